@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+"""
+基于 asyncio 的转换引擎
+一个事件循环驱动全部 ffmpeg 子进程（asyncio.create_subprocess_exec），进度和错误输出以非阻塞方式读取，
+同时运行的任务再多也不需要每个任务一个线程：
+  - 并发：总并发和每块磁盘的并发由信号量限制，排队中的任务只是等待中的协程；
+    按分片表估算输出大小并预留磁盘空间，空间不足时等同一磁盘上的任务完成
+  - 取消：取消任务时先让 ffmpeg 自行退出（SIGTERM，Windows 上为结束进程），超时再强制结束
+  - 超时：总时长超时和进度停滞超时（ffmpeg 卡住不再输出进度）
+  - 背压：写入标准输入时等待管道排空（drain）；进度只保留最新一组，由界面按自己的节奏读取，不会积压回调
+命令行通过 asyncio.run 运行（convert_m3u8_to_mp4.py --async），
+界面在后台线程中运行事件循环（start），通过 submit / cancel_all 与之交互
+"""
+
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+
+from convert_m3u8_to_mp4 import (
+    FRAGMENTED_MOVFLAGS, check_outputs, fill_playlist_stats, find_converted, finish_job_result, job_output_path,
+    new_job_result, preflight_check, run_job
+)
+from ffmpeg_progress import PROGRESS_ARGS, ProgressParser
+from hls_download import DEFAULT_WORKERS, is_url
+from hls_variants import parse_selection
+from io_scheduler import DEFAULT_MARGIN_BYTES, DiskSpaceError, device_of, estimate_sizes
+from m3u8_parser import PlaylistError
+from multi_output import (
+    MultiOutputError, build_command, commit_outputs, discard_outputs, parse_targets, plan_targets, resolve_media
+)
+from toolchain import ffmpeg_command
+
+DEFAULT_MAX_JOBS = min(8, os.cpu_count() or 1)
+# 进度停滞超过这么多秒视为 ffmpeg 卡住（正常情况下每 0.5 秒输出一组进度）
+DEFAULT_STALL_TIMEOUT = 300
+# 取消或超时后等待 ffmpeg 自行退出的秒数，超过后强制结束
+TERMINATE_GRACE = 5
+# 检查超时的间隔（秒）
+WATCHDOG_INTERVAL = 1.0
+# 读取错误输出时单行长度的上限
+STDERR_LINE_LIMIT = 1024 * 1024
+
+
+class FFmpegTimeout(Exception):
+    """ffmpeg 超时或进度停滞，已被结束"""
+
+
+@contextlib.contextmanager
+def pidfd_child_watcher():
+    """
+    在主线程中运行事件循环（asyncio.run）期间使用 PidfdChildWatcher：
+    Linux 上 Python 3.12 以前默认的子进程监视器为每个子进程启动一个线程等待其退出，
+    pidfd 由事件循环直接等待，不需要线程；Windows、3.12 起或内核不支持时不做改变
+    """
+    supported = (sys.platform != 'win32' and sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher')
+                 and threading.current_thread() is threading.main_thread())
+    if supported:
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except (AttributeError, OSError):
+            supported = False
+    if not supported:
+        yield
+        return
+    asyncio.set_child_watcher(asyncio.PidfdChildWatcher())
+    try:
+        yield
+    finally:
+        # 恢复默认的监视器（其他线程中的事件循环仍可使用子进程）
+        asyncio.set_child_watcher(None)
+
+
+async def _terminate(process):
+    """结束 ffmpeg：先请求退出，等待 TERMINATE_GRACE 秒后强制结束"""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(process.wait(), TERMINATE_GRACE)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run_in_thread(func, *args):
+    """
+    在线程池中调用 func(*args) 并返回结果
+    线程中的转换（run_job 及其中的 ffmpeg、下载）没有中途停止的接口，取消无法结束它：
+    被取消时仍等它完成并返回结果（不再抛出 CancelledError），避免 ffmpeg 在事件循环关闭后继续写输出；
+    排队中尚未开始的任务照常被取消
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    while not future.done():
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            pass
+    return future.result()
+
+
+async def run_ffmpeg_async(cmd, on_progress=None, on_stderr=None, feed=None, timeout=None, stall_timeout=None):
+    """
+    run_ffmpeg 的 asyncio 版本，返回 (返回码, 最后几行错误输出)
+    on_progress(FFmpegProgress) 和 on_stderr(line) 在事件循环中回调，不能阻塞；
+    feed 为协程函数 feed(stdin)，向 asyncio.StreamWriter 写入后 await stdin.drain()（管道满时等待），返回后关闭标准输入；
+    timeout 为总超时秒数，stall_timeout 为进度停滞的超时秒数，超时先结束 ffmpeg 再抛出 FFmpegTimeout；
+    任务被取消时同样先结束 ffmpeg 再抛出 CancelledError
+    """
+    process = await asyncio.create_subprocess_exec(
+        cmd[0], *PROGRESS_ARGS, *cmd[1:],
+        stdin=asyncio.subprocess.PIPE if feed else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STDERR_LINE_LIMIT
+    )
+    error_tail = deque(maxlen=20)
+    state = {'active': time.monotonic()}
+
+    async def read_progress():
+        parser = ProgressParser()
+        while True:
+            chunk = await process.stdout.read(4096)
+            if not chunk:
+                break
+            state['active'] = time.monotonic()
+            for progress in parser.feed(chunk):
+                if on_progress:
+                    on_progress(progress)
+
+    async def read_stderr():
+        while True:
+            raw = await process.stderr.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if line:
+                error_tail.append(line)
+                if on_stderr:
+                    on_stderr(line)
+
+    async def write_stdin():
+        try:
+            await feed(process.stdin)
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg 提前退出，错误信息以 stderr 为准
+            pass
+        finally:
+            process.stdin.close()
+
+    waiter = asyncio.ensure_future(process.wait())
+    helpers = [asyncio.ensure_future(read_progress()), asyncio.ensure_future(read_stderr())]
+    feeder = asyncio.ensure_future(write_stdin()) if feed else None
+    start = time.monotonic()
+    try:
+        while True:
+            await asyncio.wait([waiter], timeout=WATCHDOG_INTERVAL)
+            if waiter.done():
+                break
+            now = time.monotonic()
+            if timeout and now - start > timeout:
+                raise FFmpegTimeout(f"超过 {timeout:g} 秒未完成，已结束 ffmpeg")
+            if stall_timeout and now - state['active'] > stall_timeout:
+                raise FFmpegTimeout(f"{stall_timeout:g} 秒没有进度，已结束 ffmpeg")
+        # ffmpeg 退出后把剩余的输出读完
+        await asyncio.gather(*helpers)
+        if feeder:
+            # 送入数据出错时 ffmpeg 会把不完整的输入当作正常结束，以送入的异常为准
+            await feeder
+        return waiter.result(), '\n'.join(error_tail)
+    except BaseException:
+        await _terminate(process)
+        raise
+    finally:
+        pending = [task for task in [waiter, *helpers, feeder] if task and not task.done()]
+        for task in pending:
+            if task is not waiter:
+                task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class AsyncJob:
+    """
+    一个 ffmpeg 任务
+    状态和进度在事件循环中更新，其他线程（例如界面）只读取：
+    state 为 'pending'（排队）、'running'、'done'、'failed'、'timeout' 或 'cancelled'
+    """
+
+    def __init__(self, cmd, total_duration=None, feed=None, sources=(), output_path=None, estimate=0):
+        self.cmd = cmd
+        self.total_duration = total_duration
+        self.feed = feed
+        self.sources = list(sources)
+        self.output_path = output_path or cmd[-1]
+        self.estimate = estimate  # 预计写入的字节数（预留磁盘空间用）
+        self.state = 'pending'
+        self.progress = None  # 最近一组 FFmpegProgress，只保留最新的
+        self.returncode = None
+        self.error = ''
+        self.started = None
+        self.finished = None
+
+    @property
+    def ok(self):
+        return self.state == 'done'
+
+    @property
+    def devices(self):
+        return {device_of(path) for path in self.sources + [self.output_path] if not is_url(path)}
+
+    @property
+    def ratio(self):
+        """已完成的比例，总时长未知时为 None"""
+        if not self.total_duration or self.progress is None or self.progress.out_time_us is None:
+            return None
+        return min(max(self.progress.out_time_sec / self.total_duration, 0.0), 1.0)
+
+    def eta_seconds(self):
+        """预计剩余秒数：优先按 ffmpeg 报告的处理速度，其次按已用时间推算；无法估算时为 None"""
+        if self.progress is not None:
+            eta = self.progress.eta_seconds(self.total_duration)
+            if eta is not None:
+                return eta
+        ratio = self.ratio
+        if ratio and self.started:
+            return (time.time() - self.started) * (1.0 - ratio) / ratio
+        return None
+
+
+class AsyncEngine:
+    """
+    在一个事件循环中调度多个 ffmpeg 任务
+    max_jobs 为同时运行的任务数，max_per_device 为同一块磁盘上同时运行的任务数（None 不单独限制）；
+    timeout / stall_timeout 见 run_ffmpeg_async
+    """
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS, max_per_device=None, timeout=None,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT, margin_bytes=DEFAULT_MARGIN_BYTES):
+        self.max_jobs = max(1, max_jobs)
+        self.max_per_device = max_per_device
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.margin_bytes = margin_bytes
+        # 信号量在事件循环中创建（Python 3.9 及以前的信号量绑定创建时的事件循环）
+        self._slots = None
+        self._device_slots = {}
+        self._space_changed = None
+        self._reserved = {}  # 目标设备 -> 运行中的任务预留的字节数
+        self._tasks = set()
+        self._loop = None
+        self._thread = None
+
+    def _semaphores(self, devices):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_jobs)
+            self._space_changed = asyncio.Condition()
+        semaphores = []
+        if self.max_per_device:
+            # 固定按设备号顺序获取，避免两个任务互相等待
+            for dev in sorted(dev for dev in devices if dev is not None):
+                if dev not in self._device_slots:
+                    self._device_slots[dev] = asyncio.Semaphore(self.max_per_device)
+                semaphores.append(self._device_slots[dev])
+        return semaphores
+
+    async def _reserve(self, output_path, estimate):
+        """预留输出空间；空间不足时等同一磁盘上的其他任务完成，没有可等的任务时抛出 DiskSpaceError"""
+        dst = device_of(output_path)
+        while True:
+            try:
+                free = shutil.disk_usage(os.path.dirname(output_path) or '.').free
+            except OSError:
+                break
+            available = free - self._reserved.get(dst, 0) - self.margin_bytes
+            if estimate <= available:
+                break
+            if not self._reserved.get(dst):
+                raise DiskSpaceError(f"磁盘空间不足：预计需要 {estimate / (1024 * 1024):.0f} MB，"
+                                     f"可用 {max(free - self.margin_bytes, 0) / (1024 * 1024):.0f} MB")
+            async with self._space_changed:
+                await self._space_changed.wait()
+        self._reserved[dst] = self._reserved.get(dst, 0) + estimate
+        return dst
+
+    @contextlib.asynccontextmanager
+    async def slot(self, devices=(), output_path=None, estimate=0):
+        """
+        占用一个运行名额：依次等待各磁盘的名额、输出空间和总名额；
+        estimate 为预计写入 output_path 的字节数（0 不检查空间）
+        """
+        device_slots = self._semaphores(devices)
+        acquired = []
+        reserved = None
+        try:
+            for semaphore in device_slots:
+                await semaphore.acquire()
+                acquired.append(semaphore)
+            if estimate and output_path:
+                reserved = (await self._reserve(output_path, estimate),)
+            await self._slots.acquire()
+            acquired.append(self._slots)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+            if reserved:
+                self._reserved[reserved[0]] -= estimate
+                async with self._space_changed:
+                    self._space_changed.notify_all()
+
+    async def run(self, job, on_stderr=None):
+        """排队并运行一个任务，返回 job（结果在 job.state / job.error 中）；取消时结束 ffmpeg 后抛出 CancelledError"""
+
+        def update(progress):
+            job.progress = progress
+
+        try:
+            async with self.slot(job.devices, job.output_path, job.estimate):
+                job.state = 'running'
+                job.started = time.time()
+                job.returncode, job.error = await run_ffmpeg_async(
+                    job.cmd, on_progress=update, on_stderr=on_stderr, feed=job.feed,
+                    timeout=self.timeout, stall_timeout=self.stall_timeout
+                )
+                job.state = 'done' if job.returncode == 0 else 'failed'
+        except FFmpegTimeout as e:
+            job.state, job.error = 'timeout', str(e)
+        except FileNotFoundError:
+            job.state, job.error = 'failed', "找不到 ffmpeg"
+        except asyncio.CancelledError:
+            job.state, job.error = 'cancelled', "已取消"
+            raise
+        except Exception as e:
+            job.state, job.error = 'failed', str(e)
+        finally:
+            job.finished = time.time()
+        return job
+
+    async def _track(self, coro):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self._tasks.discard(task)
+
+    async def gather(self, coros, on_done=None):
+        """并发运行协程（运行名额由 run / slot 控制），按完成顺序回调 on_done(下标, 结果, 异常)，返回结果列表"""
+        tasks = [asyncio.ensure_future(self._track(coro)) for coro in coros]
+
+        async def wait_one(index, task):
+            try:
+                result, error = await task, None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result, error = None, e
+            if on_done:
+                on_done(index, result, error)
+            return result
+
+        try:
+            return await asyncio.gather(*(wait_one(i, task) for i, task in enumerate(tasks)))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # 以下供界面使用：事件循环运行在后台线程中，可从任意线程调用
+
+    def start(self):
+        """在后台线程中启动事件循环"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, coro):
+        """提交协程到后台事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self._track(coro), self._loop)
+
+    def cancel_all(self):
+        """取消全部已提交的协程，运行中的 ffmpeg 会被结束"""
+        if self._loop is None:
+            return
+
+        def cancel():
+            for task in list(self._tasks):
+                task.cancel()
+
+        self._loop.call_soon_threadsafe(cancel)
+
+    async def _shutdown(self):
+        tasks = [task for task in self._tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """取消全部任务、等待 ffmpeg 退出后停止后台事件循环"""
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(TERMINATE_GRACE + 5)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        if not self._thread.is_alive():
+            self._loop.close()
+        self._loop = None
+
+
+def plan_ffmpeg_job(input_path, output_path, specs=None, selection='best', output_args=None, ffmpeg_cmd=None):
+    """
+    本地播放列表用一个 ffmpeg 进程转换时的任务，返回 (AsyncJob, 输出目标列表)；
+    specs 为 multi_output 的输出类型（默认只输出 MP4），主播放列表按 selection 选择一路码率；
+    需要内置功能处理的（加密分片、导出全部码率、输出 .ts、无法按大小分段等）返回 None
+    """
+    if is_url(input_path) or not input_path.lower().endswith('.m3u8') or output_path.lower().endswith('.ts'):
+        return None
+    if selection == 'all':
+        return None
+    try:
+        playlist, audio_playlist = resolve_media(input_path, output_path, selection)
+        if playlist.encrypted or not playlist.segments:
+            return None
+        targets = plan_targets(output_path, specs or [('mp4', None)])
+        cmd = build_command(ffmpeg_cmd or ffmpeg_command(), playlist, audio_playlist, targets, output_args=output_args)
+    except (OSError, PlaylistError, MultiOutputError):
+        return None
+    sources = [playlist.path] + ([audio_playlist] if audio_playlist else [])
+    _, estimate = estimate_sizes(playlist.path)
+    job = AsyncJob(cmd, playlist.total_duration or None, sources=sources, output_path=output_path,
+                   estimate=estimate * len(targets))
+    return job, targets
+
+
+async def run_job_async(engine, job, default_engine='auto', default_jobs=None, output_dir=None, check=True,
+                        download_workers=DEFAULT_WORKERS, keep_download=False, history=None, force=False, verify=True,
+                        faststart=False, fragmented=False, variant='best', targets=None):
+    """
+    run_job 的 asyncio 版本，参数和返回的结果字典与 run_job 相同
+    本地播放列表用 ffmpeg 转换时由 engine 运行，不占用线程；其他情况（在线地址、加密分片、内置引擎、
+    分段/并行转换、导出全部码率等）占用 engine 的运行名额后在线程池中调用 run_job，
+    这种情况不能中途取消（见 run_in_thread），取消后会等它转换完成
+    """
+    args = (job, default_engine, default_jobs, output_dir, check, download_workers, keep_download, history, force,
+            verify, faststart, fragmented, variant, targets)
+    engine_name = job.get('engine', default_engine)
+    plan = None
+    if not is_url(job['input']) and engine_name in ('auto', 'ffmpeg'):
+        try:
+            specs = job.get('targets', targets)
+            specs = parse_targets(specs) if specs else None
+            selection = parse_selection(job.get('variant', variant))
+        except ValueError:
+            specs = selection = None
+        else:
+            output_args = FRAGMENTED_MOVFLAGS if job.get('fragmented', fragmented) else None
+            plan = await asyncio.to_thread(plan_ffmpeg_job, os.path.abspath(job['input']),
+                                           job_output_path(job, output_dir), specs, selection, output_args)
+    if plan is None:
+        output_path = job_output_path(job, output_dir)
+        devices = {device_of(output_path)}
+        estimate = 0
+        if not is_url(job['input']):
+            devices.add(device_of(job['input']))
+            _, estimate = await asyncio.to_thread(estimate_sizes, os.path.abspath(job['input']), engine_name)
+        async with engine.slot(devices, output_path, estimate):
+            return await run_in_thread(run_job, *args)
+
+    ffmpeg_job, output_targets = plan
+    input_path = os.path.abspath(job['input'])
+    output_path = ffmpeg_job.output_path
+    result = new_job_result(input_path, output_path, engine_name)
+    fingerprint = None
+    if history is not None:
+        fingerprint = await asyncio.to_thread(find_converted, history, input_path, output_path, result,
+                                              job.get('force', force), job.get('variant', variant),
+                                              job.get('targets', targets), job.get('fragmented', fragmented))
+        if result['skipped']:
+            return result
+
+    start = time.time()
+    outputs = [output_path]
+    try:
+        await asyncio.to_thread(fill_playlist_stats, ffmpeg_job.sources[0], result)
+        if job.get('check', check):
+            ok = await asyncio.to_thread(lambda: all([preflight_check(path) for path in ffmpeg_job.sources]))
+            if not ok:
+                return await asyncio.to_thread(finish_job_result, result, False, outputs, output_path, start,
+                                               history, fingerprint)
+        # ffmpeg 写入临时文件：上次中断留下的先删除，失败时上次的输出保持不变
+        await asyncio.to_thread(discard_outputs, output_targets)
+        print(f"正在转换: {input_path} -> {output_path}")
+        await engine.run(ffmpeg_job)
+        if not ffmpeg_job.ok:
+            await asyncio.to_thread(discard_outputs, output_targets)
+            result['error'] = ffmpeg_job.error or f"ffmpeg 返回码 {ffmpeg_job.returncode}"
+            print(f"转换失败: {result['error']}")
+            ok = False
+        else:
+            outputs = await asyncio.to_thread(commit_outputs, output_targets)
+            full_length = {output_path, os.path.splitext(output_path)[0] + '.m4a'}
+            if specs:
+                result['outputs'] = outputs
+                output_path = result['output'] = outputs[0] if outputs else output_path
+            ok = await asyncio.to_thread(check_outputs, outputs, full_length, result,
+                                         job.get('faststart', faststart), job.get('verify', verify))
+    except asyncio.CancelledError:
+        # 取消时 ffmpeg 已被结束，不完整的临时文件不保留
+        discard_outputs(output_targets)
+        raise
+    except Exception as e:
+        ok = False
+        result['error'] = str(e)
+    return await asyncio.to_thread(finish_job_result, result, ok, outputs, output_path, start, history, fingerprint)
+
+
+def run_batch(jobs, options, max_jobs=DEFAULT_MAX_JOBS, max_per_device=None, timeout=None,
+              stall_timeout=DEFAULT_STALL_TIMEOUT, on_done=None):
+    """
+    在一个事件循环中执行全部任务，返回结果字典列表
+    options 为传给 run_job_async 的其余参数（字典），on_done(任务, 结果, 异常) 按完成顺序回调；
+    Ctrl+C 时取消全部任务，运行中的 ffmpeg 被结束（在线程池中运行的任务会先等它完成），之后抛出 KeyboardInterrupt
+    """
+    engine = AsyncEngine(max_jobs=max_jobs, max_per_device=max_per_device, timeout=timeout,
+                         stall_timeout=stall_timeout)
+
+    def done(index, result, error):
+        if on_done:
+            on_done(jobs[index], result, error)
+
+    async def main():
+        return await engine.gather((run_job_async(engine, job, **options) for job in jobs), done)
+
+    with pidfd_child_watcher():
+        return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    # 等同于 convert_m3u8_to_mp4.py --async
+    from convert_m3u8_to_mp4 import main as convert_main
+
+    sys.exit(convert_main(['--async'] + sys.argv[1:]))
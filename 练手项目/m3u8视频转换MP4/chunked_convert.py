@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+分段转换：按分片边界把播放列表切成若干段，逐段转封装为中间 .ts 文件，
+最后用 concat 分离器无损拼接为 MP4
+
+- 断点续转：输出文件旁会生成断点清单（<输出>.resume.json）和中间文件目录（<输出>.parts），
+  转换中断后再次运行会跳过已完成的段，全部完成后自动清理
+- 并行转换：把分片列表切成 N 个连续区间，同时启动 N 个 ffmpeg 进程转封装
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg
+from m3u8_parser import load_playlist
+from toolchain import ffmpeg_command
+
+# 每段的目标时长（秒）
+DEFAULT_CHUNK_SECONDS = 300
+MANIFEST_VERSION = 1
+
+
+def plan_chunks(playlist, chunk_seconds=DEFAULT_CHUNK_SECONDS):
+    """按分片边界切段，返回 [(起始下标, 结束下标(不含), 时长), ...]"""
+    chunks = []
+    start = 0
+    duration = 0.0
+    for i, seg in enumerate(playlist.segments):
+        duration += seg.duration
+        if duration >= chunk_seconds:
+            chunks.append((start, i + 1, duration))
+            start = i + 1
+            duration = 0.0
+    if start < len(playlist.segments):
+        chunks.append((start, len(playlist.segments), duration))
+    return chunks
+
+
+def plan_ranges(playlist, count):
+    """把分片列表切成 count 个时长接近的连续区间，返回格式同 plan_chunks"""
+    segments = playlist.segments
+    count = max(1, min(count, len(segments)))
+    total = sum(seg.duration for seg in segments)
+    ranges = []
+    start = 0
+    elapsed = 0.0
+    duration = 0.0
+    for i, seg in enumerate(segments):
+        elapsed += seg.duration
+        duration += seg.duration
+        remaining_ranges = count - len(ranges) - 1
+        # 到达下一个边界，且剩余分片足够分给后面的区间
+        if (remaining_ranges > 0 and elapsed >= total * (len(ranges) + 1) / count
+                and len(segments) - (i + 1) >= remaining_ranges):
+            ranges.append((start, i + 1, duration))
+            start = i + 1
+            duration = 0.0
+    ranges.append((start, len(segments), duration))
+    return ranges
+
+
+def _format_attr_byterange(byterange):
+    length, offset = byterange
+    return f"{length}@{offset}"
+
+
+def write_chunk_playlist(playlist, start, end, path):
+    """
+    写出只包含 [start, end) 分片的子播放列表
+    分片、密钥和初始化分片都写成绝对路径，媒体序号保持不变（未指定 IV 时解密依赖序号）
+    """
+    segments = playlist.segments[start:end]
+    lines = ['#EXTM3U', f"#EXT-X-VERSION:{playlist.version or 3}"]
+    target = playlist.target_duration or max(seg.duration for seg in segments)
+    lines.append(f"#EXT-X-TARGETDURATION:{int(target + 0.999)}")
+    lines.append(f"#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence}")
+    lines.append('#EXT-X-PLAYLIST-TYPE:VOD')
+    if playlist.init_map:
+        attrs = f'URI="{playlist.init_map.path}"'
+        if playlist.init_map.byterange:
+            attrs += f',BYTERANGE="{_format_attr_byterange(playlist.init_map.byterange)}"'
+        lines.append(f"#EXT-X-MAP:{attrs}")
+    current_key = None
+    for seg in segments:
+        if seg.key != current_key:
+            if seg.key is None:
+                lines.append('#EXT-X-KEY:METHOD=NONE')
+            else:
+                key = playlist.keys[seg.key]
+                attrs = f'METHOD={key.method},URI="{key.path}"'
+                if key.iv is not None:
+                    attrs += f",IV=0x{key.iv.hex()}"
+                lines.append(f"#EXT-X-KEY:{attrs}")
+            current_key = seg.key
+        if seg.discontinuity and seg is not segments[0]:
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f"#EXTINF:{seg.duration:.6f},")
+        if seg.byterange:
+            lines.append(f"#EXT-X-BYTERANGE:{_format_attr_byterange(seg.byterange)}")
+        lines.append(seg.path)
+    lines.append('#EXT-X-ENDLIST')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def chunk_command(ffmpeg_cmd, chunk_playlist, part_path):
+    """单段转封装命令：输出 MPEG-TS 中间文件，保证后续拼接无损"""
+    return [
+        ffmpeg_cmd,
+        '-protocol_whitelist', 'file,crypto,data,http,https,tcp,tls',
+        '-allowed_extensions', 'ALL',
+        '-i', chunk_playlist,
+        '-c', 'copy',
+        '-f', 'mpegts',
+        '-y',
+        part_path
+    ]
+
+
+def convert_chunk(ffmpeg_cmd, playlist, start, end, part_path, on_progress=None):
+    """
+    把 [start, end) 分片转封装为中间文件 part_path，返回 (返回码, 错误信息)
+    先写到临时文件，成功后再改名，避免留下不完整的中间文件
+    """
+    chunk_playlist = os.path.splitext(part_path)[0] + '.m3u8'
+    write_chunk_playlist(playlist, start, end, chunk_playlist)
+    tmp_part = part_path + '.tmp'
+    try:
+        returncode, error = run_ffmpeg(
+            chunk_command(ffmpeg_cmd, chunk_playlist, tmp_part),
+            on_progress=on_progress
+        )
+        if returncode == 0:
+            os.replace(tmp_part, part_path)
+        return returncode, error
+    finally:
+        if os.path.exists(tmp_part):
+            os.remove(tmp_part)
+        os.remove(chunk_playlist)
+
+
+def concat_parts(ffmpeg_cmd, part_paths, output_path, work_dir, on_progress=None, output_args=None):
+    """用 concat 分离器把中间文件无损拼接为最终输出，返回 (返回码, 错误信息)；output_args 为额外的输出参数"""
+    list_path = os.path.join(work_dir, 'concat.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for part in part_paths:
+            escaped = os.path.abspath(part).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    tmp_output = _temp_output_path(output_path)
+    cmd = [
+        ffmpeg_cmd,
+        '-f', 'concat',
+        '-safe', '0',
+        '-i', list_path,
+        '-c', 'copy',
+        '-bsf:a', 'aac_adtstoasc',
+        *(output_args or []),
+        '-y',
+        tmp_output
+    ]
+    returncode, error = run_ffmpeg(cmd, on_progress=on_progress)
+    if returncode == 0:
+        os.replace(tmp_output, output_path)
+    elif os.path.exists(tmp_output):
+        os.remove(tmp_output)
+    return returncode, error
+
+
+def _temp_output_path(output_path):
+    """临时输出文件，保留扩展名以便 ffmpeg 识别封装格式"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.partial{ext or '.mp4'}"
+
+
+def manifest_path(output_path):
+    return output_path + '.resume.json'
+
+
+def parts_dir(output_path):
+    return output_path + '.parts'
+
+
+def _input_stamp(m3u8_path):
+    st = os.stat(m3u8_path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _save_manifest(path, manifest):
+    """先写临时文件再替换，保证中途断电也不会留下损坏的清单"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _load_manifest(m3u8_path, output_path, chunks):
+    """读取断点清单；输入文件或分段方式变化时作废"""
+    path = manifest_path(output_path)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('input') != m3u8_path
+            or manifest.get('input_stamp') != _input_stamp(m3u8_path)
+            or manifest.get('chunks') != [[c[0], c[1]] for c in chunks]):
+        return None
+    # 只保留大小与记录一致的已完成段
+    done = {}
+    for index, info in manifest.get('done', {}).items():
+        part = os.path.join(parts_dir(output_path), info['file'])
+        if os.path.isfile(part) and os.path.getsize(part) == info['size']:
+            done[index] = info
+    manifest['done'] = done
+    return manifest
+
+
+def convert_resumable(m3u8_path, output_path, ffmpeg_cmd=None,
+                      chunk_seconds=DEFAULT_CHUNK_SECONDS, on_progress=None, log=print, output_args=None):
+    """
+    可断点续转的分段转换，返回 (返回码, 错误信息)
+    on_progress(已完成时长秒, 总时长秒) 在每段的进度更新和完成时回调
+    """
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    m3u8_path = os.path.abspath(m3u8_path)
+    output_path = os.path.abspath(output_path)
+    playlist = load_playlist(m3u8_path)
+    if playlist.is_master or not playlist.segments:
+        return 1, "分段转换需要包含分片的媒体播放列表"
+
+    chunks = plan_chunks(playlist, chunk_seconds)
+    total = playlist.total_duration
+    work_dir = parts_dir(output_path)
+    os.makedirs(work_dir, exist_ok=True)
+
+    manifest = _load_manifest(m3u8_path, output_path, chunks)
+    if manifest is None:
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'input': m3u8_path,
+            'input_stamp': _input_stamp(m3u8_path),
+            'output': output_path,
+            'chunks': [[c[0], c[1]] for c in chunks],
+            'done': {},
+            'created': time.time(),
+        }
+        _save_manifest(manifest_path(output_path), manifest)
+    elif manifest['done']:
+        log(f"从断点继续：已完成 {len(manifest['done'])}/{len(chunks)} 段")
+
+    done_seconds = sum(chunks[int(i)][2] for i in manifest['done'])
+    for index, (start, end, duration) in enumerate(chunks):
+        if str(index) in manifest['done']:
+            continue
+        part_name = f"part_{index:05d}.ts"
+        part_path = os.path.join(work_dir, part_name)
+        log(f"正在转换第 {index + 1}/{len(chunks)} 段（分片 {start}~{end - 1}）")
+
+        def chunk_progress(progress, base=done_seconds):
+            if on_progress and progress.out_time_us is not None:
+                on_progress(base + min(progress.out_time_sec, duration), total)
+
+        returncode, error = convert_chunk(ffmpeg_cmd, playlist, start, end, part_path, chunk_progress)
+        if returncode != 0:
+            return returncode, error
+        manifest['done'][str(index)] = {'file': part_name, 'size': os.path.getsize(part_path)}
+        _save_manifest(manifest_path(output_path), manifest)
+        done_seconds += duration
+        if on_progress:
+            on_progress(done_seconds, total)
+
+    log("所有分段已完成，正在无损拼接...")
+    part_paths = [os.path.join(work_dir, manifest['done'][str(i)]['file']) for i in range(len(chunks))]
+    returncode, error = concat_parts(ffmpeg_cmd, part_paths, output_path, work_dir, output_args=output_args)
+    if returncode == 0:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.remove(manifest_path(output_path))
+    return returncode, error
+
+
+def convert_parallel(m3u8_path, output_path, ffmpeg_cmd=None, jobs=None, on_progress=None, log=print,
+                     output_args=None):
+    """
+    把分片列表切成 jobs 个连续区间并行转封装，再无损拼接，返回 (返回码, 错误信息)
+    on_progress(已完成时长秒, 总时长秒) 汇总所有进程的进度
+    """
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    m3u8_path = os.path.abspath(m3u8_path)
+    output_path = os.path.abspath(output_path)
+    playlist = load_playlist(m3u8_path)
+    if playlist.is_master or not playlist.segments:
+        return 1, "并行转换需要包含分片的媒体播放列表"
+
+    ranges = plan_ranges(playlist, jobs or os.cpu_count() or 1)
+    total = playlist.total_duration
+    work_dir = output_path + '.parallel'
+    os.makedirs(work_dir, exist_ok=True)
+    log(f"并行转换：{len(ranges)} 个区间，{len(playlist.segments)} 个分片")
+
+    lock = threading.Lock()
+    range_done = [0.0] * len(ranges)
+
+    def run_range(index):
+        start, end, duration = ranges[index]
+
+        def range_progress(progress):
+            if progress.out_time_us is None:
+                return
+            with lock:
+                range_done[index] = min(progress.out_time_sec, duration)
+                done = sum(range_done)
+            if on_progress:
+                on_progress(done, total)
+
+        part_path = os.path.join(work_dir, f"range_{index:03d}.ts")
+        returncode, error = convert_chunk(ffmpeg_cmd, playlist, start, end, part_path, range_progress)
+        return returncode, error, part_path
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            results = list(pool.map(run_range, range(len(ranges))))
+        for returncode, error, _ in results:
+            if returncode != 0:
+                return returncode, error
+        log("所有区间已完成，正在无损拼接...")
+        return concat_parts(ffmpeg_cmd, [r[2] for r in results], output_path, work_dir, output_args=output_args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_parallel(m3u8_path, ffmpeg_cmd=None, job_counts=(1, 2, 4, 8), log=print):
+    """
+    对比单进程 ffmpeg 与不同并行度的分段转换耗时，返回 [(并行度, 秒), ...]（并行度 0 表示单进程）
+    单进程转换失败（或找不到 ffmpeg）时无法对比，返回空列表；某个并行度失败时跳过该项
+    """
+    import tempfile
+
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    m3u8_path = os.path.abspath(m3u8_path)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'single.mp4')
+        start = time.time()
+        try:
+            subprocess.run(
+                [ffmpeg_cmd, '-v', 'error', '-i', m3u8_path, '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-y', output],
+                check=True, capture_output=True
+            )
+        except FileNotFoundError:
+            log("单进程: 失败 找不到 ffmpeg")
+            return results
+        except subprocess.CalledProcessError as e:
+            log(f"单进程: 失败 {e.stderr.decode('utf-8', errors='replace').strip() or f'返回码 {e.returncode}'}")
+            return results
+        except OSError as e:
+            log(f"单进程: 失败 {e}")
+            return results
+        single = time.time() - start
+        results.append((0, single))
+        log(f"单进程:      {single:7.2f} 秒")
+        os.remove(output)
+        for jobs in job_counts:
+            output = os.path.join(tmp, f"parallel_{jobs}.mp4")
+            start = time.time()
+            try:
+                returncode, error = convert_parallel(
+                    m3u8_path, output, ffmpeg_cmd=ffmpeg_cmd, jobs=jobs, log=lambda message: None
+                )
+            except OSError as e:
+                returncode, error = 1, str(e)
+            elapsed = time.time() - start
+            if returncode != 0:
+                log(f"并行度 {jobs}: 失败 {error}")
+                if os.path.exists(output):
+                    os.remove(output)
+                continue
+            results.append((jobs, elapsed))
+            log(f"并行度 {jobs:2d}:   {elapsed:7.2f} 秒，加速比 {single / elapsed:.2f}x")
+            os.remove(output)
+    return results
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+转换历史记录（SQLite）
+每个播放列表按内容指纹（播放列表文本 + 各分片的大小和修改时间的流式哈希）记录转换结果，
+同一内容以相同选项再次转换到同一个输出文件时，如果输出文件仍然完好就直接跳过；同时保存每个任务的耗时数据，便于估算容量
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from hls_variants import VariantError, audio_rendition, select_variants
+from m3u8_parser import PlaylistError, load_playlist
+
+# 计算指纹时读取播放列表的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    playlist_path TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    output_size INTEGER,
+    output_mtime_ns INTEGER,
+    engine TEXT,
+    status TEXT NOT NULL,
+    segments INTEGER,
+    input_bytes INTEGER,
+    duration REAL,
+    started_at REAL NOT NULL,
+    wall_time REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversions_path ON conversions (playlist_path);
+CREATE INDEX IF NOT EXISTS idx_conversions_fingerprint ON conversions (fingerprint, status);
+'''
+
+
+def default_history_file():
+    """默认历史数据库：脚本目录下 logs/history.sqlite3"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'logs', 'history.sqlite3')
+
+
+def _hash_media(digest, m3u8_path):
+    """把媒体播放列表的文本和每个本地分片的大小、修改时间加入哈希（不读取分片内容）"""
+    with open(m3u8_path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    playlist = load_playlist(m3u8_path)
+    if not playlist.is_master:
+        for seg in playlist.segments:
+            if '://' in seg.path:
+                continue
+            try:
+                st = os.stat(seg.path)
+                digest.update(f"\n{st.st_size}:{st.st_mtime_ns}".encode())
+            except OSError:
+                digest.update(b"\nmissing")
+    return playlist
+
+
+def playlist_fingerprint(m3u8_path, selection='best', options=None):
+    """
+    播放列表的内容指纹（十六进制字符串）
+    流式哈希播放列表文件，再加上每个本地分片的大小和修改时间（不读取分片内容）；
+    主播放列表还包括按 selection（见 hls_variants.parse_selection）选中的各路码率及其单独音轨，
+    重新下载后码率的分片有变化时不会被当作已转换过；
+    options 为影响输出内容的转换选项（例如分片 MP4、多输出），不同选项的转换结果互不通用
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    playlist = _hash_media(digest, m3u8_path)
+    if options:
+        digest.update(f"\noptions:{options}".encode())
+    if playlist.is_master:
+        digest.update(f"\nselection:{selection}".encode())
+        try:
+            variants = select_variants(playlist, selection)
+        except VariantError:
+            variants = []
+        for variant in variants:
+            audio = audio_rendition(playlist, variant)
+            for path in [variant.path] + ([audio.path] if audio else []):
+                if '://' in path:
+                    continue
+                try:
+                    _hash_media(digest, path)
+                except (OSError, PlaylistError):
+                    digest.update(b"\nmissing")
+    return digest.hexdigest()
+
+
+class HistoryRecord:
+    """一条成功的转换记录"""
+
+    def __init__(self, row):
+        (self.id, self.playlist_path, self.fingerprint, self.output_path, self.output_size,
+         self.output_mtime_ns, self.engine, self.status, self.segments, self.input_bytes,
+         self.duration, self.started_at, self.wall_time, self.error) = row
+
+    def output_intact(self):
+        """输出文件仍然存在且大小与记录一致"""
+        try:
+            return os.path.getsize(self.output_path) == self.output_size
+        except OSError:
+            return False
+
+
+class ConversionHistory:
+    """转换历史数据库，可在多个线程中共用"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_history_file()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def find_converted(self, fingerprint, output_path):
+        """返回该指纹转换到 output_path 的最近一次成功且输出仍完好的记录，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM conversions WHERE fingerprint = ? AND output_path = ? AND status = 'ok' "
+                "ORDER BY id DESC LIMIT 1",
+                (fingerprint, os.path.abspath(output_path))
+            ).fetchone()
+        if row is None:
+            return None
+        record = HistoryRecord(row)
+        return record if record.output_intact() else None
+
+    def history_for(self, playlist_path):
+        """某个播放列表路径的全部记录（新的在前）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM conversions WHERE playlist_path = ? ORDER BY id DESC",
+                (os.path.abspath(playlist_path),)
+            ).fetchall()
+        return [HistoryRecord(row) for row in rows]
+
+    def record(self, playlist_path, fingerprint, output_path, ok, engine=None, started_at=None,
+               wall_time=None, segments=None, input_bytes=None, duration=None, error=None):
+        """记录一次转换（成功时同时记下输出文件的大小和修改时间）"""
+        output_size = output_mtime_ns = None
+        if ok:
+            try:
+                st = os.stat(output_path)
+                output_size, output_mtime_ns = st.st_size, st.st_mtime_ns
+            except OSError:
+                ok = False
+                error = error or '输出文件不存在'
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversions (playlist_path, fingerprint, output_path, output_size, output_mtime_ns, "
+                "engine, status, segments, input_bytes, duration, started_at, wall_time, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(playlist_path), fingerprint, os.path.abspath(output_path), output_size,
+                 output_mtime_ns, engine, 'ok' if ok else 'failed', segments, input_bytes, duration,
+                 started_at or time.time(), wall_time, error)
+            )
+            self._conn.commit()
+
+    def stats(self, since=None):
+        """
+        按引擎汇总耗时数据，返回 [(引擎, 成功数, 失败数, 输入字节数, 总时长秒, 总耗时秒, 平均 MB/s), ...]
+        since 为起始时间戳，None 表示全部
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT COALESCE(engine, ''), "
+                "SUM(status = 'ok'), SUM(status != 'ok'), "
+                "SUM(CASE WHEN status = 'ok' THEN input_bytes ELSE 0 END), "
+                "SUM(CASE WHEN status = 'ok' THEN duration ELSE 0 END), "
+                "SUM(CASE WHEN status = 'ok' THEN wall_time ELSE 0 END) "
+                "FROM conversions WHERE started_at >= ? GROUP BY COALESCE(engine, '') ORDER BY 1",
+                (since or 0,)
+            ).fetchall()
+        result = []
+        for engine, ok, failed, input_bytes, duration, wall in rows:
+            input_bytes, duration, wall = input_bytes or 0, duration or 0.0, wall or 0.0
+            speed = input_bytes / (1024 * 1024) / wall if wall > 0 else 0.0
+            result.append((engine, ok, failed, input_bytes, duration, wall, speed))
+        return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def playlist_summary(m3u8_path):
+    """(分片数, 本地分片总字节数, 总时长)，用于历史记录"""
+    playlist = load_playlist(m3u8_path)
+    if playlist.is_master:
+        return None, None, None
+    input_bytes = 0
+    for seg in playlist.segments:
+        if '://' not in seg.path:
+            try:
+                input_bytes += os.path.getsize(seg.path)
+            except OSError:
+                pass
+    return len(playlist.segments), input_bytes, playlist.total_duration
+
+
+if __name__ == '__main__':
+    history = ConversionHistory(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"历史记录: {history.db_path}")
+    print(f"{'引擎':<16}{'成功':>6}{'失败':>6}{'输入 MB':>12}{'视频时长(时)':>14}{'耗时(分)':>10}{'MB/s':>8}")
+    for engine, ok, failed, input_bytes, duration, wall, speed in history.stats():
+        print(f"{engine or '-':<16}{ok:>6}{failed:>6}{input_bytes / (1024 * 1024):>12.1f}"
+              f"{duration / 3600:>14.2f}{wall / 60:>10.1f}{speed:>8.1f}")
+    history.close()
@@ -6,21 +6,271 @@
 或者使用 subprocess 直接调用 ffmpeg
 """
 
+import argparse
+import contextlib
+import glob
+import json
 import os
+import shutil
 import subprocess
 import sys
+import threading
+import time
 
-def convert_m3u8_to_mp4(m3u8_path, output_path):
+from chunked_convert import benchmark_parallel, convert_parallel, convert_resumable
+from conversion_history import ConversionHistory, playlist_fingerprint, playlist_summary
+from fast_copy import CopyStats, append_file
+from hls_download import DEFAULT_WORKERS, download_hls, is_url, url_output_name
+from hls_variants import export_variants, master_plan, parse_selection
+from io_scheduler import DEFAULT_PER_DEVICE, IOScheduler, ScheduledTask
+from m3u8_parser import PlaylistError, load_playlist
+from mp4_faststart import faststart as faststart_mp4
+from mp4_verify import is_mp4_path, verify_mp4
+from multi_output import convert_multi, parse_targets
+from segment_check import scan_playlist
+from stream_pipeline import pipeline_convert
+from toolchain import ffmpeg_command
+
+# 分片 MP4：moov 写在开头，随后是 moof + mdat，边写边可播放，不需要再前置 moov
+FRAGMENTED_MOVFLAGS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+
+
+def parse_ts_segments(m3u8_path):
+    """
+    解析媒体播放列表，返回 .ts 分片的绝对路径列表
+    遇到加密、fMP4（EXT-X-MAP）、字节范围、远程地址或主播放列表时返回 None，
+    这些情况需要交给 ffmpeg 处理
+    """
+    try:
+        playlist = load_playlist(m3u8_path)
+    except (OSError, ValueError, PlaylistError):
+        return None
+    if playlist.is_master or playlist.encrypted or playlist.init_map:
+        return None
+    segments = []
+    for seg in playlist.segments:
+        if seg.byterange or '://' in seg.path or not seg.path.lower().endswith('.ts'):
+            return None
+        segments.append(seg.path)
+    return segments or None
+
+
+def concat_ts_segments(m3u8_path, output_path):
+    """
+    不启动 ffmpeg，直接把未加密的 .ts 分片按顺序拼接为一个 .ts 文件
+    与分片在同一文件系统时优先 reflink 共享数据块，其次在内核中复制（copy_file_range），不经过用户态缓冲区
+    返回 True/False，并打印吞吐量（MB/s）
+    """
+    m3u8_abs_path = os.path.abspath(m3u8_path)
+    segments = parse_ts_segments(m3u8_abs_path)
+    if not segments:
+        print("错误：播放列表不是本地未加密的 .ts 分片，无法原生拼接")
+        return False
+
+    missing = [seg for seg in segments if not os.path.isfile(seg)]
+    if missing:
+        print(f"错误：缺少 {len(missing)} 个分片，例如 {missing[0]}")
+        return False
+
+    print(f"正在原生拼接: {m3u8_abs_path} -> {output_path} ({len(segments)} 个分片)")
+    start = time.time()
+    total = 0
+    stats = CopyStats()
+    try:
+        with open(output_path, 'wb') as dst:
+            for seg in segments:
+                with open(seg, 'rb') as src:
+                    total += append_file(src, dst, os.fstat(src.fileno()).st_size, stats)
+    except OSError as e:
+        print(f"拼接失败: {e}")
+        return False
+
+    elapsed = max(time.time() - start, 1e-6)
+    size_mb = total / (1024 * 1024)
+    print(f"拼接成功！{size_mb:.2f} MB，用时 {elapsed:.2f} 秒，{size_mb / elapsed:.1f} MB/s（{stats.summary()}）")
+    return True
+
+
+def remux_m3u8_to_mp4(m3u8_path, output_path):
+    """
+    使用内置引擎把本地 .ts 分片转封装为 MP4（H.264 + AAC），不启动 ffmpeg
+    """
+    from ts_remux import RemuxError, remux_ts_to_mp4
+
+    segments = parse_ts_segments(m3u8_path)
+    if not segments:
+        print("错误：播放列表不是本地未加密的 .ts 分片，无法使用内置引擎")
+        return False
+
+    print(f"正在转封装（内置引擎）: {m3u8_path} -> {output_path}")
+    start = time.time()
+    try:
+        bytes_in, bytes_out = remux_ts_to_mp4(segments, output_path)
+    except (OSError, RemuxError) as e:
+        print(f"转换失败: {e}")
+        return False
+
+    elapsed = max(time.time() - start, 1e-6)
+    size_mb = bytes_in / (1024 * 1024)
+    print(f"转换成功！输入 {size_mb:.2f} MB，输出 {bytes_out / (1024 * 1024):.2f} MB，"
+          f"用时 {elapsed:.2f} 秒，{size_mb / elapsed:.1f} MB/s")
+    return True
+
+
+def chunked_convert_m3u8_to_mp4(m3u8_path, output_path, jobs=None, output_args=None):
+    """
+    分段转换 m3u8
+    jobs 为空时逐段转换，断点记录在 <输出>.resume.json，中断后重新运行会从上次完成的段继续；
+    jobs 为整数时把分片列表切成 jobs 个连续区间，并行启动多个 ffmpeg 转换后无损拼接
+    """
+    try:
+        if jobs:
+            print(f"正在并行转换（{jobs} 个进程）: {m3u8_path} -> {output_path}")
+            returncode, error = convert_parallel(m3u8_path, output_path, jobs=jobs, output_args=output_args)
+        else:
+            print(f"正在分段转换（可断点续转）: {m3u8_path} -> {output_path}")
+            returncode, error = convert_resumable(m3u8_path, output_path, output_args=output_args)
+    except FileNotFoundError:
+        print("错误：找不到 ffmpeg。请先安装 ffmpeg。")
+        return False
+    except (OSError, ValueError, PlaylistError) as e:
+        print(f"转换失败: {e}")
+        return False
+    if returncode == 0:
+        print("转换成功！")
+        return True
+    print(f"转换失败 (返回码: {returncode})")
+    if error:
+        print(f"错误信息: {error}")
+    return False
+
+
+def pipeline_m3u8_to_mp4(source, output_path, muxer='ffmpeg', workers=DEFAULT_WORKERS, output_args=None):
+    """
+    边下载边转封装：分片并发读取或下载（加密分片同时解密），按顺序写入 ffmpeg 标准输入
+    （muxer='native' 时使用内置引擎，'ts' 时直接拼接），source 可以是本地播放列表或 http(s) 地址
+    """
+    print(f"正在边下载边转换: {source} -> {output_path}")
+    returncode, error = pipeline_convert(source, output_path, muxer=muxer, workers=workers, output_args=output_args)
+    if returncode == 0:
+        print("转换成功！")
+        return True
+    print(f"转换失败 (返回码: {returncode})")
+    if error:
+        print(f"错误信息: {error}")
+    return False
+
+
+def is_encrypted(m3u8_path):
+    """媒体播放列表的分片是否有 AES-128 加密（#EXT-X-KEY）；主播放列表或无法读取时返回 False"""
+    try:
+        playlist = load_playlist(m3u8_path)
+    except (OSError, PlaylistError):
+        return False
+    return not playlist.is_master and playlist.encrypted
+
+
+def preflight_check(m3u8_path):
+    """
+    转换前检查分片完整性，有缺失或损坏的分片时打印明细并返回 False
+    播放列表中有无法解析的标签时跳过检查，交给 ffmpeg 处理（ffmpeg 能容忍大部分这类问题）
+    """
+    try:
+        report = scan_playlist(m3u8_path)
+    except PlaylistError as e:
+        print(f"跳过分片检查: {e}")
+        return True
+    except OSError as e:
+        print(f"分片检查失败: {e}")
+        return False
+    print(report.summary())
+    for line in report.lines():
+        print(line)
+    return report.ok
+
+
+def convert_m3u8_to_mp4(m3u8_path, output_path, engine='auto', jobs=None, check=True,
+                        download_workers=DEFAULT_WORKERS, fragmented=False, variant='best'):
     """
     使用 ffmpeg 将 m3u8 转换为 MP4
+    engine: 'ffmpeg' 始终调用 ffmpeg；'native' 直接拼接 .ts 分片；
+            'remux' 使用内置引擎（ts_remux）转封装为分片 MP4，不启动 ffmpeg；
+            'resume' 按分片边界分段转换，记录断点清单，中断后再次运行从上次完成的段继续；
+            'parallel' 把分片切成 jobs 个区间并行转换（默认为 CPU 核数）；
+            'pipeline' / 'pipeline-remux' 边下载（或读取）边写入 ffmpeg / 内置引擎，m3u8_path 可以是 http(s) 地址；
+            'auto' 在输出为 .ts 且播放列表是本地未加密 .ts 分片时使用原生拼接
+    check: 转换前先检查分片是否缺失、为空或损坏，有问题时不启动转换
+    fragmented: 调用 ffmpeg 的引擎输出分片 MP4（moov 在开头，无需再前置；内置引擎始终输出分片 MP4）
+    variant: 输入为主播放列表时选择的码率：'best'、'all'（每一路各输出一个文件）或码率（bps）
     """
+    output_args = FRAGMENTED_MOVFLAGS if fragmented else None
+    if engine in ('pipeline', 'pipeline-remux') and is_url(m3u8_path):
+        return pipeline_m3u8_to_mp4(m3u8_path, output_path,
+                                    muxer='native' if engine == 'pipeline-remux' else 'ffmpeg',
+                                    workers=download_workers, output_args=output_args)
+
+    # 在线地址（例如主播放列表中的远程码率）没有本地文件可检查：ffmpeg 直接读取，
+    # 需要本地分片的引擎改为边下载边转换
+    remote = is_url(m3u8_path)
+    if remote and engine in ('native', 'remux', 'resume', 'parallel'):
+        muxer = {'native': 'ts', 'remux': 'native'}.get(engine, 'ffmpeg')
+        return pipeline_m3u8_to_mp4(m3u8_path, output_path, muxer=muxer, workers=download_workers,
+                                    output_args=output_args)
+
     # 获取 m3u8 文件的绝对路径
-    m3u8_abs_path = os.path.abspath(m3u8_path)
+    m3u8_abs_path = m3u8_path if remote else os.path.abspath(m3u8_path)
     
     # 检查 m3u8 文件是否存在
-    if not os.path.exists(m3u8_abs_path):
+    if not remote and not os.path.exists(m3u8_abs_path):
         print(f"错误：找不到文件 {m3u8_abs_path}")
         return False
+
+    # 主播放列表：按选择的码率转换，而不是让 ffmpeg 自行挑选
+    tasks = None if remote else master_plan(m3u8_abs_path, output_path, variant)
+    if tasks is not None:
+        if len(tasks) == 1 and tasks[0].audio is None:
+            print(f"主播放列表：选择码率 {tasks[0].label}")
+            return convert_m3u8_to_mp4(tasks[0].variant.path, output_path, engine=engine, jobs=jobs, check=check,
+                                       download_workers=download_workers, fragmented=fragmented)
+        # 音频在单独音轨中或导出多路时交给 ffmpeg 合并，共用的音轨只解复用一次
+        sources = [t.variant.path for t in tasks] + [t.audio.path for t in tasks if t.audio]
+        if check and not all(preflight_check(path) for path in dict.fromkeys(sources) if not is_url(path)):
+            return False
+        returncode, error, _ = export_variants(m3u8_abs_path, output_path, variant, output_args=output_args)
+        if returncode != 0:
+            print(f"转换失败: {error}")
+        return returncode == 0
+
+    if check and not remote and not preflight_check(m3u8_abs_path):
+        return False
+
+    # AES-128 加密的播放列表由内置解密处理，不依赖 ffmpeg 解析密钥地址（本地或相对路径的密钥会失败）
+    if not remote and engine in ('auto', 'ffmpeg', 'native', 'remux') and is_encrypted(m3u8_abs_path):
+        if engine == 'native' or output_path.lower().endswith('.ts'):
+            muxer = 'ts'
+        else:
+            muxer = 'native' if engine == 'remux' else 'ffmpeg'
+        print("检测到 AES-128 加密分片，使用内置解密")
+        return pipeline_m3u8_to_mp4(m3u8_abs_path, output_path, muxer=muxer, workers=download_workers,
+                                    output_args=output_args)
+    
+    # 输出 .ts 时不需要转封装，直接拼接分片即可，省去 ffmpeg 启动和解复用开销
+    if engine == 'native' or (
+            engine == 'auto'
+            and output_path.lower().endswith('.ts')
+            and parse_ts_segments(m3u8_abs_path)):
+        return concat_ts_segments(m3u8_abs_path, output_path)
+    if engine == 'remux':
+        return remux_m3u8_to_mp4(m3u8_abs_path, output_path)
+    if engine in ('pipeline', 'pipeline-remux'):
+        return pipeline_m3u8_to_mp4(m3u8_abs_path, output_path,
+                                    muxer='native' if engine == 'pipeline-remux' else 'ffmpeg',
+                                    workers=download_workers, output_args=output_args)
+    if engine == 'resume':
+        return chunked_convert_m3u8_to_mp4(m3u8_abs_path, output_path, output_args=output_args)
+    if engine == 'parallel':
+        return chunked_convert_m3u8_to_mp4(m3u8_abs_path, output_path, jobs=jobs or os.cpu_count() or 1,
+                                           output_args=output_args)
     
     # 构建 ffmpeg 命令
     # -i: 输入文件
@@ -28,10 +278,11 @@ def convert_m3u8_to_mp4(m3u8_path, output_path):
     # -bsf:a aac_adtstoasc: 处理音频流（如果需要）
     # -y: 覆盖输出文件（如果存在）
     cmd = [
-        'ffmpeg',
+        ffmpeg_command(),
         '-i', m3u8_abs_path,
         '-c', 'copy',
         '-bsf:a', 'aac_adtstoasc',
+        *(output_args or []),
         '-y',  # 覆盖输出文件
         output_path
     ]
@@ -64,18 +315,400 @@ def convert_m3u8_to_mp4(m3u8_path, output_path):
         print("  - 或下载后解压，将 bin 目录添加到 PATH")
         return False
 
-if __name__ == '__main__':
-    # 默认路径
-    m3u8_file = r'ed2db3d.comvideo122722.m3u8\index.m3u8'
-    output_file = 'output.mp4'
-    
-    # 如果提供了命令行参数，使用参数
-    if len(sys.argv) > 1:
-        m3u8_file = sys.argv[1]
-    if len(sys.argv) > 2:
-        output_file = sys.argv[2]
-    
-    success = convert_m3u8_to_mp4(m3u8_file, output_file)
-    sys.exit(0 if success else 1)
+
+def default_output_path(m3u8_path, output_dir=None):
+    """
+    默认输出路径：index.m3u8 以所在文件夹命名并保存在父目录（与 GUI 选择文件夹时一致），
+    其他文件与播放列表同名；指定 output_dir 时保存到该目录
+    """
+    m3u8_path = os.path.abspath(m3u8_path)
+    folder = os.path.dirname(m3u8_path)
+    if os.path.basename(m3u8_path).lower() == 'index.m3u8':
+        name = os.path.basename(folder)
+        if name.lower().endswith('.m3u8'):
+            name = name[:-5]
+        output = os.path.join(os.path.dirname(folder), f"{name}.mp4")
+    else:
+        output = os.path.splitext(m3u8_path)[0] + '.mp4'
+    if output_dir:
+        output = os.path.join(output_dir, os.path.basename(output))
+    return output
+
+
+def expand_inputs(patterns):
+    """展开输入：支持通配符（含 **）和文件夹（递归查找 .m3u8）"""
+    paths = []
+    for pattern in patterns:
+        if is_url(pattern):
+            paths.append(pattern)
+            continue
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.m3u8'))
+            else:
+                paths.append(path)
+    return paths
+
+
+def load_job_file(path):
+    """
+    读取任务文件：.jsonl 每行一个任务，.json 为任务数组或 {"jobs": [...]}
+    任务格式: {"input": "...", "output": "...", "engine": "auto", "jobs": 4}，input 以外均可省略
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith('.jsonl'):
+            jobs = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            jobs = data.get('jobs', []) if isinstance(data, dict) else data
+    for job in jobs:
+        if not isinstance(job, dict) or 'input' not in job:
+            raise ValueError(f"任务缺少 input 字段: {job}")
+    return jobs
+
+
+def job_output_path(job, output_dir=None):
+    """任务的输出文件绝对路径：未指定 output 时按输入生成默认文件名"""
+    output_path = job.get('output')
+    if not output_path:
+        if is_url(job['input']):
+            output_path = os.path.join(output_dir or os.getcwd(), url_output_name(job['input']))
+        else:
+            output_path = default_output_path(job['input'], output_dir)
+    return os.path.abspath(output_path)
+
+
+def fill_playlist_stats(m3u8_path, result):
+    """把播放列表的分片数、总时长和本地分片总字节数填入结果"""
+    try:
+        segments, input_bytes, duration = playlist_summary(m3u8_path)
+    except (OSError, ValueError, PlaylistError):
+        return
+    if duration is not None:
+        result['segments'] = segments
+        result['duration'] = round(duration, 3)
+        result['input_bytes'] = input_bytes
+
+
+def new_job_result(input_path, output_path, engine):
+    """任务结果字典的初始内容"""
+    return {
+        'input': input_path,
+        'output': output_path,
+        'engine': engine,
+        'ok': False,
+        'duration': None,
+        'bytes': None,
+        'input_bytes': None,
+        'wall_time': None,
+        'throughput_mbps': None,
+        'download_mbps': None,
+        'segments': None,
+        'skipped': False,
+        'verified': None,
+        'error': None,
+    }
+
+
+def find_converted(history, input_path, output_path, result, force=False, variant='best', targets=None,
+                   fragmented=False):
+    """
+    查询转换历史，返回内容指纹；内容和选项与已成功转换到 output_path 的一致且输出完好时（force 为 False）
+    把结果标记为跳过。主播放列表按 variant 选中的码率计算指纹，targets 和 fragmented 一并计入指纹；
+    多个输出（targets 或导出全部码率）时历史只记录第一个输出，无法确认全部完好，始终重新转换
+    """
+    try:
+        selection = parse_selection(variant)
+        options = ';'.join(filter(None, [f"targets={targets}" if targets else '', 'fragmented' if fragmented else '']))
+        fingerprint = playlist_fingerprint(input_path, selection, options)
+    except (OSError, PlaylistError, ValueError):
+        return None
+    multiple = bool(targets) or selection == 'all'
+    done = history.find_converted(fingerprint, output_path) if fingerprint and not force and not multiple else None
+    if done:
+        print(f"已转换过，跳过: {input_path} -> {done.output_path}")
+        result.update(ok=True, skipped=True, output=done.output_path, bytes=done.output_size,
+                      duration=done.duration, input_bytes=done.input_bytes, segments=done.segments)
+    return fingerprint
 
 
+def check_outputs(outputs, full_length, result, faststart=False, verify=True):
+    """
+    按需前置 moov 并校验各输出，返回是否全部通过；full_length 中的输出还要检查时长与播放列表一致
+    （按大小分段的每一段只校验结构），校验失败的原因写入 result['error']
+    """
+    ok = True
+    for path in outputs:
+        if faststart and is_mp4_path(path):
+            print(faststart_mp4(path).summary())
+        if verify and is_mp4_path(path):
+            report = verify_mp4(path, result['duration'] if path in full_length else None)
+            print(report.summary())
+            result['verified'] = report.ok
+            if not report.ok:
+                ok = False
+                result['error'] = '输出校验失败：' + '；'.join(report.problems)
+    return ok
+
+
+def finish_job_result(result, ok, outputs, output_path, start, history=None, fingerprint=None):
+    """填入耗时、输出大小和吞吐量，写入转换历史"""
+    wall = time.time() - start
+    result['ok'] = bool(ok)
+    result['wall_time'] = round(wall, 3)
+    if ok and os.path.exists(output_path):
+        result['bytes'] = sum(os.path.getsize(path) for path in outputs if os.path.exists(path))
+        size = result['input_bytes'] or result['bytes']
+        result['throughput_mbps'] = round(size / (1024 * 1024) / max(wall, 1e-6), 2)
+    elif not result['error']:
+        result['error'] = '转换失败'
+    if fingerprint:
+        history.record(result['input'], fingerprint, output_path, result['ok'], engine=result['engine'],
+                       started_at=start, wall_time=wall, segments=result['segments'],
+                       input_bytes=result['input_bytes'], duration=result['duration'], error=result['error'])
+    return result
+
+
+def run_job(job, default_engine='auto', default_jobs=None, output_dir=None, check=True,
+            download_workers=DEFAULT_WORKERS, keep_download=False, history=None, force=False, verify=True,
+            faststart=False, fragmented=False, variant='best', targets=None):
+    """
+    执行一个任务，返回结果字典（可直接序列化为 JSON）
+    input 为 http(s) 地址时先下载到输出文件旁的 <输出>.download 目录，转换成功后删除；
+    pipeline 引擎不落盘，边下载边转换；
+    history 为 ConversionHistory 时，本地播放列表内容与已成功转换过的一致且输出完好则跳过（force 强制重新转换），
+    转换结果和耗时写入历史记录；
+    faststart 为 True 时把 MP4 的 moov 原地移到文件开头，fragmented 为 True 时直接输出分片 MP4；
+    variant 为主播放列表的码率选择，'all' 时结果的 outputs 为各码率的输出文件；
+    targets 为一次读取写出多个输出（例如 'mp4,m4a,split:2G'，见 multi_output），结果的 outputs 为全部输出文件；
+    verify 为 True 时校验 MP4 输出（box 结构、moov/mdat、时长与 #EXTINF 总时长一致），不通过按失败处理
+    """
+    remote = is_url(job['input'])
+    input_path = job['input'] if remote else os.path.abspath(job['input'])
+    output_path = job_output_path(job, output_dir)
+    engine = job.get('engine', default_engine)
+    result = new_job_result(input_path, output_path, engine)
+
+    fingerprint = None
+    if history is not None and not remote:
+        fingerprint = find_converted(history, input_path, output_path, result, job.get('force', force),
+                                     job.get('variant', variant), job.get('targets', targets),
+                                     job.get('fragmented', fragmented))
+        if result['skipped']:
+            return result
+
+    start = time.time()
+    outputs = [output_path]
+    try:
+        workers = job.get('download_workers', download_workers)
+        specs = job.get('targets', targets)
+        specs = parse_targets(specs) if specs else None
+        # 多个输出按大小分段需要分片大小，在线地址始终先下载
+        streamed = engine.startswith('pipeline') and not specs
+        if remote and not streamed:
+            download_dir = os.path.splitext(output_path)[0] + '.download'
+            downloaded = download_hls(input_path, download_dir, workers=workers)
+            result['download_mbps'] = round(downloaded.speed_mbps, 2)
+            input_path = downloaded.playlist_path
+        selection = parse_selection(job.get('variant', variant))
+        if not is_url(input_path):
+            # 主播放列表的时长等统计取自选中的（第一路）码率
+            tasks = master_plan(input_path, output_path, selection)
+            if tasks:
+                outputs = [task.output_path for task in tasks]
+            fill_playlist_stats(tasks[0].variant.path if tasks else input_path, result)
+        if specs:
+            # 多个输出只读取一遍分片，不经过 engine 选择的引擎
+            sources = [input_path]
+            if tasks:
+                sources = [tasks[0].variant.path] + ([tasks[0].audio.path] if tasks[0].audio else [])
+            ok = not job.get('check', check) or all(preflight_check(path) for path in sources if not is_url(path))
+            if ok:
+                returncode, error, outputs = convert_multi(
+                    input_path, output_path, specs, selection=selection, workers=workers,
+                    output_args=FRAGMENTED_MOVFLAGS if job.get('fragmented', fragmented) else None)
+                ok = returncode == 0
+                if not ok:
+                    print(f"转换失败: {error}")
+                    result['error'] = error
+        else:
+            ok = convert_m3u8_to_mp4(input_path, output_path, engine=engine, jobs=job.get('jobs', default_jobs),
+                                     check=job.get('check', check), download_workers=workers,
+                                     fragmented=job.get('fragmented', fragmented), variant=selection)
+        # 按大小分段的每一段只校验结构，不比较总时长
+        full_length = {output_path, os.path.splitext(output_path)[0] + '.m4a'} if specs else set(outputs)
+        if len(outputs) > 1 or specs:
+            result['outputs'] = outputs
+            output_path = outputs[0] if outputs else output_path
+            if specs:
+                result['output'] = output_path
+        # 清理下载的分片之前先确认输出完整
+        ok = ok and check_outputs(outputs, full_length, result, job.get('faststart', faststart),
+                                  job.get('verify', verify))
+        if ok and remote and not keep_download and not streamed:
+            shutil.rmtree(download_dir, ignore_errors=True)
+    except Exception as e:
+        ok = False
+        result['error'] = str(e)
+    return finish_job_result(result, ok, outputs, output_path, start, history, fingerprint)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="将 m3u8 转换为 MP4（支持批量、通配符和 JSON 任务文件）"
+    )
+    parser.add_argument('inputs', nargs='*', help="m3u8 文件、http(s) 地址、文件夹或通配符；只给一个输入时第二个参数可作为输出文件")
+    parser.add_argument('-o', '--output', help="输出文件（仅单个输入时有效）")
+    parser.add_argument('--output-dir', help="输出目录（默认与输入相邻）")
+    parser.add_argument('--job-file', action='append', default=[], help="JSON 或 JSONL 任务文件，可多次指定")
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help="同时执行的任务数上限（默认 1）")
+    parser.add_argument('--per-device', type=int, default=DEFAULT_PER_DEVICE,
+                        help=f"同一块磁盘上同时执行的任务数上限（默认 {DEFAULT_PER_DEVICE}）")
+    parser.add_argument('--no-adaptive', action='store_true',
+                        help="不根据实测吞吐量调整每块磁盘的并发数（直接使用 --per-device）")
+    parser.add_argument('--engine', default='auto',
+                        choices=['auto', 'ffmpeg', 'native', 'remux', 'resume', 'parallel', 'pipeline', 'pipeline-remux'],
+                        help="转换引擎（默认 auto）")
+    parser.add_argument('--resume', action='store_true', help="分段转换，可断点续转（等同 --engine resume）")
+    parser.add_argument('--jobs', type=int, help="单个任务切成 N 个区间并行转换（等同 --engine parallel）")
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"输入为 http(s) 地址时并发下载的分片数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument('--keep-download', action='store_true', help="转换成功后保留下载的分片")
+    parser.add_argument('--force', action='store_true', help="即使历史记录显示已转换过也重新转换")
+    parser.add_argument('--no-history', action='store_true', help="不读写转换历史记录")
+    parser.add_argument('--no-check', action='store_true', help="跳过转换前的分片完整性检查")
+    parser.add_argument('--no-verify', action='store_true', help="跳过转换后的 MP4 输出校验")
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--faststart', action='store_true',
+                        help="转换后把 moov 原地移到文件开头（便于网页边下边播，不需要 ffmpeg 再处理一遍）")
+    layout.add_argument('--fragmented', action='store_true',
+                        help="输出分片 MP4（moov 在开头，无需前置）")
+    parser.add_argument('--variant', default='best', type=parse_selection,
+                        help="输入为主播放列表时选择的码率：best（默认，最高码率）、all（每一路各输出一个文件）"
+                             "或码率，例如 2500k（不超过该码率的最高一路）")
+    parser.add_argument('--targets', type=parse_targets,
+                        help="一次读取写出多个输出，逗号分隔：mp4（音视频）、m4a（纯音频）、split:大小（按大小分段，"
+                             "例如 split:2G）；例如 mp4,m4a,split:2G")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="全部任务由一个 asyncio 事件循环驱动（async_engine），不为每个任务启动线程，适合大量并发任务")
+    parser.add_argument('--timeout', type=float, help="--async 时单个 ffmpeg 的总超时秒数（默认不限）")
+    parser.add_argument('--stall-timeout', type=float, default=300,
+                        help="--async 时 ffmpeg 多少秒没有进度视为卡住并结束（默认 300，0 不检查）")
+    parser.add_argument('--benchmark', action='store_true', help="对比单进程与不同并行度的耗时")
+    parser.add_argument('--json', action='store_true', help="每个任务输出一行 JSON 结果，其余信息输出到 stderr")
+    args = parser.parse_args(argv)
+
+    engine = args.engine
+    if args.resume:
+        engine = 'resume'
+    elif args.jobs and engine == 'auto':
+        engine = 'parallel'
+
+    inputs = list(args.inputs)
+    output = args.output
+    # 兼容旧用法: convert_m3u8_to_mp4.py 输入.m3u8 输出.mp4
+    if (not output and len(inputs) == 2 and not inputs[1].lower().endswith('.m3u8')
+            and not is_url(inputs[1]) and not glob.has_magic(inputs[1]) and not os.path.isdir(inputs[1])):
+        output = inputs.pop()
+
+    jobs = [{'input': path} for path in expand_inputs(inputs)]
+    for job_file in args.job_file:
+        jobs.extend(load_job_file(job_file))
+    if not jobs:
+        parser.error("请指定至少一个 m3u8 文件、文件夹、通配符或 --job-file")
+    if output:
+        if len(jobs) != 1:
+            parser.error("多个输入时不能指定 -o，请使用 --output-dir")
+        jobs[0]['output'] = output
+
+    if args.benchmark:
+        counts = [args.jobs] if args.jobs else [1, 2, 4, 8]
+        failed = 0
+        for job in jobs:
+            if not benchmark_parallel(job['input'], job_counts=counts):
+                failed += 1
+        return 1 if failed else 0
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # JSON 模式下 stdout 只输出结果行，转换过程中的提示信息转到 stderr
+    result_stream = sys.stdout
+    lock = threading.Lock()
+    failed = 0
+    cancelled = 0
+
+    def report(result):
+        if args.json:
+            with lock:
+                result_stream.write(json.dumps(result, ensure_ascii=False) + '\n')
+                result_stream.flush()
+
+    history = None if args.no_history else ConversionHistory()
+    with contextlib.ExitStack() as stack:
+        if args.json:
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        if history:
+            stack.callback(history.close)
+        tasks = [
+            ScheduledTask(job['input'], job_output_path(job, args.output_dir), payload=job,
+                          engine=job.get('engine', engine))
+            for job in jobs
+        ]
+        options = dict(default_engine=engine, default_jobs=args.jobs, output_dir=args.output_dir,
+                       check=not args.no_check, download_workers=args.download_workers,
+                       keep_download=args.keep_download, history=history, force=args.force,
+                       verify=not args.no_verify, faststart=args.faststart, fragmented=args.fragmented,
+                       variant=args.variant, targets=args.targets)
+
+        def on_done(task, result, error):
+            nonlocal failed
+            if error is not None:
+                result = {'input': task.input_path, 'output': task.output_path, 'ok': False, 'error': str(error)}
+                print(f"✗ {task.input_path}: {error}")
+            if not result['ok']:
+                failed += 1
+            report(result)
+
+        if args.use_async:
+            # 一个事件循环驱动全部 ffmpeg 子进程，排队的任务只是等待中的协程
+            from async_engine import run_batch
+
+            by_job = {id(task.payload): task for task in tasks}
+            finished = set()
+
+            def on_async_done(job, result, error):
+                finished.add(id(job))
+                on_done(by_job[id(job)], result, error)
+
+            try:
+                run_batch(jobs, options, max_jobs=args.concurrency, max_per_device=args.per_device,
+                          timeout=args.timeout, stall_timeout=args.stall_timeout or None, on_done=on_async_done)
+            except KeyboardInterrupt:
+                # 运行中的 ffmpeg 已被结束，未完成的任务记为已取消
+                for task in tasks:
+                    if id(task.payload) not in finished:
+                        cancelled += 1
+                        print(f"已取消: {task.input_path}")
+                        report({'input': task.input_path, 'output': task.output_path, 'ok': False,
+                                'error': '已取消'})
+        else:
+            # 按磁盘调度：预留输出空间，限制每块磁盘的并发，并根据实测吞吐量调整
+            scheduler = IOScheduler(max_jobs=args.concurrency, max_per_device=args.per_device,
+                                    adaptive=not args.no_adaptive)
+            scheduler.run(tasks, lambda task: run_job(task.payload, **options), on_done)
+
+    if (len(jobs) > 1 or cancelled) and not args.json:
+        summary = f"共 {len(jobs)} 个任务，成功 {len(jobs) - failed - cancelled}，失败 {failed}"
+        print(summary + (f"，已取消 {cancelled}" if cancelled else ''))
+    return 0 if failed == 0 and cancelled == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+同一文件系统内的快速复制
+输入和输出在同一块磁盘上时，拼接/复制分片不必经过用户态缓冲区：
+优先用 reflink（FICLONERANGE，btrfs、XFS 等支持，共享数据块，几乎不写盘），
+其次用 copy_file_range / sendfile 在内核中复制，都不支持时才退回大块缓冲读写；
+link_or_copy 为只读的分片副本建立硬链接（hls_decrypt.py 单独解密播放列表时用于未加密的分片）
+"""
+
+import errno
+import os
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux/fs.h：Python 3.12 之前的 fcntl 模块没有这个常量
+FICLONERANGE = getattr(fcntl, 'FICLONERANGE', 0x4020940D)
+# 缓冲读写时每次复制的块大小（8 MB）
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# 已确认不支持 reflink 的设备（避免每个分片都重复尝试一次失败的系统调用）
+_no_reflink_devices = set()
+
+
+class CopyStats:
+    """按复制方式统计字节数：reflink 共享数据块，不产生新的写入"""
+
+    def __init__(self):
+        self.linked = 0     # 硬链接
+        self.cloned = 0     # reflink
+        self.kernel = 0     # copy_file_range / sendfile
+        self.buffered = 0   # 用户态读写
+
+    @property
+    def total(self):
+        return self.linked + self.cloned + self.kernel + self.buffered
+
+    @property
+    def copied(self):
+        """实际复制了数据的字节数"""
+        return self.kernel + self.buffered
+
+    def summary(self):
+        mb = 1024 * 1024
+        parts = [f"{name} {size / mb:.2f} MB" for name, size in (
+            ('硬链接', self.linked), ('reflink', self.cloned),
+            ('内核复制', self.kernel), ('缓冲读写', self.buffered)) if size]
+        return '，'.join(parts) or '0 MB'
+
+
+def clone_range(src_fd, dst_fd, src_offset=0, length=0, dst_offset=0):
+    """
+    FICLONERANGE：把 src 的 [src_offset, src_offset + length) 共享到 dst 的 dst_offset 处（length 为 0 表示到文件末尾）
+    偏移需要按文件系统块对齐；成功返回 True，文件系统不支持时返回 False
+    """
+    if fcntl is None:
+        return False
+    dev = os.fstat(dst_fd).st_dev
+    if dev in _no_reflink_devices:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONERANGE, struct.pack('qQQQ', src_fd, src_offset, length, dst_offset))
+        return True
+    except OSError as e:
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.ENOSYS):
+            _no_reflink_devices.add(dev)
+        # EXDEV（跨文件系统）、EINVAL（未对齐）等情况只是这一次不能共享
+        return False
+
+
+def append_file(src, dst, size, stats=None):
+    """
+    把 src 的全部内容（size 字节）追加写入 dst（均为已打开的文件对象），返回复制的字节数
+    同一设备且写入位置按块对齐时先尝试 reflink，再依次尝试 copy_file_range / sendfile，最后缓冲读写
+    """
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    copied = 0
+    # 零拷贝直接写 fd，先把文件对象缓冲区中的数据落盘
+    dst.flush()
+    dst_st = os.fstat(dst_fd)
+    offset = dst_st.st_size
+    if size and os.fstat(src_fd).st_dev == dst_st.st_dev and offset % (dst_st.st_blksize or 4096) == 0:
+        if clone_range(src_fd, dst_fd, 0, 0, offset):
+            dst.seek(0, os.SEEK_END)
+            if stats:
+                stats.cloned += size
+            return size
+
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+        try:
+            while copied < size:
+                if name == 'copy_file_range':
+                    n = func(src_fd, dst_fd, size - copied)
+                else:
+                    n = func(dst_fd, src_fd, copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+            # 同步文件对象的写入位置
+            dst.seek(0, os.SEEK_END)
+            if stats:
+                stats.kernel += copied
+            return copied
+        except OSError:
+            if copied:
+                raise
+            # 跨文件系统或平台不支持，尝试下一种方式
+            continue
+    buf = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        dst.write(view[:n])
+        copied += n
+    if stats:
+        stats.buffered += copied
+    return copied
+
+
+def copy_range_to_file(src_path, dst_path, offset=0, length=None, stats=None):
+    """把 src 的一段（length 为 None 时到文件末尾）复制为新文件 dst，返回字节数"""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        if length is None:
+            length = os.fstat(src.fileno()).st_size - offset
+        if offset == 0 and length == os.fstat(src.fileno()).st_size:
+            return append_file(src, dst, length, stats)
+        # 字节范围：起始偏移通常不对齐，不尝试 reflink
+        src.seek(offset)
+        copied = 0
+        func = getattr(os, 'copy_file_range', None)
+        if func is not None:
+            try:
+                while copied < length:
+                    n = func(src.fileno(), dst.fileno(), length - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                if stats:
+                    stats.kernel += copied
+                return copied
+            except OSError:
+                if copied:
+                    raise
+        data = src.read(length)
+        dst.write(data)
+        if stats:
+            stats.buffered += len(data)
+        return len(data)
+
+
+def link_or_copy(src_path, dst_path, stats=None):
+    """
+    只读的分片副本：优先建立硬链接（同一文件系统，不复制任何数据），否则 reflink 或复制
+    调用方不能原地修改 dst，否则会同时改掉源文件
+    """
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+        if stats:
+            stats.linked += os.path.getsize(dst_path)
+        return os.path.getsize(dst_path)
+    except OSError:
+        return copy_range_to_file(src_path, dst_path, stats=stats)
+
+
+def _io_counters():
+    """本进程 /proc/self/io 中的 (wchar 写入系统调用字节数, write_bytes 实际写入存储的字节数)，不支持时为 None"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            fields = dict(line.split(':') for line in f if ':' in line)
+        return int(fields['wchar']), int(fields['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def concat_files(paths, output_path, mode='auto', stats=None):
+    """按顺序拼接文件，mode 为 'auto'（快速路径）、'kernel'（不用 reflink）或 'buffered'（只用缓冲读写）"""
+    total = 0
+    with open(output_path, 'wb') as dst:
+        for path in paths:
+            with open(path, 'rb') as src:
+                size = os.fstat(src.fileno()).st_size
+                if mode == 'auto':
+                    total += append_file(src, dst, size, stats)
+                elif mode == 'kernel':
+                    dst.flush()
+                    n = 0
+                    while n < size:
+                        step = os.copy_file_range(src.fileno(), dst.fileno(), size - n)
+                        if step == 0:
+                            break
+                        n += step
+                    dst.seek(0, os.SEEK_END)
+                    total += n
+                    if stats:
+                        stats.kernel += n
+                else:
+                    data = src.read()
+                    dst.write(data)
+                    total += len(data)
+                    if stats:
+                        stats.buffered += len(data)
+    return total
+
+
+def benchmark(m3u8_path, work_dir=None, log=print):
+    """
+    比较三种拼接方式的耗时与写入放大：每输出 1 字节，写入系统调用和实际写入存储的字节数
+    work_dir 默认为播放列表所在目录（与输入同一文件系统，才能测到 reflink）
+    """
+    from m3u8_parser import load_playlist
+
+    playlist = load_playlist(m3u8_path)
+    paths = [seg.path for seg in playlist.segments if '://' not in seg.path and not seg.byterange]
+    if not paths:
+        log("播放列表中没有可拼接的本地分片")
+        return {}
+    work_dir = work_dir or os.path.dirname(os.path.abspath(m3u8_path))
+    modes = ['buffered']
+    if hasattr(os, 'copy_file_range'):
+        modes.append('kernel')
+    modes.append('auto')
+    names = {'buffered': '缓冲读写', 'kernel': 'copy_file_range', 'auto': '快速路径'}
+    log(f"拼接 {len(paths)} 个分片到 {work_dir}")
+    log(f"{'方式':<18}{'耗时(秒)':>10}{'MB/s':>10}{'写入调用/输出':>14}{'写入存储/输出':>14}  复制方式")
+    results = {}
+    for mode in modes:
+        fd, output = tempfile.mkstemp(suffix='.ts', dir=work_dir)
+        os.close(fd)
+        stats = CopyStats()
+        try:
+            before = _io_counters()
+            start = time.time()
+            total = concat_files(paths, output, mode, stats)
+            fd = os.open(output, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            elapsed = max(time.time() - start, 1e-6)
+            after = _io_counters()
+        finally:
+            os.remove(output)
+        if before and after and total:
+            wchar = f"{(after[0] - before[0]) / total:.2f}"
+            wbytes = f"{(after[1] - before[1]) / total:.2f}"
+        else:
+            wchar = wbytes = '-'
+        speed = total / (1024 * 1024) / elapsed
+        results[mode] = (elapsed, speed, stats)
+        log(f"{names[mode]:<18}{elapsed:>10.2f}{speed:>10.1f}{wchar:>14}{wbytes:>14}  {stats.summary()}")
+    log("说明：copy_file_range / sendfile 在 /proc/self/io 中也计入写入调用，"
+        "写入存储为 0 的部分由 reflink 共享；tmpfs 等内存文件系统不统计写入存储")
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--benchmark':
+        benchmark(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        print("用法: python fast_copy.py --benchmark index.m3u8 [临时目录]")
+        sys.exit(2)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+解析 ffmpeg -progress 输出的 key=value 进度流
+配合 `-progress pipe:1 -nostats` 使用，ffmpeg 每个统计周期输出一组键值，以 progress=continue/end 结尾
+"""
+
+import os
+import subprocess
+import threading
+from collections import deque
+
+# 由 run_ffmpeg 插入到 ffmpeg 路径之后的参数
+PROGRESS_ARGS = ['-nostats', '-loglevel', 'warning', '-progress', 'pipe:1']
+
+
+class FFmpegProgress:
+    """一组进度数据（无法解析的字段为 None）"""
+
+    __slots__ = ('frame', 'fps', 'bitrate_kbps', 'total_size', 'out_time_us', 'speed', 'finished')
+
+    def __init__(self):
+        self.frame = None
+        self.fps = None
+        self.bitrate_kbps = None
+        self.total_size = None
+        self.out_time_us = None
+        self.speed = None
+        self.finished = False
+
+    @property
+    def out_time_sec(self):
+        return self.out_time_us / 1000000.0 if self.out_time_us is not None else None
+
+    def eta_seconds(self, total_duration_sec):
+        """按当前处理速度估算剩余秒数，无法估算时返回 None"""
+        if not total_duration_sec or self.out_time_us is None or not self.speed:
+            return None
+        remaining = max(total_duration_sec - self.out_time_sec, 0.0)
+        return remaining / self.speed
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"FFmpegProgress({fields})"
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _to_float(value, suffix=''):
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class ProgressParser:
+    """增量解析器：可以分多次送入任意切分的数据块"""
+
+    def __init__(self):
+        self._buffer = ''
+        self._current = FFmpegProgress()
+        self.latest = None  # 最近一组完整的进度
+
+    def feed(self, data):
+        """送入 str 或 bytes，返回本次解析出的完整进度列表"""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', errors='ignore')
+        self._buffer += data
+        lines = self._buffer.split('\n')
+        self._buffer = lines.pop()
+        results = []
+        for line in lines:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            value = value.strip()
+            if key == 'progress':
+                self._current.finished = value == 'end'
+                self.latest = self._current
+                results.append(self._current)
+                self._current = FFmpegProgress()
+            else:
+                self._set(key, value)
+        return results
+
+    def _set(self, key, value):
+        p = self._current
+        if key == 'frame':
+            p.frame = _to_int(value)
+        elif key == 'fps':
+            p.fps = _to_float(value)
+        elif key == 'bitrate':
+            p.bitrate_kbps = _to_float(value, 'kbits/s')
+        elif key == 'total_size':
+            p.total_size = _to_int(value)
+        elif key in ('out_time_us', 'out_time_ms'):
+            # 旧版本 ffmpeg 的 out_time_ms 实际单位也是微秒
+            us = _to_int(value)
+            if us is not None and us >= 0:
+                p.out_time_us = us
+        elif key == 'speed':
+            p.speed = _to_float(value, 'x')
+
+
+def run_ffmpeg(cmd, on_progress=None, on_stderr=None, feed=None):
+    """
+    运行 ffmpeg 并解析进度，返回 (返回码, 最后几行错误输出)
+    cmd 为不含进度参数的完整命令；on_progress(FFmpegProgress) 每个统计周期回调一次，
+    on_stderr(line) 收到每行警告/错误时回调（在单独的线程中）；
+    feed(stdin) 在单独的线程中向 ffmpeg 标准输入（-i pipe:0）写入数据，返回后自动关闭标准输入，
+    feed 抛出的异常在 ffmpeg 退出后重新抛出
+    """
+    cmd = [cmd[0]] + PROGRESS_ARGS + list(cmd[1:])
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if feed else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+
+    # stderr 在单独的线程中读取，避免管道写满阻塞 ffmpeg
+    error_tail = deque(maxlen=20)
+
+    def drain_stderr():
+        for raw in iter(process.stderr.readline, b''):
+            line = raw.decode('utf-8', errors='ignore').strip()
+            if line:
+                error_tail.append(line)
+                if on_stderr:
+                    on_stderr(line)
+
+    stderr_thread = threading.Thread(target=drain_stderr)
+    stderr_thread.daemon = True
+    stderr_thread.start()
+
+    feed_error = []
+    feed_thread = None
+    if feed:
+        def write_stdin():
+            try:
+                feed(process.stdin)
+            except BrokenPipeError:
+                # ffmpeg 提前退出，错误信息以 stderr 为准
+                pass
+            except BaseException as e:
+                feed_error.append(e)
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        feed_thread = threading.Thread(target=write_stdin)
+        feed_thread.daemon = True
+        feed_thread.start()
+
+    parser = ProgressParser()
+    fd = process.stdout.fileno()
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            break
+        for progress in parser.feed(chunk):
+            if on_progress:
+                on_progress(progress)
+
+    returncode = process.wait()
+    if feed_thread:
+        feed_thread.join()
+    stderr_thread.join(timeout=5)
+    process.stdout.close()
+    process.stderr.close()
+    if feed_error:
+        raise feed_error[0]
+    return returncode, '\n'.join(error_tail)
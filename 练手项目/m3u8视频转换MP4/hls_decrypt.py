@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+AES-128 加密分片解密
+按 #EXT-X-KEY 读取本地或远程密钥（相对路径相对于播放列表解析），每个分片使用自己的 IV
+（未指定 IV 时为媒体序号），以大块流式 CBC 解密，多个分片在线程池中并行处理
+
+需要安装 cryptography（pip install cryptography），也可以使用 pycryptodome
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chunked_convert import write_chunk_playlist
+from fast_copy import copy_range_to_file, link_or_copy
+from m3u8_parser import MediaPlaylist, load_playlist
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    def _new_cipher(key, iv):
+        return Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor().update
+
+    AES_BACKEND = 'cryptography'
+except ImportError:
+    try:
+        from Crypto.Cipher import AES
+
+        def _new_cipher(key, iv):
+            return AES.new(key, AES.MODE_CBC, iv).decrypt
+
+        AES_BACKEND = 'pycryptodome'
+    except ImportError:
+        _new_cipher = None
+        AES_BACKEND = None
+
+BLOCK_SIZE = 16
+# 流式解密时每次处理的块大小（16 的整数倍）
+DECRYPT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class DecryptError(Exception):
+    """无法解密（缺少依赖、密钥错误或加密方式不支持）"""
+
+
+def _require_backend():
+    if _new_cipher is None:
+        raise DecryptError("解密 AES-128 需要安装 cryptography: pip install cryptography")
+
+
+class SegmentDecryptor:
+    """单个分片的流式解密器：多次 update() 送入密文，最后 finish() 去掉 PKCS#7 填充"""
+
+    def __init__(self, key, iv):
+        _require_backend()
+        self._update = _new_cipher(key, iv)
+        self._tail = b''
+
+    def update(self, data):
+        if self._tail:
+            data = self._tail + data
+        # 保留最后一个完整块（可能含填充）和不足一块的部分，留到下次或 finish() 处理
+        keep = len(data) % BLOCK_SIZE or BLOCK_SIZE
+        if len(data) <= keep:
+            self._tail = bytes(data)
+            return b''
+        self._tail = bytes(data[-keep:])
+        return self._update(data[:-keep])
+
+    def finish(self):
+        if len(self._tail) != BLOCK_SIZE:
+            raise DecryptError(f"密文长度不是 {BLOCK_SIZE} 的整数倍")
+        last = self._update(self._tail)
+        pad = last[-1]
+        # 填充不合法时按未填充处理（部分服务器生成的分片没有填充）
+        if 1 <= pad <= BLOCK_SIZE and last[-pad:] == bytes([pad]) * pad:
+            return last[:-pad]
+        return last
+
+
+def decrypt_bytes(data, key, iv):
+    """解密一个完整分片"""
+    decryptor = SegmentDecryptor(key, iv)
+    return decryptor.update(data) + decryptor.finish()
+
+
+def decrypt_file(src, dst, key, iv, byterange=None):
+    """流式解密 src（byterange 为 (长度, 偏移) 时只解密这一段）写入 dst，返回写入的字节数"""
+    decryptor = SegmentDecryptor(key, iv)
+    written = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        remaining = None
+        if byterange:
+            remaining, offset = byterange
+            fin.seek(offset)
+        while remaining is None or remaining > 0:
+            size = DECRYPT_CHUNK_SIZE if remaining is None else min(DECRYPT_CHUNK_SIZE, remaining)
+            chunk = fin.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            written += fout.write(decryptor.update(chunk))
+        written += fout.write(decryptor.finish())
+    return written
+
+
+def segment_iv(key, sequence):
+    """分片的 IV：播放列表指定的 IV，否则为 128 位大端媒体序号"""
+    return key.iv if key.iv is not None else sequence.to_bytes(BLOCK_SIZE, 'big')
+
+
+class KeyStore:
+    """按地址缓存密钥；远程密钥通过 downloader（HLSDownloader）下载"""
+
+    def __init__(self, downloader=None):
+        self.downloader = downloader
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        if key.method != 'AES-128':
+            raise DecryptError(f"不支持的加密方式: {key.method}")
+        if not key.path:
+            raise DecryptError("EXT-X-KEY 缺少 URI")
+        with self._lock:
+            if key.path in self._keys:
+                return self._keys[key.path]
+        if '://' in key.path:
+            if self.downloader is None:
+                raise DecryptError(f"远程密钥需要下载: {key.path}")
+            data = self.downloader.fetch_bytes(key.path)
+        else:
+            try:
+                with open(key.path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                raise DecryptError(f"无法读取密钥文件 {key.path}: {e}")
+        if len(data) != BLOCK_SIZE:
+            raise DecryptError(f"密钥长度应为 {BLOCK_SIZE} 字节，实际为 {len(data)}: {key.path}")
+        with self._lock:
+            self._keys[key.path] = data
+        return data
+
+
+def check_supported(playlist):
+    """播放列表中的所有加密方式都能解密时返回 None，否则返回原因"""
+    methods = {key.method for key in playlist.keys if key.method != 'NONE'}
+    if methods - {'AES-128'}:
+        return f"不支持的加密方式: {', '.join(sorted(methods - {'AES-128'}))}"
+    if methods and _new_cipher is None:
+        return "解密 AES-128 需要安装 cryptography: pip install cryptography"
+    return None
+
+
+def decrypt_playlist(m3u8_path, output_dir, workers=None, log=print):
+    """
+    把本地加密播放列表的分片并行解密到 output_dir，写出不加密的 index.m3u8 并返回其路径
+    结果可以交给任何转换方式（包括内置引擎和原生拼接）
+    """
+    playlist = load_playlist(m3u8_path)
+    if playlist.is_master:
+        raise DecryptError("请选择具体的子播放列表")
+    problem = check_supported(playlist)
+    if problem:
+        raise DecryptError(problem)
+    os.makedirs(output_dir, exist_ok=True)
+    keys = KeyStore()
+
+    local = MediaPlaylist(os.path.join(output_dir, 'index.m3u8'))
+    local.version = playlist.version
+    local.target_duration = playlist.target_duration
+    local.media_sequence = playlist.media_sequence
+    local.init_map = playlist.init_map
+    jobs = []
+    for i, seg in enumerate(playlist.segments):
+        name = f"seg{i:05d}{os.path.splitext(seg.path)[1] or '.ts'}"
+        jobs.append((seg, os.path.join(output_dir, name)))
+        local.segments.append(seg._replace(uri=name, path=name, byterange=None, key=None))
+
+    def run(job):
+        seg, dst = job
+        if seg.key is None:
+            # 未加密的分片不需要改写：同一文件系统上建立硬链接，否则在内核中复制
+            if seg.byterange:
+                return copy_range_to_file(seg.path, dst, seg.byterange[1], seg.byterange[0])
+            return link_or_copy(seg.path, dst)
+        key = playlist.keys[seg.key]
+        return decrypt_file(seg.path, dst, keys.get(key), segment_iv(key, seg.sequence), seg.byterange)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        total = sum(pool.map(run, jobs))
+    elapsed = max(time.time() - start, 1e-6)
+    write_chunk_playlist(local, 0, len(local.segments), local.path)
+    log(f"解密完成：{len(jobs)} 个分片，{total / (1024 * 1024):.2f} MB，用时 {elapsed:.2f} 秒，"
+        f"{total / (1024 * 1024) / elapsed:.1f} MB/s")
+    return local.path
+
+
+def benchmark(size_mb=64, thread_counts=None, log=print):
+    """测量解密吞吐量：单线程（每核）与多线程的 MB/s"""
+    _require_backend()
+    thread_counts = thread_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+    key = os.urandom(BLOCK_SIZE)
+    segment = os.urandom(4 * 1024 * 1024)
+    segments = max(1, size_mb // 4)
+    log(f"解密后端: {AES_BACKEND}，数据量 {segments * 4} MB（{segments} 个 4 MB 分片）")
+
+    def run(i):
+        decrypt_bytes(segment, key, i.to_bytes(BLOCK_SIZE, 'big'))
+
+    results = {}
+    for threads in thread_counts:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(run, range(segments)))
+        elapsed = max(time.time() - start, 1e-6)
+        speed = segments * 4 / elapsed
+        results[threads] = speed
+        log(f"  {threads} 个线程: {speed:.0f} MB/s（每线程 {speed / threads:.0f} MB/s）")
+    return results
+
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        benchmark()
+    elif len(sys.argv) >= 3:
+        decrypt_playlist(sys.argv[1], sys.argv[2])
+    else:
+        print("用法: python hls_decrypt.py 加密的index.m3u8 输出目录")
+        print("      python hls_decrypt.py --benchmark")
+        sys.exit(2)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+HLS 下载
+通过保持连接的 HTTP 连接池并发下载播放列表中的分片，失败自动重试（指数退避），
+分片直接写入磁盘，最后生成引用本地文件的 index.m3u8，可直接交给转换步骤
+"""
+
+import http.client
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urljoin, urlsplit
+
+from chunked_convert import write_chunk_playlist
+from m3u8_parser import MediaPlaylist, parse_playlist
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_TIMEOUT = 30
+# 写盘时每次读取的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+MAX_REDIRECTS = 5
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+# 复用的连接在服务器已关闭时会抛出这些异常，换一个新连接重发即可
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                 ConnectionResetError, BrokenPipeError)
+
+
+class DownloadError(Exception):
+    """下载失败；status 为 HTTP 状态码（网络错误时为 None）"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def is_url(path):
+    return path.lower().startswith(('http://', 'https://'))
+
+
+class ConnectionPool:
+    """按 (协议, 主机, 端口) 复用 HTTP/1.1 长连接，线程安全"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=DEFAULT_WORKERS * 2, headers=None):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.connections_opened = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            self.connections_opened += 1
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, url, headers):
+        """发送一次请求（不处理重定向），返回 (连接键, 连接, 响应)"""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        while True:
+            conn, reused = self._acquire(key)
+            try:
+                conn.request('GET', target, headers=headers)
+                return key, conn, conn.getresponse()
+            except _STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+    def get(self, url, sink=None, byterange=None):
+        """
+        GET 请求；sink 为 None 时返回 (内容, 最终地址)，否则把响应体写入 sink 并返回 (字节数, 最终地址)
+        byterange 为 (长度, 偏移) 时只请求这一段，长度为 None 时请求从偏移到末尾
+        """
+        headers = dict(self.headers)
+        if byterange:
+            length, offset = byterange
+            headers['Range'] = f"bytes={offset}-" if length is None else f"bytes={offset}-{offset + length - 1}"
+        for _ in range(MAX_REDIRECTS + 1):
+            key, conn, response = self._send(url, headers)
+            redirect = error = None
+            try:
+                if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                    response.read()
+                    redirect = urljoin(url, response.getheader('Location'))
+                elif response.status >= 400:
+                    response.read()
+                    error = DownloadError(f"HTTP {response.status} {response.reason}: {url}", response.status)
+                elif byterange and response.status != 206:
+                    raise DownloadError(f"服务器不支持 Range 请求: {url}", response.status)
+                else:
+                    expected = response.getheader('Content-Length')
+                    if sink is None:
+                        result = response.read()
+                        size = len(result)
+                    else:
+                        result = size = _copy_response(response, sink)
+                    if expected is not None and size != int(expected):
+                        raise DownloadError(f"响应不完整（{size}/{expected} 字节）: {url}")
+            except BaseException:
+                conn.close()
+                raise
+            # 响应体已读完，连接可以留给下一个请求
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            if error:
+                raise error
+            if redirect:
+                url = redirect
+                continue
+            return result, url
+        raise DownloadError(f"重定向次数过多: {url}")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def _copy_response(response, sink):
+    buffer = bytearray(READ_CHUNK_SIZE)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = response.readinto(buffer)
+        if not n:
+            break
+        sink.write(view[:n])
+        total += n
+    return total
+
+
+class DownloadResult:
+    """下载结果：playlist_path 为生成的本地播放列表"""
+
+    def __init__(self, playlist_path, segments, bytes_downloaded, elapsed, skipped=0):
+        self.playlist_path = playlist_path
+        self.segments = segments
+        self.bytes = bytes_downloaded
+        self.elapsed = elapsed
+        self.skipped = skipped
+
+    @property
+    def speed_mbps(self):
+        return self.bytes / (1024 * 1024) / max(self.elapsed, 1e-6)
+
+
+def _local_name(prefix, index, url, default_ext):
+    ext = os.path.splitext(unquote(urlsplit(url).path))[1].lower()
+    if not ext or len(ext) > 6:
+        ext = default_ext
+    return f"{prefix}{index:05d}{ext}"
+
+
+class HLSDownloader:
+    """
+    下载远程 HLS 播放列表到本地目录
+    workers 为并发下载的分片数，retries 为每个分片的重试次数，第 n 次重试前等待 backoff * 2^n 秒
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, headers=None, log=print):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.log = log
+        self.pool = ConnectionPool(timeout=timeout, max_idle=self.workers * 2, headers=headers)
+
+    def _retry(self, what, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except DownloadError as e:
+                # 4xx（超时和限流除外）重试也不会成功
+                if e.status and 400 <= e.status < 500 and e.status not in (408, 429):
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt)
+                self.log(f"{what} 失败（{error}），{delay:.1f} 秒后重试")
+                time.sleep(delay)
+        raise DownloadError(f"{what} 失败: {error}")
+
+    def fetch_playlist(self, url):
+        """下载并解析播放列表；主播放列表自动选择码率最高的子播放列表"""
+        data, final_url = self._retry(url, self.pool.get, url)
+        playlist = parse_playlist(data.decode('utf-8', errors='ignore'), final_url)
+        if playlist.is_master:
+            if not playlist.variants:
+                raise DownloadError(f"主播放列表中没有可用的码率: {url}")
+            variant = max(playlist.variants, key=lambda v: v.bandwidth)
+            self.log(f"选择码率 {variant.bandwidth} bps: {variant.path}")
+            return self.fetch_playlist(variant.path)
+        return playlist
+
+    def fetch_bytes(self, url, byterange=None):
+        """下载到内存（带重试），返回内容"""
+        data, _ = self._retry(url, self.pool.get, url, None, byterange)
+        return data
+
+    def download_file(self, url, path, byterange=None):
+        """下载到 path（先写 .part 再改名，已存在的完整文件直接跳过），返回写入的字节数"""
+        if os.path.exists(path):
+            return 0
+
+        def attempt():
+            tmp_path = path + '.part'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    size, _ = self.pool.get(url, sink=f, byterange=byterange)
+                os.replace(tmp_path, path)
+                return size
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        return self._retry(os.path.basename(path), attempt)
+
+    def prepare(self, url, output_dir):
+        """
+        下载播放列表、密钥和初始化分片，写出引用本地文件的 index.m3u8
+        返回 (本地播放列表路径, [(下标, 分片地址, 本地路径, 字节范围), ...])
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        remote = self.fetch_playlist(url)
+        local = MediaPlaylist(os.path.join(output_dir, 'index.m3u8'))
+        local.version = remote.version
+        local.target_duration = remote.target_duration
+        local.media_sequence = remote.media_sequence
+        local.total_duration = remote.total_duration
+
+        for i, key in enumerate(remote.keys):
+            if key.path and key.method != 'NONE':
+                name = f"key{i:02d}.key"
+                self.download_file(key.path, os.path.join(output_dir, name))
+                key = key._replace(uri=name, path=name)
+            local.keys.append(key)
+        if remote.init_map:
+            name = _local_name('init', 0, remote.init_map.path, '.mp4')
+            self.download_file(remote.init_map.path, os.path.join(output_dir, name), remote.init_map.byterange)
+            local.init_map = remote.init_map._replace(uri=name, path=name, byterange=None)
+
+        jobs = []
+        for i, seg in enumerate(remote.segments):
+            name = _local_name('seg', i, seg.path, '.ts')
+            jobs.append((i, seg.path, os.path.join(output_dir, name), seg.byterange))
+            local.segments.append(seg._replace(uri=name, path=name, byterange=None))
+        if local.segments:
+            write_chunk_playlist(local, 0, len(local.segments), local.path)
+        return local.path, jobs
+
+    def download(self, url, output_dir, on_progress=None):
+        """
+        下载整个播放列表，返回 DownloadResult
+        on_progress(已下载字节, 已完成分片数, 分片总数) 在下载线程中回调
+        """
+        start = time.time()
+        playlist_path, jobs = self.prepare(url, output_dir)
+        self.log(f"开始下载 {len(jobs)} 个分片（并发 {self.workers}）到 {output_dir}")
+        state = {'bytes': 0, 'done': 0, 'skipped': 0}
+        lock = threading.Lock()
+
+        def fetch(job):
+            index, seg_url, path, byterange = job
+            size = self.download_file(seg_url, path, byterange)
+            with lock:
+                state['bytes'] += size
+                state['done'] += 1
+                if not size:
+                    state['skipped'] += 1
+                progress = (state['bytes'], state['done'], len(jobs))
+            if on_progress:
+                on_progress(*progress)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # list() 让任一分片的异常在这里抛出
+            list(executor.map(fetch, jobs))
+
+        result = DownloadResult(playlist_path, len(jobs), state['bytes'], time.time() - start, state['skipped'])
+        self.log(f"下载完成：{result.segments} 个分片，{result.bytes / (1024 * 1024):.2f} MB，"
+                 f"用时 {result.elapsed:.2f} 秒，{result.speed_mbps:.1f} MB/s，"
+                 f"建立连接 {self.pool.connections_opened} 个")
+        return result
+
+    def close(self):
+        self.pool.close()
+
+
+def download_hls(url, output_dir, workers=DEFAULT_WORKERS, on_progress=None, log=print):
+    """下载远程播放列表到 output_dir，返回 DownloadResult"""
+    downloader = HLSDownloader(workers=workers, log=log)
+    try:
+        return downloader.download(url, output_dir, on_progress)
+    finally:
+        downloader.close()
+
+
+def url_output_name(url):
+    """根据播放列表地址生成输出文件名（index.m3u8 之类的通用名称改用上一级目录名）"""
+    parts = [p for p in unquote(urlsplit(url).path).split('/') if p]
+    name = os.path.splitext(parts[-1])[0] if parts else 'video'
+    if name.lower() in ('index', 'playlist', 'master', 'prog_index', 'chunklist') and len(parts) > 1:
+        name = parts[-2]
+        if name.lower().endswith('.m3u8'):
+            name = name[:-5]
+    return f"{name}.mp4"
+
+
+def serve(directory, port=8000):
+    """在本地启动支持长连接的 HTTP 服务器，用于测试下载"""
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(Handler, directory=directory))
+    print(f"正在提供 {os.path.abspath(directory)}: http://127.0.0.1:{server.server_address[1]}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 8000)
+    elif len(sys.argv) >= 3:
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_WORKERS
+        download_hls(sys.argv[1], sys.argv[2], workers=workers)
+    else:
+        print("用法: python hls_download.py 播放列表地址 保存目录 [并发数]")
+        print("      python hls_download.py --serve 目录 [端口]   启动本地测试服务器")
+        sys.exit(2)
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+直播 HLS 录制
+按 #EXT-X-TARGETDURATION 的节奏重新读取媒体播放列表（有新分片时间隔一个目标时长，没有时减半），
+每次只读取上次读到的字节偏移之后新增的内容，送入同一个增量解析器，不重新解析整个播放列表；
+新分片按顺序并发读取（加密分片同时解密），追加到不断增长的分片 MP4（内置引擎，边录边可播放）或 .ts 文件，
+遇到 #EXT-X-ENDLIST 时结束。
+
+服务器每次整体重写的滑动窗口播放列表（上次读到的末尾内容对不上）会完整重新解析，按分片序号去重。
+本地测试可以用 --simulate 按分片时长逐个写出分片，模拟正在录制的播放列表
+"""
+
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+
+from hls_decrypt import KeyStore, check_supported, decrypt_bytes, segment_iv
+from hls_download import DEFAULT_WORKERS, DownloadError, HLSDownloader, is_url
+from m3u8_parser import PlaylistParser, load_playlist
+from stream_pipeline import iter_in_order, read_local_segment
+from ts_remux import TSRemuxer
+
+# 重新读取时与上次末尾重叠比对的字节数，用来发现播放列表被整体重写
+OVERLAP_BYTES = 64
+# 播放列表还没有 #EXT-X-TARGETDURATION 时的重新读取间隔
+DEFAULT_RELOAD_SECONDS = 2.0
+# 连续这么多个目标时长没有新分片时认为直播已中断
+STALL_TARGET_DURATIONS = 6
+
+
+class LiveError(Exception):
+    """直播播放列表无法录制"""
+
+
+class LivePlaylistReader:
+    """
+    增量读取正在增长的媒体播放列表（本地路径或 http(s) 地址）
+    poll() 返回自上次以来新增的分片；远程服务器不支持 Range 请求时每次下载整个播放列表，但仍只解析新增部分
+    """
+
+    def __init__(self, source, downloader=None):
+        self.source = source if is_url(source) else os.path.abspath(source)
+        self.downloader = downloader
+        self.full_reloads = 0
+        self.bytes_parsed = 0
+        self.skipped = 0
+        self.last_sequence = None
+        self._ranges = True
+        self._reset()
+
+    def _reset(self):
+        self.parser = PlaylistParser(self.source)
+        self.offset = 0
+        self._tail = b''
+        self._next_index = 0
+
+    @property
+    def playlist(self):
+        return self.parser.playlist
+
+    def _read_from(self, start):
+        """读取从 start 开始的内容；文件比 start 短时返回空"""
+        if not is_url(self.source):
+            with open(self.source, 'rb') as f:
+                f.seek(start)
+                return f.read()
+        if self._ranges and start > 0:
+            try:
+                data, _ = self.downloader.pool.get(self.source, None, (None, start))
+                return data
+            except DownloadError as e:
+                if e.status == 416:
+                    return b''
+                if e.status not in (200, 501):
+                    raise
+                self._ranges = False
+        return self.downloader.fetch_bytes(self.source)[start:]
+
+    def _feed(self, data):
+        """只解析完整的行，末尾不完整的行留到下次读取"""
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        self.parser.feed(data[:end].decode('utf-8', errors='ignore'))
+        self._tail = (self._tail + data[:end])[-OVERLAP_BYTES:]
+        self.offset += end
+        self.bytes_parsed += end
+
+    def poll(self):
+        start = self.offset - len(self._tail)
+        data = self._read_from(start)
+        if data.startswith(self._tail):
+            self._feed(data[len(self._tail):])
+        else:
+            # 播放列表被重写（滑动窗口）或截断：从头重新解析，已经交出的分片按序号跳过
+            self.full_reloads += 1
+            self._reset()
+            self._feed(self._read_from(0))
+        playlist = self.parser.playlist
+        if playlist is None:
+            return []
+        if playlist.is_master:
+            raise LiveError("这是主播放列表，请指定具体码率的媒体播放列表")
+        new = playlist.segments[self._next_index:]
+        self._next_index = len(playlist.segments)
+        if self.last_sequence is not None:
+            new = [seg for seg in new if seg.sequence > self.last_sequence]
+            if new and new[0].sequence > self.last_sequence + 1:
+                # 读取太慢，滑动窗口已经把中间的分片移走了
+                self.skipped += new[0].sequence - self.last_sequence - 1
+        if new:
+            self.last_sequence = new[-1].sequence
+        return new
+
+
+def record_live(source, output_path, muxer='native', workers=DEFAULT_WORKERS, stop_event=None,
+                stall_timeout=None, on_segment=None, log=print):
+    """
+    录制直播播放列表到 output_path，返回 (返回码, 错误信息)
+    muxer 为 'native'（分片 MP4）或 'ts'；stop_event 被设置时写完已读到的分片后正常结束；
+    连续 stall_timeout 秒（默认 STALL_TARGET_DURATIONS 个目标时长）没有新分片时报错结束，已录制的内容保留；
+    on_segment(已写入分片数, 已写入时长) 每写入一个分片回调一次
+    """
+    stop_event = stop_event or threading.Event()
+    downloader = HLSDownloader(workers=workers, log=log)
+    reader = LivePlaylistReader(source, downloader)
+    keys = KeyStore(downloader)
+    state = {'segments': 0, 'duration': 0.0, 'bytes': 0}
+    returncode, error = 0, ''
+    start = time.time()
+    last_new = start
+    log(f"开始录制: {source} -> {output_path}")
+    try:
+        with open(output_path, 'wb') as out:
+            remuxer = TSRemuxer(out) if muxer == 'native' else None
+            write = remuxer.feed if remuxer else out.write
+            checked = False
+            try:
+                while True:
+                    polled_at = time.time()
+                    skipped = reader.skipped
+                    segments = reader.poll()
+                    if reader.skipped > skipped:
+                        log(f"警告：{reader.skipped - skipped} 个分片已从播放列表中移除，未能录制")
+                    playlist = reader.playlist
+                    if playlist is not None and not checked:
+                        if playlist.init_map:
+                            raise LiveError("fMP4 分片（EXT-X-MAP）暂不支持录制")
+                        checked = True
+                    if segments:
+                        problem = check_supported(playlist)
+                        if problem:
+                            raise LiveError(problem)
+                        last_new = polled_at
+
+                        def fetch(index, segments=segments, playlist=playlist):
+                            seg = segments[index]
+                            if is_url(seg.path):
+                                data = downloader.fetch_bytes(seg.path, seg.byterange)
+                            else:
+                                data = read_local_segment(seg.path, seg.byterange)
+                            if seg.key is not None:
+                                key = playlist.keys[seg.key]
+                                data = decrypt_bytes(data, keys.get(key), segment_iv(key, seg.sequence))
+                            return data
+
+                        for seg, data in zip(segments, iter_in_order(fetch, len(segments), workers)):
+                            write(data)
+                            state['segments'] += 1
+                            state['duration'] += seg.duration
+                            state['bytes'] += len(data)
+                            if on_segment:
+                                on_segment(state['segments'], state['duration'])
+                        # 让已写出的分片立即对播放器可见
+                        out.flush()
+                        log(f"已录制 {state['segments']} 个分片，{state['duration']:.1f} 秒，"
+                            f"{state['bytes'] / (1024 * 1024):.2f} MB")
+
+                    if playlist is not None and playlist.endlist:
+                        log("遇到 #EXT-X-ENDLIST，直播结束")
+                        break
+                    if stop_event.is_set():
+                        log("已停止录制")
+                        break
+                    target = (playlist.target_duration if playlist is not None else None) or DEFAULT_RELOAD_SECONDS
+                    limit = stall_timeout if stall_timeout is not None else target * STALL_TARGET_DURATIONS
+                    if time.time() - last_new > limit:
+                        raise LiveError(f"播放列表 {limit:.0f} 秒没有新分片，直播可能已中断")
+                    # 有新分片时间隔一个目标时长，没有时减半（RFC 8216 6.3.4）
+                    interval = target if segments else target / 2
+                    stop_event.wait(max(polled_at + interval - time.time(), 0))
+            finally:
+                # 出错或停止时也写出缓存中的样本，已录制的部分保持可播放
+                if remuxer and state['segments']:
+                    remuxer.finish()
+    except Exception as e:
+        returncode, error = 1, str(e)
+    finally:
+        downloader.close()
+
+    elapsed = max(time.time() - start, 1e-6)
+    log(f"录制{'完成' if returncode == 0 else '中止'}：{state['segments']} 个分片，{state['duration']:.1f} 秒，"
+        f"{state['bytes'] / (1024 * 1024):.2f} MB，用时 {elapsed:.1f} 秒；"
+        f"播放列表读取 {reader.bytes_parsed} 字节，完整重新解析 {reader.full_reloads} 次")
+    return returncode, error
+
+
+def simulate_live(m3u8_path, output_dir, interval=None, window=None, log=print):
+    """
+    把已有的本地播放列表当作直播重放到 output_dir：每隔 interval 秒（默认为分片时长）写出一个分片并更新播放列表，
+    最后写入 #EXT-X-ENDLIST；window 为 None 时追加写入（EVENT 类型），否则整体重写只保留最近 window 个分片的滑动窗口
+    """
+    source = load_playlist(m3u8_path)
+    if source.is_master or source.encrypted or source.init_map:
+        raise LiveError("模拟器只支持未加密的 .ts 媒体播放列表")
+    os.makedirs(output_dir, exist_ok=True)
+    playlist_path = os.path.join(output_dir, 'index.m3u8')
+    target = math.ceil(max((seg.duration for seg in source.segments), default=1))
+    header = f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:{target}\n"
+    written = []
+
+    def rewrite(ended):
+        shown = written[-window:]
+        lines = [header, f"#EXT-X-MEDIA-SEQUENCE:{len(written) - len(shown)}\n"]
+        lines += [f"#EXTINF:{duration:.6f},\n{name}\n" for name, duration in shown]
+        if ended:
+            lines.append("#EXT-X-ENDLIST\n")
+        tmp = playlist_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(''.join(lines))
+        os.replace(tmp, playlist_path)
+
+    if window is None:
+        with open(playlist_path, 'w', encoding='utf-8') as f:
+            f.write(header + "#EXT-X-PLAYLIST-TYPE:EVENT\n#EXT-X-MEDIA-SEQUENCE:0\n")
+    else:
+        rewrite(False)
+    log(f"模拟直播: {len(source.segments)} 个分片 -> {playlist_path}")
+    for i, seg in enumerate(source.segments):
+        name = f"seg{i:05d}.ts"
+        # 先写完分片再更新播放列表，与真实的录制程序一致
+        shutil.copyfile(seg.path, os.path.join(output_dir, name))
+        written.append((name, seg.duration))
+        if window is None:
+            with open(playlist_path, 'a', encoding='utf-8') as f:
+                f.write(f"#EXTINF:{seg.duration:.6f},\n{name}\n")
+        else:
+            rewrite(False)
+        time.sleep(seg.duration if interval is None else interval)
+    if window is None:
+        with open(playlist_path, 'a', encoding='utf-8') as f:
+            f.write("#EXT-X-ENDLIST\n")
+    else:
+        rewrite(True)
+    log("模拟直播结束")
+    return playlist_path
+
+
+if __name__ == '__main__':
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description="录制直播 HLS（跟随不断增长的媒体播放列表）")
+    parser.add_argument('source', help="媒体播放列表路径或 http(s) 地址；--simulate 时为要重放的本地播放列表")
+    parser.add_argument('output', help="输出文件（.mp4 为分片 MP4，.ts 直接拼接）；--simulate 时为输出目录")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"并发读取的分片数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument('--stall-timeout', type=float,
+                        help=f"多少秒没有新分片时结束（默认 {STALL_TARGET_DURATIONS} 个目标时长）")
+    parser.add_argument('--simulate', action='store_true', help="把本地播放列表按分片时长逐个写出，模拟直播")
+    parser.add_argument('--interval', type=float, help="--simulate 时每个分片的间隔秒数（默认为分片时长）")
+    parser.add_argument('--window', type=int, help="--simulate 时使用只保留最近 N 个分片的滑动窗口播放列表")
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate_live(args.source, args.output, args.interval, args.window)
+        sys.exit(0)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    code, message = record_live(
+        args.source, args.output,
+        muxer='ts' if args.output.lower().endswith('.ts') else 'native',
+        workers=args.workers, stop_event=stop, stall_timeout=args.stall_timeout
+    )
+    if code != 0:
+        print(f"录制失败: {message}")
+    sys.exit(code)
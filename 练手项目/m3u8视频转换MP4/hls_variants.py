@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+主播放列表的码率选择与多码率导出
+解析 #EXT-X-STREAM-INF（各码率）和 #EXT-X-MEDIA（备选音轨），按选择导出：
+  - 'best'：码率最高的一路（码率相同时取分辨率高的）
+  - 指定码率（bps）：不超过该码率的最高一路，都超过时取最低的一路
+  - 'all'：每一路各导出一个文件（<输出名>_<分辨率>_<码率>.mp4），并行运行
+音频是单独备选音轨（EXT-X-MEDIA TYPE=AUDIO 带 URI）时，多路共用的同一音轨只解复用一次，
+先转封装为 .m4a 再被各路复用，不会被读取和解析 N 遍
+"""
+
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg
+from m3u8_parser import PlaylistError, load_playlist
+from toolchain import ffmpeg_command
+
+# 同时运行的 ffmpeg 进程数上限（-c copy 主要是磁盘读写，太多反而更慢）
+DEFAULT_EXPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class VariantError(Exception):
+    """主播放列表中没有可用的码率"""
+
+
+def parse_selection(value):
+    """命令行的 --variant 取值：'best'、'all' 或码率（bps，可带 k/m 后缀）"""
+    if value is None:
+        return 'best'
+    text = str(value).strip().lower()
+    if text in ('best', 'all'):
+        return text
+    scale = 1
+    if text.endswith('k'):
+        text, scale = text[:-1], 1000
+    elif text.endswith('m'):
+        text, scale = text[:-1], 1000 * 1000
+    try:
+        return int(float(text) * scale)
+    except ValueError:
+        raise ValueError(f"码率选择应为 best、all 或码率数值: {value}")
+
+
+def variant_label(variant):
+    """用于文件名和日志的简短描述，例如 '720p_2500k'"""
+    parts = []
+    if variant.resolution:
+        parts.append(f"{variant.resolution[1]}p")
+    parts.append(f"{round(variant.bandwidth / 1000)}k")
+    return '_'.join(parts)
+
+
+def _rank(variant):
+    return variant.bandwidth, variant.resolution[0] * variant.resolution[1] if variant.resolution else 0
+
+
+def select_variants(master, selection='best'):
+    """按选择返回码率列表（'all' 按码率从高到低）"""
+    variants = [v for v in master.variants if v.path]
+    if not variants:
+        raise VariantError("主播放列表中没有可用的码率")
+    if selection == 'all':
+        return sorted(variants, key=_rank, reverse=True)
+    if selection == 'best':
+        return [max(variants, key=_rank)]
+    fitting = [v for v in variants if v.bandwidth <= selection]
+    return [max(fitting, key=_rank) if fitting else min(variants, key=_rank)]
+
+
+def audio_rendition(master, variant):
+    """码率引用的单独音轨（有 URI 的 EXT-X-MEDIA TYPE=AUDIO）：优先 DEFAULT=YES；音频在码率本身的分片中时返回 None"""
+    if not variant.audio:
+        return None
+    group = [r for r in master.renditions if r.type == 'AUDIO' and r.group_id == variant.audio and r.path]
+    if not group:
+        return None
+    return next((r for r in group if r.default), group[0])
+
+
+class ExportTask:
+    """一路码率的导出任务；audio 为单独音轨的 Rendition 或 None"""
+
+    def __init__(self, variant, audio, output_path):
+        self.variant = variant
+        self.audio = audio
+        self.output_path = output_path
+
+    @property
+    def label(self):
+        return variant_label(self.variant)
+
+
+def plan_exports(master, output_path, selection='best'):
+    """
+    生成导出任务：只导出一路时输出到 output_path，
+    'all' 时为 <output_path 去掉扩展名>_<分辨率>_<码率><扩展名>（同名时再加序号）
+    """
+    variants = select_variants(master, selection)
+    if selection != 'all':
+        return [ExportTask(variants[0], audio_rendition(master, variants[0]), output_path)]
+    stem, ext = os.path.splitext(output_path)
+    tasks = []
+    used = set()
+    for variant in variants:
+        name = f"{stem}_{variant_label(variant)}{ext or '.mp4'}"
+        index = 2
+        while name in used:
+            name = f"{stem}_{variant_label(variant)}_{index}{ext or '.mp4'}"
+            index += 1
+        used.add(name)
+        tasks.append(ExportTask(variant, audio_rendition(master, variant), name))
+    return tasks
+
+
+def master_plan(m3u8_path, output_path, selection='best'):
+    """本地主播放列表按选择生成的导出任务；不是主播放列表或无法读取时返回 None"""
+    try:
+        playlist = load_playlist(m3u8_path)
+    except (OSError, PlaylistError):
+        return None
+    if not playlist.is_master:
+        return None
+    return plan_exports(playlist, output_path, selection)
+
+
+def _audio_command(ffmpeg_cmd, audio_playlist, output_path):
+    return [ffmpeg_cmd, '-i', audio_playlist, '-map', '0:a', '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+            '-y', output_path]
+
+
+def _variant_command(ffmpeg_cmd, task, audio_input, output_args):
+    cmd = [ffmpeg_cmd, '-i', task.variant.path]
+    if audio_input:
+        # 视频取码率的分片，音频取单独音轨（已解复用的 .m4a 时不需要再转换 ADTS）
+        cmd += ['-i', audio_input, '-map', '0:v?', '-map', '1:a']
+    cmd += ['-c', 'copy']
+    if not audio_input or audio_input.lower().endswith('.m3u8'):
+        cmd += ['-bsf:a', 'aac_adtstoasc']
+    return cmd + [*(output_args or []), '-y', task.output_path]
+
+
+def export_variants(m3u8_path, output_path, selection='best', ffmpeg_cmd=None, workers=DEFAULT_EXPORT_WORKERS,
+                    output_args=None, log=print):
+    """
+    导出主播放列表中选中的码率，返回 (返回码, 错误信息, 成功的输出文件列表)
+    多路共用的单独音轨先各解复用一次到 <output_path>.variants 临时目录，再与各路视频并行封装
+    """
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    master = load_playlist(m3u8_path)
+    if not master.is_master:
+        raise VariantError("不是主播放列表")
+    tasks = plan_exports(master, output_path, selection)
+    for task in tasks:
+        audio = f"，音轨 {task.audio.name or task.audio.group_id}" if task.audio else ''
+        log(f"码率 {task.label}{audio}: {task.variant.path} -> {task.output_path}")
+
+    # 统计每条单独音轨被多少路使用，共用的只解复用一次
+    users = {}
+    for task in tasks:
+        if task.audio:
+            users.setdefault(task.audio.path, []).append(task)
+    work_dir = output_path + '.variants'
+    shared = {path: os.path.join(work_dir, f"audio_{i:02d}.m4a")
+              for i, path in enumerate(users) if len(users[path]) > 1}
+    if shared:
+        os.makedirs(work_dir, exist_ok=True)
+
+    errors = []
+    outputs = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            if shared:
+                log(f"解复用 {len(shared)} 条共用音轨（供 {sum(len(users[p]) for p in shared)} 路使用）")
+                results = pool.map(lambda item: run_ffmpeg(_audio_command(ffmpeg_cmd, *item)), shared.items())
+                for (path, _), (returncode, error) in zip(shared.items(), results):
+                    if returncode != 0:
+                        return 1, f"音轨解复用失败: {path}: {error}", []
+
+            def export(task):
+                audio_input = shared.get(task.audio.path, task.audio.path) if task.audio else None
+                return run_ffmpeg(_variant_command(ffmpeg_cmd, task, audio_input, output_args))
+
+            for task, (returncode, error) in zip(tasks, pool.map(export, tasks)):
+                if returncode == 0:
+                    outputs.append(task.output_path)
+                    log(f"✓ {task.label}: {task.output_path}")
+                else:
+                    errors.append(f"{task.label}: {error}")
+                    log(f"✗ {task.label}: {error}")
+                    if os.path.exists(task.output_path):
+                        os.remove(task.output_path)
+    except FileNotFoundError:
+        return 1, "找不到 ffmpeg", outputs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if errors:
+        return 1, '；'.join(errors), outputs
+    return 0, '', outputs
+
+
+def describe(master):
+    """主播放列表的码率和音轨列表（用于命令行显示）"""
+    lines = []
+    for variant in sorted(master.variants, key=_rank, reverse=True):
+        size = f"{variant.resolution[0]}x{variant.resolution[1]}" if variant.resolution else '-'
+        audio = audio_rendition(master, variant)
+        lines.append(f"  {variant.bandwidth / 1000:>8.0f} kb/s  {size:<10} {variant.codecs or '-':<28} "
+                     f"{'音轨 ' + (audio.name or audio.group_id) if audio else ''}")
+    for rendition in master.renditions:
+        lines.append(f"  {rendition.type:<8} {rendition.group_id or '-':<10} {rendition.name or '-':<12} "
+                     f"{rendition.language or '-':<6}{' 默认' if rendition.default else ''}"
+                     f"{'' if rendition.path else '（在码率分片中）'}")
+    return lines
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        playlist = load_playlist(sys.argv[1])
+        if not playlist.is_master:
+            print("不是主播放列表")
+            sys.exit(1)
+        print(f"{len(playlist.variants)} 个码率，{len(playlist.renditions)} 个备选音视频:")
+        print('\n'.join(describe(playlist)))
+    elif len(sys.argv) >= 3:
+        code, message, _ = export_variants(sys.argv[1], sys.argv[2],
+                                           parse_selection(sys.argv[3] if len(sys.argv) > 3 else 'best'))
+        if code != 0:
+            print(f"导出失败: {message}")
+        sys.exit(code)
+    else:
+        print("用法: python hls_variants.py master.m3u8                  列出码率和音轨")
+        print("      python hls_variants.py master.m3u8 输出.mp4 [best|all|码率]")
+        sys.exit(2)
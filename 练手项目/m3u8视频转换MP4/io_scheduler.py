@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+按磁盘调度的批量转换
+-c copy 转封装几乎全是磁盘读写，同一块磁盘上并发太多反而更慢，中途磁盘写满还会留下损坏的输出。
+调度器根据分片表估算输出大小并预留空间，按源/目标所在设备（st_dev）分别限制并发，
+并根据实测吞吐量自动调整每个设备的并发数
+"""
+
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from conversion_history import playlist_summary
+from m3u8_parser import PlaylistError
+
+# 转封装后的输出大小约等于分片总大小（TS 包头换成 MP4 索引），留一点余量
+OUTPUT_SIZE_RATIO = 1.02
+# 分段/并行转换先写中间文件再拼接，峰值约为两倍
+CHUNKED_SIZE_RATIO = 2.05
+# 每块磁盘始终保留的空闲空间
+DEFAULT_MARGIN_BYTES = 512 * 1024 * 1024
+DEFAULT_PER_DEVICE = 2
+# 吞吐量变化超过这个比例才调整并发数
+ADAPT_THRESHOLD = 0.10
+# 吞吐量的指数滑动平均系数
+EWMA_ALPHA = 0.5
+# 耗时太短的任务（例如按历史记录跳过的）不参与吞吐量统计
+MIN_SAMPLE_SECONDS = 1.0
+
+
+class DiskSpaceError(Exception):
+    """磁盘空间不足以完成转换"""
+
+
+def device_of(path):
+    """路径所在设备号；路径还不存在时取最近的已存在的上级目录"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def estimate_sizes(m3u8_path, engine='auto'):
+    """根据分片表估算 (输入字节数, 需要预留的输出字节数)，远程或无法解析的播放列表返回 (0, 0)"""
+    if '://' in m3u8_path:
+        return 0, 0
+    try:
+        _, input_bytes, _ = playlist_summary(m3u8_path)
+    except (OSError, ValueError, PlaylistError):
+        return 0, 0
+    input_bytes = input_bytes or 0
+    ratio = CHUNKED_SIZE_RATIO if engine in ('resume', 'parallel') else OUTPUT_SIZE_RATIO
+    return input_bytes, int(input_bytes * ratio)
+
+
+class ScheduledTask:
+    """一个待调度的任务；payload 原样传给执行函数"""
+
+    def __init__(self, input_path, output_path, payload=None, engine='auto'):
+        self.input_path = input_path
+        self.output_path = os.path.abspath(output_path)
+        self.payload = payload
+        self.engine = engine
+        self.input_bytes, self.estimate = estimate_sizes(input_path, engine)
+        self.src_dev = None if '://' in input_path else device_of(input_path)
+        self.dst_dev = device_of(os.path.dirname(self.output_path))
+        self.started = None
+        self.level = 1
+
+    @property
+    def devices(self):
+        return {dev for dev in (self.src_dev, self.dst_dev) if dev is not None}
+
+    def written(self):
+        try:
+            return os.path.getsize(self.output_path)
+        except OSError:
+            return 0
+
+
+class _DeviceState:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self.throughput = {}  # 并发数 -> 设备总吞吐量（MB/s，滑动平均）
+
+
+class IOScheduler:
+    """
+    批量任务调度器
+    max_jobs 为总并发上限，max_per_device 为每块磁盘的并发上限；
+    adaptive=True 时每块磁盘从 1 个任务开始，吞吐量随并发增加而提高时逐步放开，下降时收回
+    """
+
+    def __init__(self, max_jobs=4, max_per_device=DEFAULT_PER_DEVICE, margin_bytes=DEFAULT_MARGIN_BYTES,
+                 adaptive=True, log=print):
+        self.max_jobs = max(1, max_jobs)
+        self.max_per_device = max(1, max_per_device)
+        self.margin_bytes = margin_bytes
+        self.adaptive = adaptive
+        self.log = log
+        self._devices = {}
+        self._running = {}
+
+    def _device(self, dev):
+        if dev not in self._devices:
+            self._devices[dev] = _DeviceState(1 if self.adaptive else self.max_per_device)
+        return self._devices[dev]
+
+    def _reserved(self, dev):
+        """目标在 dev 上、正在运行的任务还需要写入的字节数"""
+        return sum(max(task.estimate - task.written(), 0)
+                   for task in self._running.values() if task.dst_dev == dev)
+
+    def _admit(self, task):
+        """返回 'run'（可以开始）、'wait'（等其他任务完成）或不能完成的原因"""
+        for dev in task.devices:
+            if self._device(dev).running >= self._device(dev).limit:
+                return 'wait'
+        if not task.estimate:
+            return 'run'
+        try:
+            free = shutil.disk_usage(os.path.dirname(task.output_path) or '.').free
+        except OSError:
+            return 'run'
+        available = free - self._reserved(task.dst_dev) - self.margin_bytes
+        if task.estimate <= available:
+            return 'run'
+        if not any(t.dst_dev == task.dst_dev for t in self._running.values()):
+            return (f"磁盘空间不足：预计需要 {task.estimate / (1024 * 1024):.0f} MB，"
+                    f"可用 {max(free - self.margin_bytes, 0) / (1024 * 1024):.0f} MB")
+        return 'wait'
+
+    def _start(self, task):
+        task.started = time.time()
+        for dev in task.devices:
+            self._device(dev).running += 1
+        task.level = max([self._device(dev).running for dev in task.devices] or [1])
+
+    def _finish(self, task, ok):
+        elapsed = time.time() - task.started
+        for dev in task.devices:
+            state = self._device(dev)
+            state.running -= 1
+            if ok and self.adaptive and task.input_bytes and elapsed >= MIN_SAMPLE_SECONDS:
+                self._adapt(dev, state, task.level, task.input_bytes / (1024 * 1024) / elapsed * task.level)
+
+    def _adapt(self, dev, state, level, aggregate):
+        """记录 level 个并发时的设备总吞吐量，并据此调整并发上限"""
+        old = state.throughput.get(level)
+        state.throughput[level] = aggregate if old is None else old + EWMA_ALPHA * (aggregate - old)
+        current = state.throughput.get(state.limit)
+        lower = state.throughput.get(state.limit - 1)
+        higher = state.throughput.get(state.limit + 1)
+        if current is None:
+            return
+        if lower is not None and current < lower * (1 - ADAPT_THRESHOLD):
+            state.limit -= 1
+            self.log(f"设备 {dev} 并发 {state.limit + 1} 时吞吐下降（{current:.0f} < {lower:.0f} MB/s），"
+                     f"并发降为 {state.limit}")
+        elif state.limit < self.max_per_device and (higher is None or higher > current * (1 + ADAPT_THRESHOLD)):
+            state.limit += 1
+
+    def run(self, tasks, execute, on_done=None):
+        """
+        调度执行全部任务，execute(task) 在工作线程中运行，返回 False 或 {'ok': False} 表示失败；
+        on_done(task, 结果, 异常) 在调度线程中按完成顺序回调，空间不足被拒绝的任务异常为 DiskSpaceError
+        """
+        pending = list(tasks)
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as pool:
+            while pending or self._running:
+                for task in list(pending):
+                    if len(self._running) >= self.max_jobs:
+                        break
+                    verdict = self._admit(task)
+                    if verdict == 'wait':
+                        continue
+                    pending.remove(task)
+                    if verdict != 'run':
+                        if on_done:
+                            on_done(task, None, DiskSpaceError(verdict))
+                        continue
+                    self._start(task)
+                    self._running[pool.submit(execute, task)] = task
+
+                if not self._running:
+                    continue
+                done, _ = wait(list(self._running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = self._running.pop(future)
+                    error = future.exception()
+                    result = None if error else future.result()
+                    if isinstance(result, dict):
+                        ok = bool(result.get('ok')) and not result.get('skipped')
+                    else:
+                        ok = result is not False
+                    self._finish(task, error is None and ok)
+                    if on_done:
+                        on_done(task, result, error)
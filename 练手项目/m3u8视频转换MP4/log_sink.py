@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+线程安全的日志缓冲
+工作线程只往环形缓冲区追加日志，界面线程定时批量取出显示；
+完整日志同时写入按大小滚动的日志文件
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# 环形缓冲区最多保留的待显示行数，超出时丢弃最旧的行（文件中仍有完整记录）
+DEFAULT_BUFFER_LINES = 5000
+# 单个日志文件大小与保留的历史文件个数
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+
+class LogSink:
+    """日志缓冲：write() 可在任意线程调用，drain() 在界面线程中调用"""
+
+    def __init__(self, log_file=None, buffer_lines=DEFAULT_BUFFER_LINES):
+        self._lines = deque(maxlen=buffer_lines)
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._logger = None
+        self._handler = None
+        if log_file:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+                self._handler = RotatingFileHandler(
+                    log_file,
+                    maxBytes=LOG_FILE_MAX_BYTES,
+                    backupCount=LOG_FILE_BACKUPS,
+                    encoding='utf-8'
+                )
+                self._handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                # 每个实例使用独立的 logger，不向根 logger 传播
+                self._logger = logging.getLogger(f"{__name__}.{id(self)}")
+                self._logger.propagate = False
+                self._logger.setLevel(logging.INFO)
+                self._logger.addHandler(self._handler)
+            except OSError:
+                self._logger = None
+                self._handler = None
+
+    def write(self, message):
+        """追加一条日志（可包含多行）"""
+        with self._lock:
+            for line in message.split('\n'):
+                if len(self._lines) == self._lines.maxlen:
+                    self._dropped += 1
+                self._lines.append(line)
+        if self._logger:
+            self._logger.info(message)
+
+    def drain(self):
+        """取出所有待显示的行，返回 (行列表, 因缓冲区满而丢弃的行数)"""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped = self._dropped
+            self._dropped = 0
+        return lines, dropped
+
+    def close(self):
+        if self._handler:
+            self._logger.removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+            self._logger = None
+
+
+def default_log_file():
+    """默认日志文件：脚本目录下 logs/converter_YYYYMMDD.log"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'logs', f"converter_{time.strftime('%Y%m%d')}.log")
@@ -1,23 +1,46 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import os
 import subprocess
 import sys
 import threading
 import shutil
+import sqlite3
 import time
-import re
 import winreg
+from collections import deque
 from tkinter import (
     Tk, Label, Button, Entry, filedialog, messagebox, 
-    Text, Scrollbar, ttk, Frame
+    Text, Scrollbar, ttk, Frame, IntVar, BooleanVar, Checkbutton
 )
 
+from async_engine import AsyncEngine, plan_ffmpeg_job, run_in_thread
+from chunked_convert import DEFAULT_CHUNK_SECONDS, convert_resumable
+from conversion_history import ConversionHistory, playlist_fingerprint, playlist_summary
+from convert_m3u8_to_mp4 import is_encrypted, parse_ts_segments
+from ffmpeg_progress import run_ffmpeg
+from hls_download import download_hls, is_url
+from io_scheduler import DEFAULT_PER_DEVICE, DiskSpaceError, device_of, estimate_sizes
+from log_sink import LogSink, default_log_file
+from m3u8_parser import PlaylistError, load_playlist, playlist_duration
+from media_probe import MetadataService, ProbeCache, format_duration
+from mp4_verify import is_mp4_path, verify_mp4
+from multi_output import MultiOutputError, commit_outputs, convert_multi, discard_outputs, parse_size
+from segment_check import scan_playlist
+from stream_pipeline import pipeline_convert
+from toolchain import CANDIDATE_DIRS, ffmpeg_command, find_toolchain
+from ts_remux import RemuxError, remux_ts_to_mp4
+
+# 日志区域最多保留的行数，以及界面刷新日志的间隔（毫秒）
+MAX_LOG_WIDGET_LINES = 2000
+LOG_FLUSH_INTERVAL_MS = 200
+
 class M3U8ConverterGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("M3U8 转 MP4 转换工具")
-        self.root.geometry("700x500")
+        self.root.geometry("800x700")
         self.root.resizable(True, True)
         
         # 变量
@@ -27,9 +50,22 @@ class M3U8ConverterGUI:
         self.ffmpeg_installed = False
         self.installing_ffmpeg = False  # 防止重复触发安装
         self.ffmpeg_path = None  # 存储 ffmpeg 的完整路径
+        self.batch_running = False  # 批量转换进行中
+        self.batch_engine = None  # 批量转换的 asyncio 引擎（事件循环在后台线程中）
+        self.batch_jobs = {}  # 批量任务行 -> 运行中的 AsyncJob（界面定时读取进度）
+        self.batch_workers = IntVar(value=min(4, os.cpu_count() or 1))  # 批量并发任务数
+        self.use_builtin_remux = BooleanVar(value=False)  # 使用内置引擎转封装（不调用 ffmpeg）
+        self.use_resume = BooleanVar(value=False)  # 分段转换，可断点续转
+        self.use_pipeline = BooleanVar(value=True)  # 在线地址边下载边转换，不保存分片
+        self.also_m4a = BooleanVar(value=False)  # 同时输出纯音频 M4A（与 MP4 一次读取写出）
+        self.output_targets = None  # MP4 之外的输出（开始转换时读取界面设置）
+        self.log_sink = LogSink(default_log_file())  # 日志先进缓冲区，由界面线程定时批量显示
+        self.history = self._open_history()  # 转换历史（批量转换时跳过已转换过的内容）
+        self.metadata = MetadataService(cache=self._open_probe_cache())  # 媒体信息（ffprobe 结果有缓存）
         
         # 创建界面
         self.create_widgets()
+        self._flush_log()
         
         # 启动时检查 FFmpeg
         self.check_ffmpeg()
@@ -77,7 +113,7 @@ class M3U8ConverterGUI:
         
         Label(
             input_frame, 
-            text="输入文件 (M3U8):", 
+            text="输入文件/网址 (M3U8):", 
             font=("Microsoft YaHei", 10)
         ).pack(anchor='w')
         
@@ -103,6 +139,13 @@ class M3U8ConverterGUI:
             text="选择文件夹...",
             command=self.select_input_folder,
             font=("Microsoft YaHei", 9)
+        ).pack(side='left', padx=(0, 5))
+        
+        Button(
+            input_file_frame,
+            text="批量转换...",
+            command=self.select_batch_folder,
+            font=("Microsoft YaHei", 9)
         ).pack(side='left')
         
         # 输出文件选择
@@ -133,6 +176,45 @@ class M3U8ConverterGUI:
             font=("Microsoft YaHei", 9)
         ).pack(side='left')
         
+        Checkbutton(
+            output_frame,
+            text="使用内置引擎转封装（不调用 ffmpeg，仅支持 H.264/AAC 的 .ts 分片）",
+            variable=self.use_builtin_remux,
+            command=self.update_convert_button_state,
+            font=("Microsoft YaHei", 9)
+        ).pack(anchor='w', pady=(5, 0))
+        
+        Checkbutton(
+            output_frame,
+            text=f"断点续转（每 {DEFAULT_CHUNK_SECONDS // 60} 分钟一段，中断后再次转换从上次完成的段继续）",
+            variable=self.use_resume,
+            font=("Microsoft YaHei", 9)
+        ).pack(anchor='w')
+        
+        Checkbutton(
+            output_frame,
+            text="在线地址边下载边转换（不保存分片；取消勾选则先完整下载再转换）",
+            variable=self.use_pipeline,
+            font=("Microsoft YaHei", 9)
+        ).pack(anchor='w')
+        
+        # 多个输出：MP4 之外同时输出纯音频和按大小分段的 MP4，分片只读取一遍
+        extra_frame = Frame(output_frame)
+        extra_frame.pack(anchor='w', fill='x')
+        Checkbutton(
+            extra_frame,
+            text="同时输出纯音频 M4A",
+            variable=self.also_m4a,
+            font=("Microsoft YaHei", 9)
+        ).pack(side='left')
+        Label(
+            extra_frame,
+            text="  同时按大小分段（MB，留空不分段）:",
+            font=("Microsoft YaHei", 9)
+        ).pack(side='left')
+        self.split_size_entry = Entry(extra_frame, width=8, font=("Microsoft YaHei", 9))
+        self.split_size_entry.pack(side='left')
+        
         # 转换按钮
         self.convert_btn = Button(
             main_frame,
@@ -164,6 +246,68 @@ class M3U8ConverterGUI:
         )
         self.status_label.pack(anchor='w')
         
+        # 批量任务列表（每个任务一行进度）
+        batch_frame = Frame(main_frame)
+        batch_frame.pack(fill='x', pady=(10, 0))
+        
+        batch_header = Frame(batch_frame)
+        batch_header.pack(fill='x')
+        
+        Label(
+            batch_header,
+            text="批量任务:",
+            font=("Microsoft YaHei", 9)
+        ).pack(side='left')
+        
+        Label(
+            batch_header,
+            text="并发任务数:",
+            font=("Microsoft YaHei", 9)
+        ).pack(side='left', padx=(20, 5))
+        
+        ttk.Spinbox(
+            batch_header,
+            from_=1,
+            to=16,
+            width=4,
+            textvariable=self.batch_workers
+        ).pack(side='left')
+        
+        self.cancel_batch_btn = Button(
+            batch_header,
+            text="取消批量",
+            command=self.cancel_batch,
+            font=("Microsoft YaHei", 9),
+            state='disabled'
+        )
+        self.cancel_batch_btn.pack(side='left', padx=(20, 0))
+        
+        batch_tree_frame = Frame(batch_frame)
+        batch_tree_frame.pack(fill='x', pady=(5, 0))
+        
+        batch_scrollbar = Scrollbar(batch_tree_frame)
+        batch_scrollbar.pack(side='right', fill='y')
+        
+        self.batch_tree = ttk.Treeview(
+            batch_tree_frame,
+            columns=('file', 'duration', 'status', 'progress', 'eta'),
+            show='headings',
+            height=6,
+            yscrollcommand=batch_scrollbar.set
+        )
+        self.batch_tree.heading('file', text='M3U8 文件')
+        self.batch_tree.heading('duration', text='时长')
+        self.batch_tree.heading('status', text='状态')
+        self.batch_tree.heading('progress', text='进度')
+        self.batch_tree.heading('eta', text='预计剩余')
+        self.batch_tree.column('file', width=350, anchor='w')
+        self.batch_tree.column('duration', width=70, anchor='center')
+        self.batch_tree.column('status', width=90, anchor='center')
+        self.batch_tree.column('progress', width=70, anchor='center')
+        self.batch_tree.column('eta', width=90, anchor='center')
+        self.batch_tree.pack(side='left', fill='x', expand=True)
+        batch_scrollbar.config(command=self.batch_tree.yview)
+        
         # 日志显示区域
         log_frame = Frame(main_frame)
         log_frame.pack(fill='both', expand=True, pady=(10, 0))
@@ -191,76 +335,68 @@ class M3U8ConverterGUI:
         scrollbar.config(command=self.log_text.yview)
     
     def log(self, message):
-        """添加日志"""
-        self.log_text.insert('end', message + '\n')
-        self.log_text.see('end')
-        self.root.update()
+        """添加日志（任意线程均可调用，界面定时批量刷新）"""
+        self.log_sink.write(message)
     
-    def check_ffmpeg(self):
-        """检查 FFmpeg 是否已安装"""
+    def _flush_log(self):
+        """把缓冲区中的日志一次性写入文本框，并限制文本框的总行数"""
+        lines, dropped = self.log_sink.drain()
+        if lines or dropped:
+            text = '\n'.join(lines) + '\n'
+            if dropped:
+                text = f"...（省略 {dropped} 行，完整日志见日志文件）\n" + text
+            self.log_text.insert('end', text)
+            # 文本以换行结尾，最后一行为空行
+            line_count = int(self.log_text.index('end-1c').split('.')[0]) - 1
+            if line_count > MAX_LOG_WIDGET_LINES:
+                self.log_text.delete('1.0', f"{line_count - MAX_LOG_WIDGET_LINES + 1}.0")
+            self.log_text.see('end')
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
+    
+    def check_ffmpeg(self, refresh=False):
+        """
+        检查 FFmpeg 是否已安装
+        查找和探测结果缓存在 logs/toolchain.json，ffmpeg 可执行文件没有变化时不再运行 ffmpeg -version；
+        refresh=True 时重新查找（安装完成后使用）
+        """
         self.log("正在检查 FFmpeg 安装状态...")
         
-        # 首先检查 D 盘上的 FFmpeg
-        d_ffmpeg_exe = r"D:\ffmpeg-8.0-essentials_build\bin\ffmpeg.exe"
-        if os.path.exists(d_ffmpeg_exe):
-            try:
-                result = subprocess.run(
-                    [d_ffmpeg_exe, '-version'],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if result.returncode == 0:
-                    # 如果 D 盘上有 ffmpeg 但不在 PATH 中，在后台线程中配置
-                    bin_dir = os.path.dirname(d_ffmpeg_exe)
-                    current_path = os.environ.get('PATH', '')
-                    if bin_dir not in current_path:
-                        self.log("检测到 D 盘上的 FFmpeg，但未在 PATH 中，正在后台配置...")
-                        # 在后台线程中配置环境变量，避免阻塞 GUI
-                        thread = threading.Thread(target=self._configure_path_in_thread, args=(bin_dir,))
-                        thread.daemon = True
-                        thread.start()
-                    else:
-                        self.log("✓ D 盘上的 FFmpeg 已在 PATH 中")
-                    
-                    self.ffmpeg_installed = True
-                    self.ffmpeg_path = d_ffmpeg_exe  # 保存完整路径
-                    self.ffmpeg_status_label.config(
-                        text="✓ FFmpeg 已安装 (D盘)",
-                        fg="green"
-                    )
-                    self.install_ffmpeg_btn.config(state='disabled')
-                    self.log("✓ FFmpeg 检测成功！(D盘)")
-                    self.update_convert_button_state()
-                    return True
-            except Exception as e:
-                self.log(f"检查 D 盘 FFmpeg 时出错: {e}")
-        
-        # 检查 ffmpeg 是否在 PATH 中
-        ffmpeg_path = shutil.which('ffmpeg')
+        try:
+            toolchain = find_toolchain(refresh=refresh)
+        except Exception as e:
+            self.log(f"检查 FFmpeg 时出错: {e}")
+            toolchain = None
         
-        if ffmpeg_path:
-            try:
-                # 尝试运行 ffmpeg 获取版本信息
-                result = subprocess.run(
-                    ['ffmpeg', '-version'],
-                    capture_output=True,
-                    text=True,
-                    timeout=5
-                )
-                if result.returncode == 0:
-                    self.ffmpeg_installed = True
-                    self.ffmpeg_path = ffmpeg_path  # 保存路径
-                    self.ffmpeg_status_label.config(
-                        text="✓ FFmpeg 已安装",
-                        fg="green"
-                    )
-                    self.install_ffmpeg_btn.config(state='disabled')
-                    self.log("✓ FFmpeg 检测成功！")
-                    self.update_convert_button_state()
-                    return True
-            except Exception as e:
-                self.log(f"检查 FFmpeg 时出错: {e}")
+        if toolchain and toolchain.ffmpeg:
+            ffmpeg_path = toolchain.ffmpeg.path
+            bin_dir = os.path.dirname(ffmpeg_path)
+            # D 盘上的 FFmpeg 可能还不在 PATH 中
+            on_d = any(os.path.normcase(bin_dir) == os.path.normcase(d) for d in CANDIDATE_DIRS)
+            if on_d:
+                if bin_dir not in os.environ.get('PATH', ''):
+                    self.log("检测到 D 盘上的 FFmpeg，但未在 PATH 中，正在后台配置...")
+                    # 在后台线程中配置环境变量，避免阻塞 GUI
+                    thread = threading.Thread(target=self._configure_path_in_thread, args=(bin_dir,))
+                    thread.daemon = True
+                    thread.start()
+                else:
+                    self.log("✓ D 盘上的 FFmpeg 已在 PATH 中")
+            
+            self.ffmpeg_installed = True
+            self.ffmpeg_path = ffmpeg_path  # 保存完整路径
+            self.ffmpeg_status_label.config(
+                text="✓ FFmpeg 已安装 (D盘)" if on_d else "✓ FFmpeg 已安装",
+                fg="green"
+            )
+            self.install_ffmpeg_btn.config(state='disabled')
+            self.log(f"✓ FFmpeg 检测成功！{'(D盘) ' if on_d else ''}版本 {toolchain.ffmpeg.version}")
+            missing = toolchain.missing_features()
+            if missing:
+                self.log(f"⚠ 当前 FFmpeg 不支持 {', '.join(missing)}，部分视频可能无法转换")
+            if not toolchain.ffprobe:
+                self.log("⚠ 未找到 ffprobe，无法从视频文件读取时长")
+            self.update_convert_button_state()
+            return True
         
         # FFmpeg 未安装
         self.ffmpeg_installed = False
@@ -305,7 +441,7 @@ class M3U8ConverterGUI:
                         self.refresh_environment()
                         time.sleep(2)
                         self.installing_ffmpeg = False
-                        self.root.after(0, lambda: self.check_ffmpeg())
+                        self.root.after(0, lambda: self.check_ffmpeg(refresh=True))
                         return
             
             # 尝试使用本地 ffmpeg-8.0-essentials_build 文件夹（如果还在当前目录）
@@ -318,7 +454,7 @@ class M3U8ConverterGUI:
                     # 等待一下让环境变量生效
                     time.sleep(2)
                     self.installing_ffmpeg = False
-                    self.root.after(0, lambda: self.check_ffmpeg())
+                    self.root.after(0, lambda: self.check_ffmpeg(refresh=True))
                     return
             
             # 尝试使用 winget（Windows 10/11 自带）
@@ -335,7 +471,7 @@ class M3U8ConverterGUI:
                 # 刷新环境变量
                 self.refresh_environment()
                 self.installing_ffmpeg = False
-                self.root.after(0, lambda: self.check_ffmpeg())
+                self.root.after(0, lambda: self.check_ffmpeg(refresh=True))
                 return
             
             # 尝试使用 choco
@@ -351,7 +487,7 @@ class M3U8ConverterGUI:
                 self.log("✓ 使用 Chocolatey 安装成功！")
                 self.refresh_environment()
                 self.installing_ffmpeg = False
-                self.root.after(0, lambda: self.check_ffmpeg())
+                self.root.after(0, lambda: self.check_ffmpeg(refresh=True))
                 return
             
             # 尝试使用 scoop
@@ -367,7 +503,7 @@ class M3U8ConverterGUI:
                 self.log("✓ 使用 Scoop 安装成功！")
                 self.refresh_environment()
                 self.installing_ffmpeg = False
-                self.root.after(0, lambda: self.check_ffmpeg())
+                self.root.after(0, lambda: self.check_ffmpeg(refresh=True))
                 return
             
             # 所有方法都失败
@@ -657,7 +793,393 @@ class M3U8ConverterGUI:
                     return os.path.join(root, file)
         
         return None
-    
+
+    def _find_all_m3u8_in_folder(self, root_folder):
+        """递归查找根目录下所有 m3u8 文件（每个文件夹优先 index.m3u8，找到后不再深入子目录）"""
+        playlists = []
+        for root, dirs, files in os.walk(root_folder):
+            dirs.sort()
+            m3u8_files = sorted(f for f in files if f.lower().endswith('.m3u8'))
+            if not m3u8_files:
+                continue
+            if 'index.m3u8' in (f.lower() for f in m3u8_files):
+                m3u8_files = [f for f in m3u8_files if f.lower() == 'index.m3u8']
+            playlists.extend(os.path.join(root, f) for f in m3u8_files)
+            # 子文件夹已作为一个任务，其子目录通常是分片或子码率，不再重复收集
+            if os.path.abspath(root) != os.path.abspath(root_folder):
+                dirs[:] = []
+        return playlists
+
+    def _batch_output_path(self, root_folder, playlist_path):
+        """生成批量任务的输出路径，返回 (输出路径, 需删除的源文件夹或 None)"""
+        folder = os.path.dirname(playlist_path)
+        if (os.path.basename(playlist_path).lower() == 'index.m3u8'
+                and os.path.normcase(os.path.abspath(folder)) != os.path.normcase(os.path.abspath(root_folder))):
+            # 与"选择文件夹"一致：以文件夹命名，保存在父目录
+            folder_name = os.path.basename(folder)
+            if folder_name.lower().endswith('.m3u8'):
+                folder_name = folder_name[:-5]
+            return os.path.join(os.path.dirname(folder), f"{folder_name}.mp4"), folder
+        return os.path.splitext(playlist_path)[0] + '.mp4', None
+
+    def _interleave_jobs_by_device(self, jobs):
+        """按源文件所在磁盘轮流排列任务，避免并发任务集中在同一块磁盘上"""
+        groups = {}
+        for job in jobs:
+            try:
+                dev = os.stat(job[0]).st_dev
+            except OSError:
+                dev = None
+            groups.setdefault(dev, deque()).append(job)
+        ordered = []
+        queues = list(groups.values())
+        while queues:
+            for q in list(queues):
+                ordered.append(q.popleft())
+                if not q:
+                    queues.remove(q)
+        return ordered
+
+    def _get_batch_workers(self):
+        """读取并发任务数（限制在 1~16）"""
+        try:
+            workers = int(self.batch_workers.get())
+        except Exception:
+            workers = 1
+        return max(1, min(16, workers))
+
+    def select_batch_folder(self):
+        """选择根目录，批量转换其中所有 m3u8 文件"""
+        if self.batch_running:
+            messagebox.showwarning("提示", "批量转换正在进行中")
+            return
+        if not self._converter_available():
+            messagebox.showerror("错误", "FFmpeg 未安装，无法转换")
+            return
+
+        folder = filedialog.askdirectory(
+            title="选择批量转换的根目录"
+        )
+        if not folder:
+            return
+
+        playlists = self._find_all_m3u8_in_folder(folder)
+        if not playlists:
+            messagebox.showwarning(
+                "未找到文件",
+                f"在文件夹中未找到 M3U8 文件:\n{folder}"
+            )
+            self.log(f"在文件夹中未找到 M3U8 文件: {folder}")
+            return
+
+        jobs = []
+        for playlist in playlists:
+            output_path, source_folder = self._batch_output_path(folder, playlist)
+            jobs.append((playlist, output_path, source_folder))
+        jobs = self._interleave_jobs_by_device(jobs)
+
+        # 每个任务一行进度
+        for iid in self.batch_tree.get_children():
+            self.batch_tree.delete(iid)
+        rows = []
+        for playlist, output_path, source_folder in jobs:
+            iid = self.batch_tree.insert(
+                '', 'end',
+                values=(os.path.relpath(playlist, folder), '--:--:--', '等待中', '--', '--:--:--')
+            )
+            rows.append((iid, playlist, output_path, source_folder))
+        self._fill_batch_metadata(rows)
+
+        workers = self._get_batch_workers()
+        self.log(f"\n批量转换: {folder}")
+        self.log(f"共找到 {len(rows)} 个 M3U8 文件，并发任务数: {workers}")
+
+        self.batch_running = True
+        self.convert_btn.config(state='disabled')
+        self.cancel_batch_btn.config(state='normal')
+        self.status_label.config(text=f"批量转换中 (0/{len(rows)})...", fg="blue")
+
+        # 全部任务由一个后台事件循环调度：排队中的任务不占线程，进度由界面定时读取
+        self.batch_engine = AsyncEngine(max_jobs=workers, max_per_device=max(DEFAULT_PER_DEVICE, workers // 2))
+        self.batch_engine.start()
+        self.batch_jobs = {}
+        done = {'ok': 0, 'fail': 0}
+        start_wall = time.time()
+        future = self.batch_engine.submit(self._batch_async(rows, done))
+        self.root.after(500, lambda: self._poll_batch(future, len(rows), done, start_wall))
+
+    def cancel_batch(self):
+        """取消批量转换：排队中的任务不再开始，运行中的 ffmpeg 被结束"""
+        if self.batch_running and self.batch_engine is not None:
+            self.log("正在取消批量转换...")
+            self.cancel_batch_btn.config(state='disabled')
+            self.batch_engine.cancel_all()
+
+    async def _batch_async(self, rows, done):
+        """在事件循环中并发运行全部批量任务（并发数、每块磁盘的并发和输出空间由引擎控制）"""
+        def on_done(index, result, error):
+            if isinstance(error, DiskSpaceError):
+                self.log(f"✗ {rows[index][1]}: {error}")
+                self._set_batch_row(rows[index][0], status='空间不足')
+            done['ok' if error is None and result else 'fail'] += 1
+
+        await self.batch_engine.gather([self._batch_job_async(*row) for row in rows], on_done)
+
+    def _poll_batch(self, future, total, done, start_wall):
+        """在主线程中定时刷新运行中任务的进度，全部结束后显示汇总"""
+        for iid, job in list(self.batch_jobs.items()):
+            if job.state != 'running':
+                continue
+            ratio = job.ratio
+            if ratio is not None:
+                self._update_batch_row(iid, status='转换中', progress=f"{ratio * 100.0:.1f}%",
+                                       eta=self._format_hhmmss(job.eta_seconds() or 0))
+            elif job.progress is not None and job.progress.out_time_us is not None:
+                self._update_batch_row(iid, status='转换中', progress=self._format_hhmmss(job.progress.out_time_sec))
+            else:
+                self._update_batch_row(iid, status='转换中')
+        finished = done['ok'] + done['fail']
+        if not future.done():
+            self.status_label.config(text=f"批量转换中 ({finished}/{total})...", fg="blue")
+            self.root.after(500, lambda: self._poll_batch(future, total, done, start_wall))
+            return
+
+        self.batch_engine.close()
+        self.batch_engine = None
+        self.batch_jobs = {}
+        elapsed = time.time() - start_wall
+        summary = f"批量转换完成：成功 {done['ok']}，失败 {done['fail']}"
+        if finished < total:
+            summary += f"，取消 {total - finished}"
+        summary += f"，耗时 {self._format_hhmmss(elapsed)}"
+        self.log(f"\n{summary}")
+        self.batch_running = False
+        self.cancel_batch_btn.config(state='disabled')
+        self.status_label.config(text=summary, fg="green" if finished == total and done['fail'] == 0 else "red")
+        messagebox.showinfo("批量转换", summary)
+        self.update_convert_button_state()
+
+    def _update_batch_row(self, iid, status=None, progress=None, eta=None, duration=None):
+        """更新批量任务行（只能在主线程中调用）"""
+        values = list(self.batch_tree.item(iid, 'values'))
+        if duration is not None:
+            values[1] = duration
+        if status is not None:
+            values[2] = status
+        if progress is not None:
+            values[3] = progress
+        if eta is not None:
+            values[4] = eta
+        self.batch_tree.item(iid, values=values)
+
+    def _set_batch_row(self, iid, status=None, progress=None, eta=None, duration=None):
+        """在主线程中更新批量任务行（可从任意线程调用）"""
+        self.root.after(0, lambda: self._update_batch_row(iid, status, progress, eta, duration))
+
+    def _fill_batch_metadata(self, rows):
+        """在后台读取每个任务的时长填入批量列表：缓存命中的立即显示，其余由 ffprobe 线程池陆续补齐"""
+        iids = {os.path.abspath(row[1]): row[0] for row in rows}
+
+        def on_result(path, info):
+            if path in iids and info.get('duration'):
+                self._set_batch_row(iids[path], duration=format_duration(info['duration']))
+
+        def run():
+            try:
+                self.metadata.probe_many(list(iids), on_result=on_result)
+            except Exception as e:
+                self.log(f"读取媒体信息失败: {e}")
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _batch_job(self, iid, input_path, output_path, source_folder):
+        """执行单个批量任务，返回是否成功"""
+        try:
+            input_path = os.path.abspath(input_path)
+            output_path = os.path.abspath(output_path)
+
+            # 内容与已成功转换过的一致且输出仍然完好时跳过（不删除源文件）
+            fingerprint = self._history_fingerprint(input_path)
+            done = self.history.find_converted(fingerprint, output_path) if fingerprint else None
+            if done:
+                self.log(f"已转换过，跳过: {input_path} -> {done.output_path}")
+                self._set_batch_row(iid, status='已跳过', progress='100.0%', eta='00:00:00')
+                return True
+
+            self._set_batch_row(iid, status='转换中', progress='0.0%')
+            start_time = time.time()
+
+            total_duration_sec = self._estimate_duration_seconds(input_path)
+
+            def on_progress(ratio, eta_sec, progress_time_sec, total_sec):
+                if ratio is not None:
+                    self._set_batch_row(iid, progress=f"{ratio * 100.0:.1f}%", eta=self._format_hhmmss(eta_sec))
+                else:
+                    self._set_batch_row(iid, progress=self._format_hhmmss(progress_time_sec))
+
+            returncode, error_tail = self._run_conversion(
+                input_path, output_path, total_duration_sec, on_progress, verbose=False
+            )
+            if returncode == 0:
+                returncode, error_tail = self._verify_output(input_path, output_path)
+            self._record_history(input_path, fingerprint, output_path, returncode == 0, start_time, error_tail)
+            if returncode == 0:
+                self.log(f"✓ 转换成功: {output_path}")
+                self._delete_source_files(input_path, source_folder)
+                self._set_batch_row(iid, status='完成', progress='100.0%', eta='00:00:00')
+                return True
+
+            self.log(f"✗ 转换失败 (返回码: {returncode}): {input_path}")
+            if error_tail:
+                self.log(f"错误信息: {error_tail}")
+            self._set_batch_row(iid, status='失败')
+            return False
+        except Exception as e:
+            self.log(f"✗ 转换出错: {input_path}: {e}")
+            self._set_batch_row(iid, status='出错')
+            return False
+
+    async def _batch_job_async(self, iid, input_path, output_path, source_folder):
+        """
+        执行单个批量任务，返回是否成功
+        本地播放列表用 ffmpeg 转换时由引擎直接运行 ffmpeg，不占用线程；
+        内置引擎、分段转换和加密分片等仍在线程中执行 _batch_job，但同样占用引擎的运行名额
+        """
+        input_path = os.path.abspath(input_path)
+        output_path = os.path.abspath(output_path)
+        job = None
+        try:
+            plan = None
+            if not self.use_builtin_remux.get() and not self.use_resume.get():
+                plan = await asyncio.to_thread(plan_ffmpeg_job, input_path, output_path,
+                                               ffmpeg_cmd=self._resolve_ffmpeg_cmd())
+            if plan is None:
+                engine = 'resume' if self.use_resume.get() else 'auto'
+                _, estimate = await asyncio.to_thread(estimate_sizes, input_path, engine)
+                devices = {device_of(input_path), device_of(output_path)}
+                async with self.batch_engine.slot(devices, output_path, estimate):
+                    # 线程中的转换无法中途结束，取消时等它完成后再退出（排队中的任务不再开始）
+                    return await run_in_thread(self._batch_job, iid, input_path, output_path, source_folder)
+
+            job, targets = plan
+            # 内容与已成功转换过的一致且输出仍然完好时跳过（不删除源文件）
+            fingerprint = await asyncio.to_thread(self._history_fingerprint, input_path)
+            done = (await asyncio.to_thread(self.history.find_converted, fingerprint, output_path)
+                    if fingerprint else None)
+            if done:
+                self.log(f"已转换过，跳过: {input_path} -> {done.output_path}")
+                self._set_batch_row(iid, status='已跳过', progress='100.0%', eta='00:00:00')
+                return True
+
+            start_time = time.time()
+            problem = await asyncio.to_thread(self._preflight_check, input_path, False)
+            if problem:
+                returncode, error_tail = -1, problem
+            else:
+                self._set_batch_row(iid, status='排队中')
+                self.batch_jobs[iid] = job
+                try:
+                    await self.batch_engine.run(job)
+                finally:
+                    self.batch_jobs.pop(iid, None)
+                # ffmpeg 写入临时文件，成功后才替换输出；失败时上次的输出保持不变
+                if job.ok:
+                    await asyncio.to_thread(commit_outputs, targets)
+                    returncode, error_tail = await asyncio.to_thread(self._verify_output, input_path, output_path)
+                else:
+                    returncode, error_tail = job.returncode or 1, job.error
+                    await asyncio.to_thread(discard_outputs, targets)
+            await asyncio.to_thread(self._record_history, input_path, fingerprint, output_path, returncode == 0,
+                                    start_time, error_tail)
+            if returncode == 0:
+                self.log(f"✓ 转换成功: {output_path}")
+                await asyncio.to_thread(self._delete_source_files, input_path, source_folder)
+                self._set_batch_row(iid, status='完成', progress='100.0%', eta='00:00:00')
+                return True
+
+            self.log(f"✗ 转换失败 (返回码: {returncode}): {input_path}")
+            if error_tail:
+                self.log(f"错误信息: {error_tail}")
+            self._set_batch_row(iid, status='超时' if job.state == 'timeout' else '失败')
+            return False
+        except asyncio.CancelledError:
+            # ffmpeg 已被结束，不完整的临时文件不保留
+            if job is not None:
+                discard_outputs(targets)
+            self._set_batch_row(iid, status='已取消')
+            raise
+        except Exception as e:
+            self.log(f"✗ 转换出错: {input_path}: {e}")
+            self._set_batch_row(iid, status='出错')
+            return False
+
+    def _verify_output(self, input_path, output_path, check_duration=True):
+        """
+        校验 MP4 输出（box 结构完整、有 moov 和 mdat、轨道时长与播放列表 #EXTINF 总时长一致），
+        返回 (返回码, 错误信息)；非 MP4 输出不校验，check_duration 为 False 时不比较时长（按大小分段的输出）
+        """
+        if not is_mp4_path(output_path):
+            return 0, ''
+        expected = None
+        if check_duration and not is_url(input_path) and input_path.lower().endswith('.m3u8'):
+            try:
+                expected = playlist_duration(input_path)
+            except (OSError, PlaylistError):
+                expected = None
+        report = verify_mp4(output_path, expected)
+        self.log(report.summary())
+        if report.ok:
+            return 0, ''
+        return 1, '；'.join(report.problems)
+
+    def _open_probe_cache(self):
+        try:
+            return ProbeCache()
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"无法打开媒体信息缓存: {e}")
+            return None
+
+    def _open_history(self):
+        try:
+            return ConversionHistory()
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"无法打开转换历史记录: {e}")
+            return None
+
+    def _history_fingerprint(self, input_path):
+        """播放列表的内容指纹，无法计算或未启用历史记录时返回 None"""
+        if self.history is None or not input_path.lower().endswith('.m3u8'):
+            return None
+        try:
+            return playlist_fingerprint(input_path)
+        except (OSError, PlaylistError):
+            return None
+
+    def _record_history(self, input_path, fingerprint, output_path, ok, start_time, error=None):
+        """把转换结果和耗时写入历史记录（必须在删除源文件之前调用）"""
+        if not fingerprint:
+            return
+        try:
+            segments, input_bytes, duration = playlist_summary(input_path)
+        except (OSError, PlaylistError):
+            segments = input_bytes = duration = None
+        if self.use_builtin_remux.get():
+            engine = 'remux'
+        elif self.use_resume.get():
+            engine = 'resume'
+        else:
+            engine = 'ffmpeg'
+        try:
+            self.history.record(
+                input_path, fingerprint, output_path, ok, engine=engine, started_at=start_time,
+                wall_time=time.time() - start_time, segments=segments, input_bytes=input_bytes,
+                duration=duration, error=None if ok else error
+            )
+        except sqlite3.Error as e:
+            self.log(f"写入转换历史记录失败: {e}")
+
     def _update_output_filename(self, input_path):
         """根据输入文件路径自动更新输出文件名"""
         # 获取输入文件的目录和文件名（不含扩展名）
@@ -692,15 +1214,17 @@ class M3U8ConverterGUI:
         self.output_entry.insert(0, output_path)
         self.log(f"自动设置输出文件: {output_path}")
     
-    def _delete_source_files(self, input_path):
-        """删除源文件或源文件夹"""
+    def _delete_source_files(self, input_path, folder_path=None):
+        """删除源文件或源文件夹（folder_path 为空时使用当前选择的文件夹）"""
+        if folder_path is None:
+            folder_path = self.output_folder_path
         try:
             # 如果之前选择了文件夹，删除整个文件夹
-            if self.output_folder_path and os.path.exists(self.output_folder_path):
-                self.log(f"正在删除源文件夹: {self.output_folder_path}")
+            if folder_path and os.path.exists(folder_path):
+                self.log(f"正在删除源文件夹: {folder_path}")
                 try:
-                    shutil.rmtree(self.output_folder_path)
-                    self.log(f"✓ 源文件夹已删除: {self.output_folder_path}")
+                    shutil.rmtree(folder_path)
+                    self.log(f"✓ 源文件夹已删除: {folder_path}")
                 except Exception as e:
                     self.log(f"✗ 删除源文件夹失败: {e}")
             # 否则只删除 m3u8 文件
@@ -730,19 +1254,27 @@ class M3U8ConverterGUI:
             self.output_entry.insert(0, filename)
             self.log(f"已选择输出文件: {filename}")
     
+    def _converter_available(self):
+        """FFmpeg 已安装或选择了内置引擎时可以转换"""
+        return self.ffmpeg_installed or self.use_builtin_remux.get()
+    
     def update_convert_button_state(self):
         """更新转换按钮状态"""
-        if self.ffmpeg_installed and self.input_file:
+        if self._converter_available() and self.input_file and not self.batch_running:
             self.convert_btn.config(state='normal')
         else:
             self.convert_btn.config(state='disabled')
     
     def start_conversion(self):
         """开始转换"""
-        if not self.ffmpeg_installed:
+        if not self._converter_available():
             messagebox.showerror("错误", "FFmpeg 未安装，无法转换")
             return
         
+        if self.batch_running:
+            messagebox.showwarning("提示", "批量转换正在进行中")
+            return
+        
         self.input_file = self.input_entry.get()
         self.output_file = self.output_entry.get()
         
@@ -754,10 +1286,16 @@ class M3U8ConverterGUI:
             messagebox.showerror("错误", "请指定输出文件")
             return
         
-        if not os.path.exists(self.input_file):
+        if not is_url(self.input_file) and not os.path.exists(self.input_file):
             messagebox.showerror("错误", f"输入文件不存在: {self.input_file}")
             return
         
+        try:
+            self.output_targets = self._output_targets()
+        except MultiOutputError as e:
+            messagebox.showerror("错误", f"分段大小无效: {e}")
+            return
+        
         # 禁用按钮
         self.convert_btn.config(state='disabled')
         self.status_label.config(text="正在转换...", fg="blue")
@@ -771,15 +1309,26 @@ class M3U8ConverterGUI:
     def _convert_thread(self):
         """在后台线程中执行转换"""
         try:
-            input_path = os.path.abspath(self.input_file)
             output_path = os.path.abspath(self.output_file)
+            source_folder = None
+            specs = self.output_targets
+            # 多个输出按大小分段需要分片大小，在线地址先下载
+            if is_url(self.input_file) and self.use_pipeline.get() and not specs:
+                input_path = self.input_file
+            elif is_url(self.input_file):
+                # 在线播放列表先下载到输出文件旁的临时目录，转换成功后随源文件一起删除
+                self.log(f"\n开始下载: {self.input_file}")
+                source_folder = os.path.splitext(output_path)[0] + '.download'
+                input_path = self._download_playlist(self.input_file, source_folder)
+            else:
+                input_path = os.path.abspath(self.input_file)
             
             self.log(f"\n开始转换...")
             self.log(f"输入文件: {input_path}")
             self.log(f"输出文件: {output_path}")
             
-            # 预估总时长（优先从 m3u8 汇总 EXTINF，其次尝试 ffprobe）
-            total_duration_sec = self._estimate_duration_seconds(input_path)
+            # 预估总时长（优先从 m3u8 汇总 EXTINF，其次尝试 ffprobe；边下载边转换时由播放列表得到）
+            total_duration_sec = None if is_url(input_path) else self._estimate_duration_seconds(input_path)
             if total_duration_sec:
                 self.root.after(0, lambda: self.progress_line_label.config(
                     text=f"进度：0.0% | 预计剩余：--:--:-- (总时长 {self._format_hhmmss(total_duration_sec)})",
@@ -791,88 +1340,35 @@ class M3U8ConverterGUI:
                     fg="blue"
                 ))
 
-            # 获取 ffmpeg 路径（优先使用完整路径，如果环境变量未生效也能工作）
-            if self.ffmpeg_path and os.path.exists(self.ffmpeg_path):
-                ffmpeg_cmd = self.ffmpeg_path
+            fingerprint = None if is_url(input_path) else self._history_fingerprint(input_path)
+            start_time = time.time()
+            if specs:
+                returncode, error_msg, outputs = self._run_multi(
+                    input_path, output_path, specs, total_duration_sec, self._show_single_progress
+                )
             else:
-                # 尝试从 PATH 中查找
-                ffmpeg_cmd = shutil.which('ffmpeg') or 'ffmpeg'
-            
-            # 构建 ffmpeg 命令
-            cmd = [
-                ffmpeg_cmd,
-                '-i', input_path,
-                '-c', 'copy',
-                '-bsf:a', 'aac_adtstoasc',
-                '-y',  # 覆盖输出文件
-                output_path
-            ]
-            
-            self.log(f"执行命令: {' '.join(cmd)}")
-            
-            # 执行转换
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            # 实时读取输出
-            start_wall = time.time()
-            last_update_ts = 0.0
-            progress_time_sec = 0.0
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    self.log(output.strip())
-                    # 解析 ffmpeg 进度时间字段，如 time=00:01:23.45
-                    match = re.search(r"time=(\d{2}):(\d{2}):(\d{2})(?:[\.,](\d{1,2}))?", output)
-                    if match:
-                        hh = int(match.group(1))
-                        mm = int(match.group(2))
-                        ss = int(match.group(3))
-                        ff = match.group(4)
-                        frac = (int(ff) / (10 ** len(ff))) if ff else 0.0
-                        progress_time_sec = hh * 3600 + mm * 60 + ss + frac
-
-                        # 若总时长未知，尝试从 ffprobe 获取一次
-                        if not total_duration_sec:
-                            total_duration_sec = self._probe_duration_seconds(input_path)
-
-                        now = time.time()
-                        if now - last_update_ts >= 0.5:
-                            last_update_ts = now
-                            if total_duration_sec and total_duration_sec > 0:
-                                ratio = min(max(progress_time_sec / total_duration_sec, 0.0), 1.0)
-                                percent = ratio * 100.0
-                                elapsed_wall = now - start_wall
-                                eta_sec = int(elapsed_wall * (1.0 / ratio - 1.0)) if ratio > 0 else 0
-                                self.root.after(0, lambda p=percent, e=eta_sec, t=total_duration_sec: self.progress_line_label.config(
-                                    text=f"进度：{p:.1f}% | 预计剩余：{self._format_hhmmss(e)} (总时长 {self._format_hhmmss(t)})",
-                                    fg="blue"
-                                ))
-                            else:
-                                self.root.after(0, lambda pt=progress_time_sec: self.progress_line_label.config(
-                                    text=f"已处理：{self._format_hhmmss(int(pt))} | 正在估算总时长...",
-                                    fg="blue"
-                                ))
-            
-            returncode = process.poll()
+                returncode, error_msg = self._run_conversion(
+                    input_path, output_path, total_duration_sec, self._show_single_progress
+                )
+                outputs = [output_path]
+            if returncode == 0:
+                # 删除源文件之前先校验输出，校验不通过按失败处理（保留源文件）；分段输出不比较总时长
+                for path in outputs:
+                    full_length = path == output_path or path.lower().endswith('.m4a')
+                    returncode, error_msg = self._verify_output(input_path, path, check_duration=full_length)
+                    if returncode != 0:
+                        break
+            self._record_history(input_path, fingerprint, output_path, returncode == 0, start_time, error_msg)
             
             if returncode == 0:
                 self.log("\n✓ 转换成功！")
-                if os.path.exists(output_path):
-                    file_size = os.path.getsize(output_path)
-                    size_mb = file_size / (1024 * 1024)
-                    self.log(f"输出文件大小: {size_mb:.2f} MB")
+                for path in outputs:
+                    if os.path.exists(path):
+                        size_mb = os.path.getsize(path) / (1024 * 1024)
+                        self.log(f"输出文件大小: {size_mb:.2f} MB  {path}")
                 
                 # 删除源文件
-                self._delete_source_files(input_path)
+                self._delete_source_files(input_path, source_folder)
                 
                 # 完成时将进度显示为 100%
                 self.root.after(0, lambda: self.progress_line_label.config(
@@ -880,15 +1376,15 @@ class M3U8ConverterGUI:
                     fg="green"
                 ))
                 
+                output_names = '\n'.join(outputs)
                 self.root.after(0, lambda: messagebox.showinfo(
                     "转换成功",
-                    f"转换完成！\n\n输出文件: {output_path}\n\n源文件已删除。"
+                    f"转换完成！\n\n输出文件: {output_names}\n\n源文件已删除。"
                 ))
                 self.root.after(0, lambda: self.status_label.config(
                     text="转换成功！", fg="green"
                 ))
             else:
-                error_msg = process.stderr.read()
                 self.log(f"\n✗ 转换失败 (返回码: {returncode})")
                 self.log(f"错误信息: {error_msg}")
                 self.root.after(0, lambda: messagebox.showerror(
@@ -914,6 +1410,240 @@ class M3U8ConverterGUI:
             self.root.after(0, lambda: self.convert_btn.config(state='normal'))
             self.root.after(0, lambda: self.update_convert_button_state())
 
+    def _download_playlist(self, url, download_dir):
+        """下载在线播放列表，在进度行显示下载进度，返回本地播放列表路径"""
+        start_wall = time.time()
+
+        def on_progress(done_bytes, done, total):
+            speed = done_bytes / (1024 * 1024) / max(time.time() - start_wall, 1e-6)
+            self.root.after(0, lambda: self.progress_line_label.config(
+                text=f"下载中：{done}/{total} 个分片 | {speed:.1f} MB/s",
+                fg="blue"
+            ))
+
+        result = download_hls(url, download_dir, on_progress=on_progress, log=self.log)
+        return result.playlist_path
+
+    def _show_single_progress(self, ratio, eta_sec, progress_time_sec, total_duration_sec):
+        """更新单文件转换的进度行"""
+        if ratio is not None:
+            self.root.after(0, lambda p=ratio * 100.0, e=eta_sec, t=total_duration_sec: self.progress_line_label.config(
+                text=f"进度：{p:.1f}% | 预计剩余：{self._format_hhmmss(e)} (总时长 {self._format_hhmmss(t)})",
+                fg="blue"
+            ))
+        else:
+            self.root.after(0, lambda pt=progress_time_sec: self.progress_line_label.config(
+                text=f"已处理：{self._format_hhmmss(int(pt))} | 正在估算总时长...",
+                fg="blue"
+            ))
+
+    def _run_conversion(self, input_path, output_path, total_duration_sec, on_progress, verbose=True):
+        """根据设置选择内置引擎或 ffmpeg 执行转换，返回 (返回码, 错误信息)"""
+        if is_url(input_path):
+            return self._run_pipeline(input_path, output_path, on_progress, verbose)
+        if input_path.lower().endswith('.m3u8'):
+            problem = self._preflight_check(input_path, verbose)
+            if problem:
+                return -1, problem
+            if is_encrypted(input_path):
+                # AES-128 加密分片由内置解密处理，不依赖 ffmpeg 解析密钥地址
+                if verbose:
+                    self.log("检测到 AES-128 加密分片，使用内置解密")
+                return self._run_pipeline(input_path, output_path, on_progress, verbose)
+        if self.use_builtin_remux.get():
+            return self._run_builtin_remux(input_path, output_path, total_duration_sec, on_progress, verbose)
+        if self.use_resume.get() and input_path.lower().endswith('.m3u8'):
+            return self._run_resumable(input_path, output_path, on_progress, verbose)
+        return self._run_ffmpeg(input_path, output_path, total_duration_sec, on_progress, verbose)
+
+    def _output_targets(self):
+        """MP4 之外的输出选项，返回 multi_output 的输出类型列表；只输出 MP4 时返回 None"""
+        specs = [('mp4', None)]
+        if self.also_m4a.get():
+            specs.append(('m4a', None))
+        split_mb = self.split_size_entry.get().strip()
+        if split_mb:
+            specs.append(('split', parse_size(split_mb if split_mb[-1].isalpha() else split_mb + 'M')))
+        return specs if len(specs) > 1 else None
+
+    def _run_multi(self, input_path, output_path, specs, total_duration_sec, on_progress):
+        """一次读取写出 MP4、M4A 和分段 MP4，返回 (返回码, 错误信息, 输出文件列表)"""
+        if not input_path.lower().endswith('.m3u8'):
+            return -1, "同时输出多个文件只支持 m3u8 播放列表", []
+        if not load_playlist(input_path).is_master:
+            problem = self._preflight_check(input_path)
+            if problem:
+                return -1, problem, []
+        return convert_multi(
+            input_path, output_path, specs,
+            ffmpeg_cmd=self._resolve_ffmpeg_cmd(),
+            on_progress=self._make_progress_handler(input_path, total_duration_sec, on_progress),
+            on_stderr=self.log,
+            log=self.log
+        )
+
+    def _run_pipeline(self, source, output_path, on_progress, verbose=True):
+        """边下载边转封装，进度按已写入的分片时长计算"""
+        start_wall = time.time()
+        state = {'last': 0.0}
+
+        def progress(done, total, done_sec, total_sec):
+            now = time.time()
+            if (now - state['last'] < 0.5 and done < total) or not total_sec:
+                return
+            state['last'] = now
+            ratio = min(done_sec / total_sec, 1.0)
+            eta_sec = int((now - start_wall) * (1.0 / ratio - 1.0)) if ratio > 0 else 0
+            on_progress(ratio, eta_sec, done_sec, total_sec)
+
+        return pipeline_convert(
+            source, output_path,
+            muxer='native' if self.use_builtin_remux.get() else 'ffmpeg',
+            ffmpeg_cmd=self._resolve_ffmpeg_cmd(),
+            on_progress=progress,
+            log=self.log if verbose else (lambda message: None)
+        )
+
+    def _preflight_check(self, input_path, verbose=True):
+        """
+        检查分片是否缺失、为空或损坏，有问题时返回错误描述，否则返回 None
+        播放列表中有无法解析的标签时跳过检查，交给 ffmpeg 处理
+        """
+        try:
+            report = scan_playlist(input_path)
+        except PlaylistError as e:
+            self.log(f"跳过分片检查: {e}")
+            return None
+        except OSError as e:
+            return f"分片检查失败: {e}"
+        if report.ok:
+            if verbose:
+                self.log(report.summary())
+            return None
+        return '\n'.join([report.summary()] + report.lines())
+
+    def _run_resumable(self, input_path, output_path, on_progress, verbose=True):
+        """分段转换，断点清单保存在输出文件旁，失败或关闭程序后再次转换会从断点继续"""
+        start_wall = time.time()
+        state = {'last': 0.0, 'first_done': None}
+
+        def progress(done_sec, total_sec):
+            now = time.time()
+            if now - state['last'] < 0.5 or not total_sec:
+                return
+            state['last'] = now
+            ratio = min(max(done_sec / total_sec, 0.0), 1.0)
+            # 续转时只按本次运行新完成的部分估算剩余时间
+            if state['first_done'] is None:
+                state['first_done'] = done_sec
+            new_done = done_sec - state['first_done']
+            eta_sec = int((now - start_wall) * (total_sec - done_sec) / new_done) if new_done > 0 else 0
+            on_progress(ratio, eta_sec, done_sec, total_sec)
+
+        try:
+            return convert_resumable(
+                input_path, output_path,
+                ffmpeg_cmd=self._resolve_ffmpeg_cmd(),
+                on_progress=progress,
+                log=self.log if verbose else (lambda message: None)
+            )
+        except Exception as e:
+            return 1, str(e)
+
+    def _run_builtin_remux(self, input_path, output_path, total_duration_sec, on_progress, verbose=True):
+        """使用内置引擎转封装，进度按已读取的字节数估算"""
+        segments = parse_ts_segments(input_path)
+        if not segments:
+            return 1, "播放列表不是本地未加密的 .ts 分片，无法使用内置引擎"
+        if verbose:
+            self.log(f"使用内置引擎转封装: {len(segments)} 个分片")
+
+        start_wall = time.time()
+        state = {'last': 0.0}
+
+        def progress(done_bytes, total_bytes):
+            now = time.time()
+            if now - state['last'] < 0.5 or not total_bytes:
+                return
+            state['last'] = now
+            ratio = min(done_bytes / total_bytes, 1.0)
+            eta_sec = int((now - start_wall) * (1.0 / ratio - 1.0)) if ratio > 0 else 0
+            on_progress(ratio, eta_sec, (total_duration_sec or 0) * ratio, total_duration_sec or 0)
+
+        try:
+            bytes_in, _ = remux_ts_to_mp4(segments, output_path, progress)
+        except (OSError, RemuxError) as e:
+            return 1, str(e)
+        if verbose:
+            elapsed = max(time.time() - start_wall, 1e-6)
+            self.log(f"内置引擎处理 {bytes_in / (1024 * 1024):.2f} MB，"
+                     f"{bytes_in / (1024 * 1024) / elapsed:.1f} MB/s")
+        return 0, ''
+
+    def _resolve_ffmpeg_cmd(self):
+        """获取 ffmpeg 路径（优先使用完整路径，如果环境变量未生效也能工作）"""
+        if self.ffmpeg_path and os.path.exists(self.ffmpeg_path):
+            return self.ffmpeg_path
+        return ffmpeg_command()
+
+    def _make_progress_handler(self, input_path, total_duration_sec, on_progress, offset_sec=0.0):
+        """
+        把 ffmpeg 的进度转换为 on_progress(ratio, eta_sec, progress_time_sec, total_duration_sec) 回调
+        offset_sec 为之前已完成部分的时长（分段转换时使用）
+        """
+        state = {'total': total_duration_sec, 'probed': bool(total_duration_sec), 'start': time.time()}
+
+        def handle(progress):
+            if progress.out_time_us is None:
+                return
+            progress_time_sec = offset_sec + progress.out_time_sec
+            
+            # 若总时长未知，尝试从 ffprobe 获取一次
+            if not state['probed']:
+                state['probed'] = True
+                state['total'] = self._probe_duration_seconds(input_path)
+            
+            total = state['total']
+            if total and total > 0:
+                ratio = min(max(progress_time_sec / total, 0.0), 1.0)
+                # 优先按 ffmpeg 报告的处理速度估算剩余时间，其次按已用时间推算
+                eta_sec = progress.eta_seconds(total - offset_sec)
+                if eta_sec is None:
+                    elapsed_wall = time.time() - state['start']
+                    done = (progress_time_sec - offset_sec) / total
+                    eta_sec = elapsed_wall * (1.0 - ratio) / done if done > 0 else 0
+                on_progress(ratio, int(eta_sec), progress_time_sec, total)
+            else:
+                on_progress(None, 0, progress_time_sec, None)
+
+        return handle
+
+    def _run_ffmpeg(self, input_path, output_path, total_duration_sec, on_progress, verbose=True):
+        """
+        执行一次 ffmpeg 转换，返回 (返回码, 最后几行错误输出)
+        进度通过 -progress pipe:1 的 key=value 流获取，ffmpeg 每 0.5 秒输出一组；
+        on_progress(ratio, eta_sec, progress_time_sec, total_duration_sec)，总时长未知时 ratio 为 None；
+        verbose 为 False 时不把 ffmpeg 的警告输出写入日志（批量模式）
+        """
+        # 构建 ffmpeg 命令（进度参数由 run_ffmpeg 添加）
+        cmd = [
+            self._resolve_ffmpeg_cmd(),
+            '-i', input_path,
+            '-c', 'copy',
+            '-bsf:a', 'aac_adtstoasc',
+            '-y',  # 覆盖输出文件
+            output_path
+        ]
+        
+        if verbose:
+            self.log(f"执行命令: {' '.join(cmd)}")
+        
+        return run_ffmpeg(
+            cmd,
+            on_progress=self._make_progress_handler(input_path, total_duration_sec, on_progress),
+            on_stderr=self.log if verbose else None
+        )
+
     def _format_hhmmss(self, seconds):
         seconds = int(max(0, seconds))
         h = seconds // 3600
@@ -922,60 +1652,36 @@ class M3U8ConverterGUI:
         return f"{h:02d}:{m:02d}:{s:02d}"
 
     def _estimate_duration_seconds(self, input_path):
-        """尝试从 m3u8 文件汇总 #EXTINF 得到总时长，失败则返回 None"""
+        """从 m3u8 的分片表汇总 #EXTINF 得到总时长（结果有缓存），失败则退化到 ffprobe"""
         try:
             if os.path.isfile(input_path) and input_path.lower().endswith('.m3u8'):
-                total = 0.0
-                with open(input_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line.startswith('#EXTINF:'):
-                            # 格式: #EXTINF:10.000,
-                            try:
-                                val = line.split(':', 1)[1]
-                                val = val.split(',')[0]
-                                total += float(val)
-                            except Exception:
-                                continue
-                return int(total) if total > 0 else None
+                total = playlist_duration(input_path)
+                return int(total) if total and total > 0 else None
         except Exception:
             pass
         # 退化到 ffprobe
         return self._probe_duration_seconds(input_path)
 
     def _probe_duration_seconds(self, input_path):
-        """通过 ffprobe 读取总时长，失败返回 None"""
+        """通过 ffprobe 读取总时长（结果按文件大小和修改时间缓存），失败返回 None"""
         try:
-            # 获取 ffprobe 路径（优先使用完整路径）
-            if self.ffmpeg_path:
-                ffprobe_path = self.ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe')
-                if not os.path.exists(ffprobe_path):
-                    ffprobe_path = 'ffprobe'
-            else:
-                ffprobe_path = shutil.which('ffprobe') or 'ffprobe'
-            
-            result = subprocess.run(
-                [ffprobe_path, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_path],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                errors='ignore',
-                timeout=10
-            )
-            if result.returncode == 0:
-                val = result.stdout.strip()
-                if val:
-                    dur = float(val)
-                    return int(dur) if dur > 0 else None
+            info = self.metadata.probe(input_path)
         except Exception:
             return None
-        return None
+        duration = info.get('duration')
+        return int(duration) if duration and duration > 0 else None
 
 
 def main():
     root = Tk()
     app = M3U8ConverterGUI(root)
     root.mainloop()
+    if app.history:
+        app.history.close()
+    app.metadata.close()
+    if app.metadata.cache:
+        app.metadata.cache.close()
+    app.log_sink.close()
 
 
 if __name__ == '__main__':
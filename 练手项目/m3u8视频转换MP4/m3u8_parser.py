@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+M3U8 播放列表解析
+支持主播放列表（EXT-X-STREAM-INF / EXT-X-MEDIA）与媒体播放列表
+（EXTINF、EXT-X-BYTERANGE、EXT-X-DISCONTINUITY、EXT-X-KEY、EXT-X-MAP），
+解析结果按 (路径, 修改时间, 文件大小) 缓存，重复读取同一文件几乎没有开销
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from urllib.parse import urljoin
+
+# 缓存的播放列表个数上限
+CACHE_SIZE = 256
+
+# 一个分片：uri 为播放列表中的原始写法，path 为解析后的本地绝对路径或完整 URL；
+# byterange 为 (长度, 偏移) 或 None；key 为 keys 列表中的下标，未加密时为 None
+Segment = namedtuple('Segment', 'uri path duration sequence byterange discontinuity key')
+
+# 加密信息：iv 为 bytes 或 None（None 表示按分片序号生成）
+Key = namedtuple('Key', 'method uri path iv keyformat')
+
+# EXT-X-MAP 初始化分片
+InitMap = namedtuple('InitMap', 'uri path byterange')
+
+# 主播放列表中的码率与备选音视频
+Variant = namedtuple('Variant', 'uri path bandwidth average_bandwidth resolution codecs frame_rate audio video subtitles')
+Rendition = namedtuple('Rendition', 'type group_id name language default autoselect uri path')
+
+
+class MediaPlaylist:
+    """媒体播放列表"""
+
+    is_master = False
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.playlist_type = None
+        self.endlist = False
+        self.segments = []
+        self.keys = []
+        self.init_map = None
+        self.total_duration = 0.0
+
+    @property
+    def encrypted(self):
+        return any(k.method != 'NONE' for k in self.keys)
+
+
+class MasterPlaylist:
+    """主播放列表"""
+
+    is_master = True
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.variants = []
+        self.renditions = []
+
+
+class PlaylistError(Exception):
+    """不是有效的 M3U8 播放列表"""
+
+
+def parse_attributes(text):
+    """解析 KEY=VALUE,KEY="VALUE" 形式的属性列表（引号中的逗号不拆分）"""
+    attrs = {}
+    pos = 0
+    size = len(text)
+    while pos < size:
+        eq = text.find('=', pos)
+        if eq == -1:
+            break
+        name = text[pos:eq].strip().upper()
+        pos = eq + 1
+        if pos < size and text[pos] == '"':
+            end = text.find('"', pos + 1)
+            if end == -1:
+                end = size
+            value = text[pos + 1:end]
+            pos = text.find(',', end)
+        else:
+            end = text.find(',', pos)
+            value = text[pos:end if end != -1 else size].strip()
+            pos = end
+        attrs[name] = value
+        if pos == -1:
+            break
+        pos += 1
+    return attrs
+
+
+def resolve_uri(base, uri):
+    """把播放列表中的相对地址解析为本地绝对路径或完整 URL"""
+    if '://' in uri:
+        return uri
+    if '://' in base:
+        return urljoin(base, uri)
+    uri = uri.split('?', 1)[0]
+    return os.path.normpath(os.path.join(os.path.dirname(base), uri))
+
+
+def _parse_byterange(value, next_offset):
+    length, _, offset = value.partition('@')
+    length = int(length)
+    offset = int(offset) if offset else next_offset
+    return length, offset
+
+
+def _parse_iv(value):
+    if not value:
+        return None
+    value = value[2:] if value[:2].lower() == '0x' else value
+    return bytes.fromhex(value.rjust(32, '0'))
+
+
+class PlaylistParser:
+    """
+    逐行解析器，可多次调用 feed() 送入新增的行（用于直播列表的增量读取）
+    base 为播放列表自身的路径或 URL，用于解析相对地址；
+    标签或属性的值无法解析时抛出 PlaylistError（带行号）
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.playlist = None
+        self._pending = {}
+        self._version = None
+        self._started = False
+        self._byterange_end = {}
+        self._line = 0
+
+    def feed(self, text):
+        for line in text.splitlines():
+            self.feed_line(line)
+        return self.playlist
+
+    def feed_line(self, line):
+        self._line += 1
+        line = line.strip()
+        if not line:
+            return
+        if not self._started:
+            if line.lstrip('\ufeff') != '#EXTM3U':
+                raise PlaylistError("缺少 #EXTM3U 头")
+            self._started = True
+            return
+        try:
+            if line.startswith('#'):
+                self._tag(line)
+            else:
+                self._uri(line)
+        except (ValueError, KeyError) as e:
+            raise PlaylistError(f"第 {self._line} 行无效: {line}（{e}）") from e
+
+    def _media(self):
+        if self.playlist is None:
+            self.playlist = MediaPlaylist(self.base)
+            self.playlist.version = self._version
+        return self.playlist
+
+    def _master(self):
+        if self.playlist is None:
+            self.playlist = MasterPlaylist(self.base)
+            self.playlist.version = self._version
+        return self.playlist
+
+    def _tag(self, line):
+        tag, _, value = line.partition(':')
+        if tag == '#EXTINF':
+            # 格式: #EXTINF:10.000,标题
+            try:
+                self._pending['duration'] = float(value.split(',', 1)[0])
+            except ValueError:
+                self._pending['duration'] = 0.0
+        elif tag == '#EXT-X-BYTERANGE':
+            self._pending['byterange'] = value
+        elif tag == '#EXT-X-DISCONTINUITY':
+            self._pending['discontinuity'] = True
+        elif tag == '#EXT-X-KEY':
+            attrs = parse_attributes(value)
+            method = attrs.get('METHOD', 'NONE')
+            uri = attrs.get('URI')
+            playlist = self._media()
+            playlist.keys.append(Key(
+                method, uri, resolve_uri(self.base, uri) if uri else None,
+                _parse_iv(attrs.get('IV')), attrs.get('KEYFORMAT', 'identity')
+            ))
+        elif tag == '#EXT-X-MAP':
+            attrs = parse_attributes(value)
+            byterange = None
+            if 'BYTERANGE' in attrs:
+                byterange = _parse_byterange(attrs['BYTERANGE'], 0)
+            self._media().init_map = InitMap(attrs['URI'], resolve_uri(self.base, attrs['URI']), byterange)
+        elif tag == '#EXT-X-TARGETDURATION':
+            self._media().target_duration = float(value)
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            self._media().media_sequence = int(value)
+        elif tag == '#EXT-X-PLAYLIST-TYPE':
+            self._media().playlist_type = value.strip()
+        elif tag == '#EXT-X-ENDLIST':
+            self._media().endlist = True
+        elif tag == '#EXT-X-STREAM-INF':
+            self._master()
+            self._pending['stream_inf'] = parse_attributes(value)
+        elif tag == '#EXT-X-MEDIA':
+            attrs = parse_attributes(value)
+            uri = attrs.get('URI')
+            self._master().renditions.append(Rendition(
+                attrs.get('TYPE'), attrs.get('GROUP-ID'), attrs.get('NAME'), attrs.get('LANGUAGE'),
+                attrs.get('DEFAULT') == 'YES', attrs.get('AUTOSELECT') == 'YES',
+                uri, resolve_uri(self.base, uri) if uri else None
+            ))
+        elif tag == '#EXT-X-VERSION':
+            self._version = int(value)
+            if self.playlist is not None:
+                self.playlist.version = self._version
+
+    def _uri(self, uri):
+        pending = self._pending
+        self._pending = {}
+        path = resolve_uri(self.base, uri)
+        if 'stream_inf' in pending:
+            attrs = pending['stream_inf']
+            resolution = None
+            if 'RESOLUTION' in attrs:
+                w, _, h = attrs['RESOLUTION'].lower().partition('x')
+                resolution = (int(w), int(h))
+            self._master().variants.append(Variant(
+                uri, path,
+                int(attrs.get('BANDWIDTH', 0)),
+                int(attrs['AVERAGE-BANDWIDTH']) if 'AVERAGE-BANDWIDTH' in attrs else None,
+                resolution,
+                attrs.get('CODECS'),
+                float(attrs['FRAME-RATE']) if 'FRAME-RATE' in attrs else None,
+                attrs.get('AUDIO'), attrs.get('VIDEO'), attrs.get('SUBTITLES')
+            ))
+            return
+        playlist = self._media()
+        byterange = None
+        if 'byterange' in pending:
+            byterange = _parse_byterange(pending['byterange'], self._byterange_end.get(path, 0))
+            self._byterange_end[path] = byterange[0] + byterange[1]
+        key = None
+        if playlist.keys and playlist.keys[-1].method != 'NONE':
+            key = len(playlist.keys) - 1
+        duration = pending.get('duration', 0.0)
+        playlist.segments.append(Segment(
+            uri, path, duration,
+            playlist.media_sequence + len(playlist.segments),
+            byterange, pending.get('discontinuity', False), key
+        ))
+        playlist.total_duration += duration
+
+
+def parse_playlist(text, base):
+    """解析播放列表文本，返回 MediaPlaylist 或 MasterPlaylist"""
+    parser = PlaylistParser(base)
+    parser.feed(text)
+    if not parser._started:
+        raise PlaylistError("缺少 #EXTM3U 头")
+    return parser._media() if parser.playlist is None else parser.playlist
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_playlist(path):
+    """
+    读取并解析本地播放列表
+    结果按 (绝对路径, 修改时间, 文件大小) 缓存，文件未变化时直接返回缓存
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == stamp:
+            _cache.move_to_end(path)
+            return cached[1]
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        playlist = parse_playlist(f.read(), path)
+    with _cache_lock:
+        _cache[path] = (stamp, playlist)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return playlist
+
+
+def playlist_duration(path):
+    """
+    返回本地播放列表的总时长（秒），无法得到时返回 None
+    主播放列表取第一个本地子播放列表的时长
+    """
+    playlist = load_playlist(path)
+    if playlist.is_master:
+        for variant in playlist.variants:
+            if '://' not in variant.path and os.path.isfile(variant.path):
+                return playlist_duration(variant.path)
+        return None
+    return playlist.total_duration or None
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+批量读取媒体信息（时长、流、编解码器、码率）
+固定数量的工作线程并发运行 ffprobe（同时运行的 ffprobe 进程数有上限），
+结果按文件路径、大小和修改时间缓存在 SQLite（logs/probe_cache.sqlite3），文件未变化时不再启动 ffprobe
+
+m3u8 播放列表不交给 ffprobe 解析整个 HLS：时长由 #EXTINF 汇总，流信息取自第一个本地分片，
+码率按分片总大小 / 总时长计算
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from m3u8_parser import PlaylistError, load_playlist
+from toolchain import find_toolchain
+
+DEFAULT_PROBE_WORKERS = min(4, os.cpu_count() or 1)
+PROBE_TIMEOUT = 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    probed_at REAL NOT NULL
+);
+'''
+
+
+class ProbeError(Exception):
+    """ffprobe 无法读取文件"""
+
+
+def default_cache_file():
+    """默认缓存数据库：脚本目录下 logs/probe_cache.sqlite3"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'logs', 'probe_cache.sqlite3')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _stream_info(stream):
+    """ffprobe 的流信息中保留常用字段"""
+    info = {
+        'index': stream.get('index'),
+        'type': stream.get('codec_type'),
+        'codec': stream.get('codec_name'),
+        'profile': stream.get('profile'),
+        'bit_rate': _to_int(stream.get('bit_rate')),
+    }
+    if stream.get('codec_type') == 'video':
+        info['width'] = stream.get('width')
+        info['height'] = stream.get('height')
+        rate = stream.get('avg_frame_rate') or stream.get('r_frame_rate') or ''
+        num, _, den = rate.partition('/')
+        info['fps'] = round(_to_float(num) / _to_float(den), 3) if _to_float(den) else None
+    elif stream.get('codec_type') == 'audio':
+        info['sample_rate'] = _to_int(stream.get('sample_rate'))
+        info['channels'] = stream.get('channels')
+    return info
+
+
+def run_ffprobe(path, ffprobe_cmd=None, timeout=PROBE_TIMEOUT):
+    """运行一次 ffprobe，返回 {'format': ..., 'duration', 'bit_rate', 'streams': [...]}"""
+    ffprobe_cmd = ffprobe_cmd or find_toolchain().ffprobe_cmd
+    try:
+        result = subprocess.run(
+            [ffprobe_cmd, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+            capture_output=True,
+            text=True,
+            encoding='utf-8',
+            errors='ignore',
+            timeout=timeout
+        )
+    except FileNotFoundError:
+        raise ProbeError("找不到 ffprobe")
+    except subprocess.TimeoutExpired:
+        raise ProbeError(f"ffprobe 超时（{timeout} 秒）")
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise ProbeError(lines[-1] if lines else f"ffprobe 返回 {result.returncode}")
+    try:
+        data = json.loads(result.stdout or '{}')
+    except ValueError:
+        raise ProbeError("ffprobe 输出不是 JSON")
+    fmt = data.get('format', {})
+    return {
+        'format': fmt.get('format_name'),
+        'duration': _to_float(fmt.get('duration')),
+        'bit_rate': _to_int(fmt.get('bit_rate')),
+        'streams': [_stream_info(s) for s in data.get('streams', [])],
+    }
+
+
+def probe_playlist(path, ffprobe_cmd=None, timeout=PROBE_TIMEOUT):
+    """m3u8 的媒体信息：时长来自 #EXTINF，流信息来自第一个本地分片（没有本地分片时为空）"""
+    playlist = load_playlist(path)
+    if playlist.is_master:
+        return {'format': 'hls', 'duration': None, 'bit_rate': None, 'streams': [],
+                'variants': len(playlist.variants), 'segments': 0}
+    size = 0
+    first_local = None
+    for seg in playlist.segments:
+        if '://' in seg.path:
+            continue
+        try:
+            size += seg.byterange[0] if seg.byterange else os.path.getsize(seg.path)
+        except OSError:
+            continue
+        if first_local is None and not seg.byterange and seg.key is None:
+            first_local = seg.path
+    duration = playlist.total_duration
+    info = {
+        'format': 'hls',
+        'duration': duration,
+        'bit_rate': int(size * 8 / duration) if size and duration else None,
+        'streams': [],
+        'segments': len(playlist.segments),
+    }
+    if first_local:
+        info['streams'] = run_ffprobe(first_local, ffprobe_cmd, timeout)['streams']
+    return info
+
+
+class ProbeCache:
+    """媒体信息缓存，按路径保存，大小或修改时间变化即失效；可在多个线程中共用"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_cache_file()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def get(self, path, size, mtime_ns):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT info FROM probes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, path, size, mtime_ns, info):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime_ns, info, probed_at) VALUES (?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, json.dumps(info, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MetadataService:
+    """
+    媒体信息服务：probe_many() 先返回缓存命中的结果，其余的交给常驻线程池并发运行 ffprobe
+    同时运行的 ffprobe 进程数不超过 workers；结果字典可直接序列化为 JSON，失败时 error 字段为原因
+    """
+
+    def __init__(self, workers=DEFAULT_PROBE_WORKERS, cache=None, timeout=PROBE_TIMEOUT):
+        self.cache = cache
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def _stamp(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def cached(self, path):
+        """缓存中的结果，没有或文件已变化时返回 None"""
+        if self.cache is None:
+            return None
+        try:
+            size, mtime_ns = self._stamp(path)
+        except OSError:
+            return None
+        return self.cache.get(path, size, mtime_ns)
+
+    def probe(self, path):
+        """读取一个文件的媒体信息（优先使用缓存）"""
+        path = os.path.abspath(path)
+        info = self.cached(path)
+        if info is not None:
+            return info
+        return self._probe_and_store(path)
+
+    def _probe_and_store(self, path):
+        result = {'path': path, 'error': None}
+        try:
+            size, mtime_ns = self._stamp(path)
+            ffprobe_cmd = find_toolchain().ffprobe_cmd
+            if path.lower().endswith('.m3u8'):
+                result.update(probe_playlist(path, ffprobe_cmd, self.timeout))
+            else:
+                result.update(run_ffprobe(path, ffprobe_cmd, self.timeout))
+                result['size'] = size
+        except (OSError, PlaylistError, ProbeError) as e:
+            result['error'] = str(e)
+            return result
+        if self.cache is not None:
+            try:
+                self.cache.put(path, size, mtime_ns, result)
+            except sqlite3.Error:
+                pass
+        return result
+
+    def probe_many(self, paths, on_result=None):
+        """
+        读取多个文件的媒体信息，返回 {绝对路径: 结果}
+        on_result(路径, 结果) 对缓存命中的文件立即回调，其余按完成顺序回调
+        """
+        results = {}
+        futures = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            info = self.cached(path)
+            if info is not None:
+                results[path] = info
+                if on_result:
+                    on_result(path, info)
+            elif path not in results:
+                futures[self._pool.submit(self._probe_and_store, path)] = path
+        for future in as_completed(futures):
+            path = futures[future]
+            results[path] = future.result()
+            if on_result:
+                on_result(path, results[path])
+        return results
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="批量读取媒体信息（结果有缓存）")
+    parser.add_argument('paths', nargs='+', help="媒体文件或 m3u8 播放列表")
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_PROBE_WORKERS,
+                        help=f"同时运行的 ffprobe 进程数（默认 {DEFAULT_PROBE_WORKERS}）")
+    parser.add_argument('--no-cache', action='store_true', help="不读写缓存")
+    parser.add_argument('--json', action='store_true', help="每个文件输出一行 JSON")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ProbeCache()
+    service = MetadataService(workers=args.workers, cache=cache)
+    start = time.time()
+
+    def show(path, info):
+        if args.json:
+            print(json.dumps(info, ensure_ascii=False), flush=True)
+        elif info.get('error'):
+            print(f"✗ {path}: {info['error']}")
+        else:
+            codecs = '/'.join(s['codec'] or '?' for s in info.get('streams', []))
+            rate = f"{info['bit_rate'] / 1000:.0f} kb/s" if info.get('bit_rate') else '--'
+            print(f"{format_duration(info.get('duration'))}  {codecs or '--':<12} {rate:>12}  {path}")
+
+    results = service.probe_many(args.paths, on_result=show)
+    service.close()
+    if cache:
+        cache.close()
+    failed = sum(1 for info in results.values() if info.get('error'))
+    print(f"共 {len(results)} 个文件，失败 {failed}，用时 {time.time() - start:.2f} 秒", file=sys.stderr)
+    sys.exit(1 if failed else 0)
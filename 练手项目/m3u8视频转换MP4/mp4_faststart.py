@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+MP4 快速启动（moov 前置）
+ffmpeg 默认把 moov 写在文件末尾，网页播放器要下载完整个文件（或额外发起范围请求）才能开始播放。
+ffmpeg -movflags +faststart 会再完整重写一遍文件；这里在原文件上原地处理：
+先按 moov 的新位置修正各轨道的块偏移（stco，超过 4 GB 时改为 co64），
+再从文件末尾开始以大块顺序读写把 mdat 向后移动，最后把新的 moov 写到 mdat 之前。
+mdat 之前有足够大的 free 空间时直接写入，不移动任何数据。
+
+原地移动过程中被中断会留下损坏的文件，因此应在删除源文件之前运行（之后还有输出校验）
+"""
+
+import os
+import struct
+import sys
+import time
+
+from mp4_verify import Mp4Error, iter_boxes
+
+# 移动数据时每次读写的块大小
+MOVE_CHUNK_SIZE = 16 * 1024 * 1024
+# 需要递归处理的容器 box（块偏移表在 moov/trak/mdia/minf/stbl 中）
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class FaststartResult:
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        self.moved_bytes = 0      # 移动的数据量
+        self.moov_size = 0
+        self.upgraded = False     # stco 是否改成了 co64
+        self.elapsed = 0.0
+
+    def summary(self):
+        if not self.changed:
+            return f"moov 已在文件开头，无需处理: {self.path}"
+        return (f"moov 已前置（{self.moov_size / 1024:.1f} KB{'，块偏移改为 64 位' if self.upgraded else ''}），"
+                f"移动 {self.moved_bytes / (1024 * 1024):.2f} MB，用时 {self.elapsed:.2f} 秒")
+
+
+def _header(box_type, size):
+    """总长度为 size 的 box 头"""
+    if size > 0xFFFFFFFF:
+        return struct.pack('>I4sQ', 1, box_type, size)
+    return struct.pack('>I4s', size, box_type)
+
+
+def _wrap(box_type, payload):
+    if len(payload) + 8 > 0xFFFFFFFF:
+        return _header(box_type, len(payload) + 16) + payload
+    return _header(box_type, len(payload) + 8) + payload
+
+
+def rebuild_moov(data, relocate, force_co64=False):
+    """
+    重建 moov（data 为完整的 moov box），所有块偏移经 relocate(旧偏移) 换算；
+    新偏移超过 32 位（或 force_co64）时把 stco 改为 co64，返回 (新 moov, 是否改为 co64)
+    """
+    state = {'upgraded': False}
+
+    def rebuild(start, end):
+        out = bytearray()
+        for box_type, pos, header, size in iter_boxes(data, start, end):
+            body_start = pos + header
+            if box_type in CONTAINER_BOXES:
+                out += _wrap(box_type, rebuild(body_start, pos + size))
+            elif box_type in (b'stco', b'co64'):
+                version_flags, count = struct.unpack_from('>II', data, body_start)
+                fmt = 'I' if box_type == b'stco' else 'Q'
+                offsets = [relocate(off) for off in struct.unpack_from(f'>{count}{fmt}', data, body_start + 8)]
+                if box_type == b'stco' and (force_co64 or (offsets and max(offsets) > 0xFFFFFFFF)):
+                    box_type, fmt = b'co64', 'Q'
+                    state['upgraded'] = True
+                out += _wrap(box_type, struct.pack(f'>II{count}{fmt}', version_flags, count, *offsets))
+            else:
+                out += data[pos:pos + size]
+        return bytes(out)
+
+    _, pos, header, size = next(iter_boxes(data, 0, len(data)))
+    return _wrap(b'moov', rebuild(pos + header, pos + size)), state['upgraded']
+
+
+def _move_backward(f, start, end, delta, buf):
+    """把 [start, end) 整体向后移动 delta 字节（从末尾开始按块复制，源和目标重叠也不会覆盖未复制的数据）"""
+    view = memoryview(buf)
+    pos = end
+    while pos > start:
+        n = min(len(buf), pos - start)
+        pos -= n
+        f.seek(pos)
+        f.readinto(view[:n])
+        f.seek(pos + delta)
+        f.write(view[:n])
+    return end - start
+
+
+def faststart(path, chunk_size=MOVE_CHUNK_SIZE):
+    """
+    原地把 moov 移到第一个 mdat 之前，返回 FaststartResult
+    文件结构不支持（没有 moov / mdat）时抛出 Mp4Error
+    """
+    result = FaststartResult(path)
+    start_time = time.time()
+    file_size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        # 只读取 box 头，不读取 mdat 内容
+        boxes = []
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            head = f.read(16)
+            size, box_type = struct.unpack_from('>I4s', head)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', head, 8)[0]
+                header = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header or pos + size > file_size:
+                raise Mp4Error(f"{box_type.decode('latin-1')} 超出范围（偏移 {pos}），文件可能被截断")
+            boxes.append((box_type, pos, header, size))
+            pos += size
+
+        moov = next((b for b in boxes if b[0] == b'moov'), None)
+        mdat = next((b for b in boxes if b[0] == b'mdat'), None)
+        if moov is None or mdat is None:
+            raise Mp4Error("缺少 moov 或 mdat")
+        if moov[1] < mdat[1]:
+            result.elapsed = time.time() - start_time
+            return result
+
+        f.seek(moov[1])
+        moov_data = f.read(moov[3])
+        insert_at = mdat[1]
+        moov_start, moov_end = moov[1], moov[1] + moov[3]
+
+        # mdat 之前紧挨着的 free/skip 空间足够时直接写入（多余部分仍保留为 free），数据不用移动
+        free = [b for b in boxes if b[0] in (b'free', b'skip') and b[1] + b[3] == insert_at]
+        if free:
+            space = free[0][3]
+            if moov[3] == space or moov[3] + 8 <= space:
+                # 数据位置不变，moov 原样写入
+                f.seek(free[0][1])
+                f.write(moov_data)
+                if moov[3] < space:
+                    f.write(_header(b'free', space - moov[3]))
+                # 原来的 moov 改为 free，不再被播放器读取
+                f.seek(moov_start)
+                f.write(_header(b'free', moov[3]) if moov[2] == 8 else struct.pack('>I4sQ', 1, b'free', moov[3]))
+                f.flush()
+                os.fsync(f.fileno())
+                result.changed = True
+                result.moov_size = moov[3]
+                result.elapsed = time.time() - start_time
+                return result
+
+        # 新 moov 的长度取决于是否需要 co64，而是否需要 co64 又取决于偏移量，迭代到长度不再变化
+        new_size = moov[3]
+        force_co64 = False
+        for _ in range(4):
+            def relocate(off, shift=new_size):
+                if off >= moov_end:
+                    return off + shift - moov[3]
+                if off >= insert_at:
+                    return off + shift
+                return off
+            new_moov, upgraded = rebuild_moov(moov_data, relocate, force_co64)
+            shortfall = new_size - len(new_moov)
+            if shortfall >= 8:
+                # 新 moov 变短（例如原来用了 64 位 box 头）：用 free 补齐，数据只需要向后移动
+                new_moov += _header(b'free', shortfall) + bytes(shortfall - 8)
+            if len(new_moov) == new_size:
+                break
+            force_co64 = force_co64 or upgraded
+            # 短了不到 8 字节时放不下 free，改为多留 8 字节
+            new_size = len(new_moov) + (8 if shortfall > 0 else 0)
+        else:
+            raise Mp4Error("无法确定 moov 的新长度")
+
+        buf = bytearray(min(chunk_size, max(moov_start - insert_at, 1)))
+        delta = new_size - moov[3]
+        moved = 0
+        if delta and moov_end < file_size:
+            # moov 之后还有其他 box，且 moov 变长了：先把它们向后移
+            moved += _move_backward(f, moov_end, file_size, delta, buf)
+        moved += _move_backward(f, insert_at, moov_start, new_size, buf)
+        f.seek(insert_at)
+        f.write(new_moov)
+        f.flush()
+        os.fsync(f.fileno())
+
+    result.changed = True
+    result.moved_bytes = moved
+    result.moov_size = new_size
+    result.upgraded = upgraded
+    result.elapsed = time.time() - start_time
+    return result
+
+
+def is_faststart(path):
+    """moov 是否已在第一个 mdat 之前"""
+    with open(path, 'rb') as f:
+        data_size = os.path.getsize(path)
+        pos = 0
+        while pos + 8 <= data_size:
+            f.seek(pos)
+            head = f.read(16)
+            size, box_type = struct.unpack_from('>I4s', head)
+            if size == 1:
+                size = struct.unpack_from('>Q', head, 8)[0]
+            elif size == 0:
+                size = data_size - pos
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat' or size < 8:
+                return False
+            pos += size
+    return False
+
+
+def benchmark(mp4_path, ffmpeg_cmd=None, log=print):
+    """对比原地前置 moov 与 ffmpeg -movflags +faststart 再处理一遍的耗时（在 mp4_path 的副本上进行）"""
+    import shutil
+    import subprocess
+    import tempfile
+
+    from toolchain import ffmpeg_command
+
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    size_mb = os.path.getsize(mp4_path) / (1024 * 1024)
+    work_dir = os.path.dirname(os.path.abspath(mp4_path))
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        copy = os.path.join(tmp, 'inplace.mp4')
+        shutil.copyfile(mp4_path, copy)
+        result = faststart(copy)
+        log(f"原地处理: {result.summary()}")
+        inplace = result.elapsed
+
+        output = os.path.join(tmp, 'ffmpeg.mp4')
+        start = time.time()
+        try:
+            subprocess.run(
+                [ffmpeg_cmd, '-v', 'error', '-i', mp4_path, '-map', '0', '-c', 'copy',
+                 '-movflags', '+faststart', '-y', output],
+                check=True, capture_output=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            log(f"ffmpeg 失败: {e}")
+            return inplace, None
+        second = time.time() - start
+        log(f"ffmpeg +faststart: {second:.2f} 秒（读 {size_mb:.2f} MB，写 {os.path.getsize(output) / (1024 * 1024):.2f} MB，"
+            f"另需同样大小的临时空间）")
+        if inplace > 0:
+            log(f"原地处理快 {second / inplace:.1f} 倍")
+    return inplace, second
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--benchmark':
+        benchmark(sys.argv[2])
+    elif len(sys.argv) >= 2:
+        for target in sys.argv[1:]:
+            try:
+                print(faststart(target).summary())
+            except (OSError, Mp4Error) as e:
+                print(f"处理失败: {target}: {e}")
+                sys.exit(1)
+    else:
+        print("用法: python mp4_faststart.py 输出.mp4 [...]")
+        print("      python mp4_faststart.py --benchmark 输出.mp4")
+        sys.exit(2)
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+转换结果校验
+通过 mmap 只读取 MP4 的 box 头和 moov 中的少量字段（不读取 mdat 内容），确认：
+- 顶层 box 完整（最后一个 box 没有超出文件末尾，即文件没有被截断）
+- 存在 moov 和 mdat（分片 MP4 为 moov + moof/mdat）
+- 每条音视频轨道都有样本，块偏移（stco/co64）没有超出文件
+- 轨道时长与播放列表 #EXTINF 总时长一致（允许一定误差）
+耗时只与 box 数量有关，与文件大小无关，可以在每次删除源文件之前运行
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+# 时长允许的误差：取 1 秒和总时长 1% 中较大的一个
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_RATIO = 0.01
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.m4a', '.mov')
+
+
+class Mp4Error(Exception):
+    """box 结构损坏"""
+
+
+def iter_boxes(buf, start, end):
+    """遍历 [start, end) 中的 box，产出 (类型, 偏移, 头长度, 总长度)；box 超出范围时抛出 Mp4Error"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise Mp4Error(f"{box_type.decode('latin-1')} 的 64 位长度不完整（偏移 {pos}）")
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise Mp4Error(f"{box_type.decode('latin-1')} 长度无效（偏移 {pos}）")
+        if pos + size > end:
+            raise Mp4Error(f"{box_type.decode('latin-1')} 超出范围（偏移 {pos}，长度 {size}，"
+                           f"只剩 {end - pos} 字节），文件可能被截断")
+        yield box_type, pos, header, size
+        pos += size
+
+
+def _children(buf, box):
+    _, pos, header, size = box
+    return iter_boxes(buf, pos + header, pos + size)
+
+
+def _find(buf, box, *path):
+    """按路径查找子 box，例如 _find(buf, trak, b'mdia', b'mdhd')，找不到返回 None"""
+    for name in path:
+        for child in _children(buf, box):
+            if child[0] == name:
+                box = child
+                break
+        else:
+            return None
+    return box
+
+
+def _payload(box):
+    """full box 的版本、标志和内容起始偏移"""
+    _, pos, header, _ = box
+    return pos + header
+
+
+def _timescale_duration(buf, box):
+    """mvhd / mdhd 的 (timescale, duration)"""
+    p = _payload(box)
+    if buf[p] == 1:
+        return struct.unpack_from('>IQ', buf, p + 4 + 16)
+    return struct.unpack_from('>II', buf, p + 4 + 8)
+
+
+class TrackInfo:
+    def __init__(self, track_id, handler, timescale, duration, samples):
+        self.track_id = track_id
+        self.handler = handler          # 'vide' / 'soun' / ...
+        self.timescale = timescale
+        self.duration = duration        # 以 timescale 为单位
+        self.samples = samples          # 非分片 MP4 的样本数；分片 MP4 为各分片样本数之和
+
+    @property
+    def seconds(self):
+        return self.duration / self.timescale if self.timescale else 0.0
+
+
+class VerifyReport:
+    """校验结果"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.boxes = []          # 顶层 box 类型
+        self.fragmented = False
+        self.fragments = 0
+        self.duration = None     # 影片时长（秒，取音视频轨道中最长的）
+        self.tracks = []
+        self.problems = []
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def summary(self):
+        layout = ' '.join(box.decode('latin-1') for box in self.boxes[:6])
+        if len(self.boxes) > 6:
+            layout += f" ...（共 {len(self.boxes)} 个）"
+        duration = f"{self.duration:.2f} 秒" if self.duration is not None else '未知'
+        head = (f"输出校验{'通过' if self.ok else '失败'}：{self.size / (1024 * 1024):.2f} MB，时长 {duration}，"
+                f"{len(self.tracks)} 条轨道{'（分片 MP4）' if self.fragmented else ''}，"
+                f"用时 {self.elapsed * 1000:.1f} 毫秒")
+        lines = [head, f"  结构: {layout}"]
+        lines.extend(f"  ✗ {problem}" for problem in self.problems)
+        return '\n'.join(lines)
+
+
+def _parse_trak(buf, trak, file_size, report):
+    tkhd = _find(buf, trak, b'tkhd')
+    mdhd = _find(buf, trak, b'mdia', b'mdhd')
+    hdlr = _find(buf, trak, b'mdia', b'hdlr')
+    if tkhd is None or mdhd is None or hdlr is None:
+        report.problems.append("trak 缺少 tkhd / mdhd / hdlr")
+        return None
+    p = _payload(tkhd)
+    track_id = struct.unpack_from('>I', buf, p + (4 + 16 if buf[p] == 1 else 4 + 8))[0]
+    timescale, duration = _timescale_duration(buf, mdhd)
+    handler = bytes(buf[_payload(hdlr) + 8:_payload(hdlr) + 12]).decode('latin-1')
+
+    samples = 0
+    stbl = _find(buf, trak, b'mdia', b'minf', b'stbl')
+    if stbl is not None:
+        for box in _children(buf, stbl):
+            p = _payload(box)
+            if box[0] == b'stsz':
+                samples = struct.unpack_from('>I', buf, p + 8)[0]
+            elif box[0] in (b'stco', b'co64'):
+                count = struct.unpack_from('>I', buf, p + 4)[0]
+                if count:
+                    fmt = 'I' if box[0] == b'stco' else 'Q'
+                    if p + 8 + count * struct.calcsize(fmt) > box[1] + box[3]:
+                        report.problems.append(f"轨道 {track_id} 的 {box[0].decode()} 条目数超出 box")
+                        continue
+                    offsets = struct.unpack_from(f'>{count}{fmt}', buf, p + 8)
+                    if max(offsets) >= file_size:
+                        report.problems.append(f"轨道 {track_id} 的数据块偏移 {max(offsets)} 超出文件大小 {file_size}")
+    return TrackInfo(track_id, handler, timescale, duration, samples)
+
+
+def _scan_fragments(buf, moofs, tracks, trex_defaults):
+    """累加每个 moof 中各轨道的样本数和时长（tfdt 起点 + trun 样本时长）"""
+    first = {}
+    end = {}
+    for moof in moofs:
+        for traf in _children(buf, moof):
+            if traf[0] != b'traf':
+                continue
+            track_id = None
+            default_duration = 0
+            base = None
+            total = 0
+            count_all = 0
+            for box in _children(buf, traf):
+                p = _payload(box)
+                flags = struct.unpack_from('>I', buf, p)[0] & 0xFFFFFF
+                if box[0] == b'tfhd':
+                    track_id = struct.unpack_from('>I', buf, p + 4)[0]
+                    default_duration = trex_defaults.get(track_id, 0)
+                    q = p + 8
+                    q += 8 if flags & 0x01 else 0
+                    q += 4 if flags & 0x02 else 0
+                    if flags & 0x08:
+                        default_duration = struct.unpack_from('>I', buf, q)[0]
+                elif box[0] == b'tfdt':
+                    base = struct.unpack_from('>Q' if buf[p] == 1 else '>I', buf, p + 4)[0]
+                elif box[0] == b'trun':
+                    count = struct.unpack_from('>I', buf, p + 4)[0]
+                    q = p + 8 + (4 if flags & 0x01 else 0) + (4 if flags & 0x04 else 0)
+                    fields = bin(flags & 0xF00).count('1')
+                    if flags & 0x100 and count:
+                        if q + count * fields * 4 > box[1] + box[3]:
+                            raise Mp4Error(f"trun 样本数 {count} 超出 box 范围")
+                        total += sum(struct.unpack_from(f'>{count * fields}I', buf, q)[0::fields])
+                    else:
+                        total += count * default_duration
+                    count_all += count
+            if track_id not in tracks:
+                continue
+            if base is None:
+                base = end.get(track_id, 0)
+            first.setdefault(track_id, base)
+            end[track_id] = max(end.get(track_id, 0), base + total)
+            tracks[track_id].samples += count_all
+    for track_id, track in tracks.items():
+        if track_id in end:
+            track.duration = end[track_id] - first[track_id]
+
+
+def verify_mp4(path, expected_duration=None, tolerance=None):
+    """
+    校验 MP4 文件，返回 VerifyReport
+    expected_duration 为播放列表的 #EXTINF 总时长（秒），给出时检查音视频轨道时长与其相差不超过 tolerance
+    """
+    report = VerifyReport(path)
+    start = time.perf_counter()
+    try:
+        report.size = os.path.getsize(path)
+        if report.size == 0:
+            report.problems.append("输出文件为空")
+            return report
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            _verify(buf, report, expected_duration, tolerance)
+    except OSError as e:
+        report.problems.append(f"无法读取输出文件: {e}")
+    except (Mp4Error, struct.error, IndexError) as e:
+        report.problems.append(f"MP4 结构损坏: {e}")
+    finally:
+        report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _verify(buf, report, expected_duration, tolerance):
+    moov = None
+    moofs = []
+    has_mdat = False
+    for box in iter_boxes(buf, 0, report.size):
+        report.boxes.append(box[0])
+        if box[0] == b'moov':
+            moov = box
+        elif box[0] == b'mdat':
+            has_mdat = True
+        elif box[0] == b'moof':
+            moofs.append(box)
+    if moov is None:
+        report.problems.append("缺少 moov（索引），文件无法播放")
+    if not has_mdat:
+        report.problems.append("缺少 mdat（媒体数据）")
+    if moov is None:
+        return
+
+    tracks = {}
+    trex_defaults = {}
+    for box in _children(buf, moov):
+        if box[0] == b'trak':
+            track = _parse_trak(buf, box, report.size, report)
+            if track:
+                tracks[track.track_id] = track
+        elif box[0] == b'mvex':
+            report.fragmented = True
+            for trex in _children(buf, box):
+                if trex[0] == b'trex':
+                    p = _payload(trex)
+                    track_id, _, duration = struct.unpack_from('>III', buf, p + 4)
+                    trex_defaults[track_id] = duration
+    if report.fragmented:
+        report.fragments = len(moofs)
+        if not moofs:
+            report.problems.append("分片 MP4 中没有 moof 分片")
+        _scan_fragments(buf, moofs, tracks, trex_defaults)
+
+    report.tracks = sorted(tracks.values(), key=lambda t: t.track_id)
+    media = [t for t in report.tracks if t.handler in ('vide', 'soun')]
+    if not media:
+        report.problems.append("没有音视频轨道")
+        return
+    for track in media:
+        if not track.samples:
+            report.problems.append(f"轨道 {track.track_id}（{track.handler}）没有样本")
+    report.duration = max(t.seconds for t in media)
+
+    if expected_duration:
+        if tolerance is None:
+            tolerance = max(DURATION_TOLERANCE_SECONDS, expected_duration * DURATION_TOLERANCE_RATIO)
+        for track in media:
+            if abs(track.seconds - expected_duration) > tolerance:
+                report.problems.append(
+                    f"轨道 {track.track_id}（{track.handler}）时长 {track.seconds:.2f} 秒，"
+                    f"与播放列表 {expected_duration:.2f} 秒相差超过 {tolerance:.2f} 秒"
+                )
+
+
+def is_mp4_path(path):
+    return path.lower().endswith(MP4_EXTENSIONS)
+
+
+def benchmark(mp4_path, size_gb=4, rounds=5, work_dir=None, log=print):
+    """
+    把 mp4_path 中最大的 mdat 扩展为 size_gb GB（稀疏文件，不实际写入数据）后反复校验，
+    测量大文件上的校验耗时；work_dir 默认为 mp4_path 所在目录
+    """
+    import tempfile
+
+    with open(mp4_path, 'rb') as f:
+        data = f.read()
+    mdats = [box for box in iter_boxes(data, 0, len(data)) if box[0] == b'mdat']
+    if not mdats:
+        log("文件中没有 mdat")
+        return None
+    _, pos, header, size = max(mdats, key=lambda box: box[3])
+    target = max(int(size_gb * 1024 ** 3), size)
+
+    fd, big = tempfile.mkstemp(suffix='.mp4', dir=work_dir or os.path.dirname(os.path.abspath(mp4_path)))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data[:pos])
+            out.write(struct.pack('>I4sQ', 1, b'mdat', target + 16))
+            out.write(data[pos + header:pos + size])
+            # 其余部分留空（稀疏），只移动写入位置
+            out.seek(pos + 16 + target)
+            out.write(data[pos + size:])
+        results = []
+        for _ in range(rounds):
+            report = verify_mp4(big)
+            results.append(report.elapsed)
+        best = min(results)
+        log(report.summary())
+        log(f"{os.path.getsize(big) / 1024 ** 3:.2f} GB：最快 {best * 1000:.2f} 毫秒，"
+            f"平均 {sum(results) / len(results) * 1000:.2f} 毫秒（{rounds} 次）")
+        return best
+    finally:
+        os.remove(big)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--benchmark':
+        benchmark(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 4)
+    elif len(sys.argv) >= 2:
+        result = verify_mp4(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(result.summary())
+        for track in result.tracks:
+            print(f"  轨道 {track.track_id} {track.handler}: {track.seconds:.3f} 秒，{track.samples} 个样本")
+        sys.exit(0 if result.ok else 1)
+    else:
+        print("用法: python mp4_verify.py 输出.mp4 [播放列表总时长秒]")
+        print("      python mp4_verify.py --benchmark 输出.mp4 [GB]")
+        sys.exit(2)
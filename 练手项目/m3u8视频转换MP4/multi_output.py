@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+一次读取，多个输出
+同一个播放列表需要 MP4、纯音频 M4A 和按大小分段的 MP4 时，只启动一个 ffmpeg、只解复用一遍，
+各输出在同一条命令里各自 -map 所需的流，分片只被读取一次（原来三个输出要读三遍）
+
+输出类型：
+  - 'mp4'：完整的音视频 MP4（输出到指定的输出文件）
+  - 'm4a'：只含音频的 M4A（<输出名>.m4a）
+  - 'split:大小'：按大小分段的 MP4（<输出名>_part001.mp4 ...），在分片边界处切分，
+    每段不超过指定大小（按 .ts 分片大小计算，音频在单独音轨中时加上与该段时间重叠的全部音频分片；
+    MP4 封装比 TS 小，实际文件只会更小）
+各输出先写入同目录下的 .partial 临时文件，ffmpeg 成功后才替换原有的输出，失败时上次的结果保持不变
+"""
+
+import bisect
+import glob
+import os
+import sys
+import time
+
+from ffmpeg_progress import run_ffmpeg
+from hls_download import DEFAULT_WORKERS, HLSDownloader, is_url
+from hls_variants import plan_exports
+from m3u8_parser import PlaylistError, load_playlist
+from stream_pipeline import iter_in_order, open_source
+from toolchain import ffmpeg_command
+
+TARGET_KINDS = ('mp4', 'm4a', 'split')
+
+SIZE_UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# 转换过程中的临时文件在扩展名之前加上的后缀（扩展名不变，ffmpeg 据此选择封装格式）
+PARTIAL_SUFFIX = '.partial'
+
+
+def size_text(size):
+    """用于日志和文件名的简短大小，例如 '2G'、'700M'"""
+    for unit in ('t', 'g', 'm', 'k'):
+        scale = SIZE_UNITS[unit]
+        if size >= scale:
+            return f"{size / scale:g}{unit.upper()}" if size % scale == 0 else f"{size / scale:.1f}{unit.upper()}"
+    return f"{size}B"
+
+
+class MultiOutputError(ValueError):
+    """输出类型无效或播放列表不支持一次多输出"""
+
+
+def parse_size(value):
+    """大小，例如 '2G'、'700M'、'1.5g' 或字节数"""
+    text = str(value).strip().lower().rstrip('b')
+    scale = 1
+    if text and text[-1] in SIZE_UNITS:
+        text, scale = text[:-1], SIZE_UNITS[text[-1]]
+    try:
+        size = int(float(text) * scale)
+    except ValueError:
+        raise MultiOutputError(f"无效的大小: {value}")
+    if size <= 0:
+        raise MultiOutputError(f"大小必须大于 0: {value}")
+    return size
+
+
+def parse_targets(value):
+    """
+    输出类型列表：逗号分隔的字符串（例如 'mp4,m4a,split:2G'）或字符串列表，
+    返回 [(类型, 分段大小或 None), ...]；已解析过的结果原样返回
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    specs = []
+    for item in value:
+        if isinstance(item, tuple):
+            item = f"{item[0]}:{item[1]}" if item[1] else item[0]
+        kind, _, size = str(item).strip().lower().partition(':')
+        if kind not in TARGET_KINDS:
+            raise MultiOutputError(f"未知的输出类型: {item}（可选 {', '.join(TARGET_KINDS)}）")
+        if kind == 'split' and not size:
+            raise MultiOutputError("split 需要指定每段大小，例如 split:2G")
+        spec = (kind, parse_size(size) if kind == 'split' else None)
+        if spec not in specs:
+            specs.append(spec)
+    if not specs:
+        raise MultiOutputError("没有指定输出类型")
+    return specs
+
+
+class OutputTarget:
+    """一个输出：kind 为输出类型，path 为输出文件（分段输出时为带 %03d 的文件名模板）"""
+
+    def __init__(self, kind, path, max_bytes=None):
+        self.kind = kind
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @property
+    def label(self):
+        return f"split:{size_text(self.max_bytes)}" if self.kind == 'split' else self.kind
+
+    @property
+    def partial_path(self):
+        """ffmpeg 实际写入的临时文件（分段输出时同样为文件名模板）"""
+        root, ext = os.path.splitext(self.path)
+        return root + PARTIAL_SUFFIX + ext
+
+    def existing_outputs(self, partial=False):
+        """已写出的输出文件（分段输出按序号排列），partial 为 True 时为本次写入的临时文件"""
+        path = self.partial_path if partial else self.path
+        if self.kind != 'split':
+            return [path] if os.path.exists(path) else []
+        stem, _, suffix = path.rpartition('%03d')
+        return sorted(glob.glob(glob.escape(stem.replace('%%', '%')) + '[0-9][0-9][0-9]' + glob.escape(suffix)))
+
+    def commit(self):
+        """用本次写出的临时文件替换输出（分段输出先删除上次的全部分段），返回输出文件列表"""
+        partials = self.existing_outputs(partial=True)
+        if self.kind != 'split':
+            for path in partials:
+                os.replace(path, self.path)
+            return self.existing_outputs()
+        for path in self.existing_outputs():
+            os.remove(path)
+        outputs = []
+        for path in partials:
+            root, ext = os.path.splitext(path)
+            outputs.append(root[:-len(PARTIAL_SUFFIX)] + ext)
+            os.replace(path, outputs[-1])
+        return outputs
+
+    def discard(self):
+        """删除本次写出的临时文件，原有的输出不受影响"""
+        for path in self.existing_outputs(partial=True):
+            os.remove(path)
+
+
+def commit_outputs(targets):
+    """ffmpeg 成功后用临时文件替换全部输出，返回输出文件列表"""
+    return [path for target in targets for path in target.commit()]
+
+
+def discard_outputs(targets):
+    """ffmpeg 失败或被取消时删除全部临时文件"""
+    for target in targets:
+        target.discard()
+
+
+def plan_targets(output_path, specs):
+    """按输出类型生成输出文件：mp4 为 output_path，m4a 和分段输出与它同名放在一起"""
+    stem = os.path.splitext(output_path)[0]
+    targets = []
+    for kind, max_bytes in specs:
+        if kind == 'mp4':
+            targets.append(OutputTarget(kind, output_path))
+        elif kind == 'm4a':
+            targets.append(OutputTarget(kind, stem + '.m4a'))
+        else:
+            # 分段大小不同的多个 split 输出用大小区分文件名；% 是分段序号模板的保留字符
+            suffix = '_part' if sum(1 for k, _ in specs if k == 'split') == 1 else f"_{size_text(max_bytes)}_part"
+            targets.append(OutputTarget(kind, stem.replace('%', '%%') + suffix + '%03d.mp4',
+                                        max_bytes))
+    return targets
+
+
+def segment_size(segment):
+    """分片字节数：有 BYTERANGE 时为其长度，否则为本地文件大小；在线分片返回 None"""
+    if segment.byterange:
+        return segment.byterange[0]
+    if is_url(segment.path):
+        return None
+    return os.path.getsize(segment.path)
+
+
+def _segment_sizes(playlist):
+    sizes = [segment_size(segment) for segment in playlist.segments]
+    if None in sizes:
+        raise MultiOutputError("在线分片大小未知，按大小分段需要先下载")
+    return sizes
+
+
+def plan_split_times(playlist, max_bytes, audio_playlist=None):
+    """
+    按分片累计大小计算分段时间点（秒），只在分片边界切分（HLS 分片以关键帧开头），
+    每段累计不超过 max_bytes；单个分片超过上限时该分片单独成段。
+    audio_playlist 为单独音轨的媒体播放列表时，每段还要算上与它时间重叠的音频分片（按整个分片计，宁大勿小）
+    """
+    starts, ends, prefix = [], [], [0]
+    if audio_playlist is not None:
+        elapsed = 0.0
+        for segment, size in zip(audio_playlist.segments, _segment_sizes(audio_playlist)):
+            starts.append(elapsed)
+            elapsed += segment.duration
+            ends.append(elapsed)
+            prefix.append(prefix[-1] + size)
+
+    def audio_bytes(begin, end):
+        # 与 [begin, end) 重叠的音频分片：结束时间晚于 begin 且开始时间早于 end
+        first = bisect.bisect_right(ends, begin)
+        last = bisect.bisect_left(starts, end)
+        return prefix[last] - prefix[first] if last > first else 0
+
+    times = []
+    elapsed = 0.0
+    part_start = 0.0
+    part_bytes = 0
+    for segment, size in zip(playlist.segments, _segment_sizes(playlist)):
+        end = elapsed + segment.duration
+        if part_bytes and part_bytes + size + audio_bytes(part_start, end) > max_bytes:
+            times.append(elapsed)
+            part_start = elapsed
+            part_bytes = 0
+        part_bytes += size
+        elapsed = end
+    return times
+
+
+def _target_args(target, video_map, audio_map, audio_bsf, split_times, output_args):
+    if target.kind == 'm4a':
+        args = ['-map', audio_map, '-vn', '-c', 'copy']
+    else:
+        # 音视频输出允许没有音频（只有视频的播放列表）
+        args = ['-map', video_map, '-map', audio_map + '?', '-c', 'copy']
+    if audio_bsf:
+        args += ['-bsf:a', 'aac_adtstoasc']
+    if target.kind != 'split':
+        return args + [*(output_args or []), '-y', target.partial_path]
+    if not split_times:
+        # 总大小不超过上限：只有一段，直接写出第一段的文件
+        return args + [*(output_args or []), '-y', target.partial_path % 1]
+    args += ['-f', 'segment', '-segment_format', 'mp4', '-segment_start_number', '1', '-reset_timestamps', '1',
+             '-segment_times', ','.join(f"{t:.3f}" for t in split_times)]
+    if output_args and '-movflags' in output_args:
+        args += ['-segment_format_options', f"movflags={output_args[output_args.index('-movflags') + 1]}"]
+    return args + ['-y', target.partial_path]
+
+
+def resolve_media(m3u8_path, output_path, selection):
+    """返回 (媒体播放列表, 单独音轨播放列表路径或 None)；主播放列表按 selection 选择一路码率"""
+    playlist = load_playlist(m3u8_path)
+    if not playlist.is_master:
+        return playlist, None
+    if selection == 'all':
+        raise MultiOutputError("一次多输出不支持同时导出所有码率，请选择一路码率")
+    task = plan_exports(playlist, output_path, selection)[0]
+    return load_playlist(task.variant.path), task.audio.path if task.audio else None
+
+
+def build_command(ffmpeg_cmd, playlist, audio_playlist, targets, piped=False, output_args=None):
+    """
+    生成一次读取、写出全部输出的 ffmpeg 命令；piped 为 True 时分片从标准输入读入（-f mpegts）
+    输出写入各目标的临时文件，成功后由 commit_outputs 替换，失败时由 discard_outputs 删除
+    """
+    if piped:
+        cmd = [ffmpeg_cmd, '-f', 'mpegts', '-i', 'pipe:0']
+    else:
+        cmd = [ffmpeg_cmd, '-i', playlist.path]
+    if audio_playlist:
+        cmd += ['-i', audio_playlist]
+        video_map, audio_map = '0:v?', '1:a'
+    else:
+        video_map, audio_map = '0:v?', '0:a'
+    audio_bsf = audio_playlist is None or audio_playlist.lower().endswith('.m3u8')
+    audio_media = None
+    if audio_playlist and audio_playlist.lower().endswith('.m3u8') and any(t.kind == 'split' for t in targets):
+        audio_media = load_playlist(audio_playlist)
+    for target in targets:
+        split_times = plan_split_times(playlist, target.max_bytes, audio_media) if target.kind == 'split' else None
+        cmd += _target_args(target, video_map, audio_map, audio_bsf, split_times, output_args)
+    return cmd
+
+
+def convert_multi(m3u8_path, output_path, specs, ffmpeg_cmd=None, selection='best', workers=DEFAULT_WORKERS,
+                  output_args=None, on_progress=None, on_stderr=None, log=print):
+    """
+    一次读取播放列表，写出 specs（parse_targets 的结果）要求的全部输出，返回 (返回码, 错误信息, 输出文件列表)
+    AES-128 加密的分片由内置解密后经标准输入送给 ffmpeg，仍只读取一遍；
+    on_progress(FFmpegProgress) 和 on_stderr(line) 直接传给 run_ffmpeg；
+    失败时只删除本次写出的临时文件，上次转换的输出保持不变
+    """
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    targets = plan_targets(output_path, specs)
+    downloader = None
+    try:
+        playlist, audio_playlist = resolve_media(m3u8_path, output_path, selection)
+        if not playlist.segments:
+            raise MultiOutputError("播放列表中没有分片")
+        piped = playlist.encrypted and audio_playlist is None
+        if playlist.encrypted and audio_playlist:
+            raise MultiOutputError("加密分片与单独音轨同时存在时不支持一次多输出")
+        # 上次中断留下的分段临时文件会和本次的混在一起，先删除
+        discard_outputs(targets)
+        cmd = build_command(ffmpeg_cmd, playlist, audio_playlist, targets, piped, output_args)
+    except (OSError, PlaylistError, MultiOutputError) as e:
+        return 1, str(e), []
+
+    for target in targets:
+        log(f"输出 {target.label}: {target.path}")
+    log(f"执行命令: {' '.join(cmd)}")
+    feed = None
+    if piped:
+        downloader = HLSDownloader(workers=workers, log=log)
+        _, fetch = open_source(playlist.path, downloader)
+
+        def feed(stdin):
+            for data in iter_in_order(fetch, len(playlist.segments), workers):
+                stdin.write(data)
+
+    try:
+        returncode, error = run_ffmpeg(cmd, on_progress=on_progress, on_stderr=on_stderr, feed=feed)
+    except FileNotFoundError:
+        returncode, error = 1, "找不到 ffmpeg"
+    except Exception as e:
+        returncode, error = 1, str(e)
+    finally:
+        if downloader:
+            downloader.close()
+
+    if returncode != 0:
+        # 中途失败的输出不完整，不保留
+        discard_outputs(targets)
+        return returncode, error, []
+    return 0, '', commit_outputs(targets)
+
+
+def _read_bytes():
+    """本进程及已回收子进程的 /proc/self/io 读取调用字节数（rchar），不支持时为 None"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            fields = dict(line.split(':') for line in f if ':' in line)
+        return int(fields['rchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def benchmark_multi(m3u8_path, specs, ffmpeg_cmd=None, log=print):
+    """
+    对比每个输出各运行一次 ffmpeg 与一次多输出的耗时和读取字节数，返回 {'separate': (秒, 字节), 'single': (秒, 字节)}
+    读取字节数取自 /proc/self/io 的 rchar（子进程退出并被回收后计入父进程），包含 ffmpeg 自身的少量读取
+    """
+    import tempfile
+
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'bench.mp4')
+        runs = {'separate': [[spec] for spec in specs], 'single': [specs]}
+        for name, groups in runs.items():
+            before = _read_bytes()
+            start = time.time()
+            for group in groups:
+                returncode, error, outputs = convert_multi(m3u8_path, output, group, ffmpeg_cmd=ffmpeg_cmd,
+                                                           log=lambda message: None)
+                if returncode != 0:
+                    raise MultiOutputError(f"转换失败: {error}")
+                for path in outputs:
+                    os.remove(path)
+            elapsed = time.time() - start
+            after = _read_bytes()
+            results[name] = (elapsed, after - before if before is not None and after is not None else None)
+
+    titles = {'separate': f"分别转换 {len(specs)} 次", 'single': "一次多输出"}
+    log(f"{'方式':<16}{'耗时(秒)':>10}{'读取 MB':>12}")
+    for name, (elapsed, read) in results.items():
+        log(f"{titles[name]:<16}{elapsed:>10.2f}{f'{read / (1024 * 1024):.2f}' if read is not None else '-':>12}")
+    separate, single = results['separate'][1], results['single'][1]
+    if separate and single:
+        log(f"读取量为分别转换的 {single / separate:.0%}")
+    return results
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if len(args) < 2:
+        print("用法: python multi_output.py [--benchmark] 播放列表.m3u8 输出.mp4 [mp4,m4a,split:2G]")
+        sys.exit(2)
+    try:
+        specs = parse_targets(args[2] if len(args) > 2 else 'mp4,m4a')
+    except MultiOutputError as e:
+        print(e)
+        sys.exit(2)
+    if '--benchmark' in sys.argv:
+        benchmark_multi(args[0], specs)
+        sys.exit(0)
+    code, message, files = convert_multi(args[0], args[1], specs)
+    if code != 0:
+        print(f"转换失败: {message}")
+    else:
+        print('\n'.join(files))
+    sys.exit(code)
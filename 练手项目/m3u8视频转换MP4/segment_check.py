@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+转换前的分片完整性检查
+并发 stat 播放列表中的所有本地分片，并通过 mmap 检查 TS 同步字节（每 188 字节一个 0x47）
+与包对齐，在启动 ffmpeg 之前找出缺失、为空或损坏的分片（末尾不完整的包只作为警告，ffmpeg 能正常处理）
+"""
+
+import mmap
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from m3u8_parser import load_playlist
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# 快速模式下每个分片抽查的包数（首尾两个包总会检查）
+SAMPLE_PACKETS = 64
+
+# 一个有问题的分片：problem 为 'missing' / 'empty' / 'corrupt'，或只作为警告的 'partial'
+SegmentIssue = namedtuple('SegmentIssue', 'index path problem detail')
+
+# 不阻止转换的问题：末尾不完整的 TS 包会被 ffmpeg 丢弃，不影响其余内容
+WARNING_PROBLEMS = {'partial'}
+
+
+class ScanReport:
+    """检查结果"""
+
+    def __init__(self, playlist_path):
+        self.playlist_path = playlist_path
+        self.total = 0      # 分片总数
+        self.checked = 0    # 实际检查的本地分片数
+        self.skipped = 0    # 远程分片等无法检查的分片数
+        self.bytes = 0      # 本地分片总字节数
+        self.issues = []
+        self.warnings = []  # 不阻止转换的问题（WARNING_PROBLEMS）
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.issues
+
+    def by_problem(self, problem):
+        return [issue for issue in self.issues if issue.problem == problem]
+
+    def summary(self):
+        if self.ok:
+            warning = f"，{len(self.warnings)} 个分片末尾有不完整的 TS 包（转换时忽略）" if self.warnings else ''
+            return (f"分片检查通过：{self.checked} 个分片，共 {self.bytes / (1024 * 1024):.2f} MB，"
+                    f"用时 {self.elapsed * 1000:.0f} 毫秒{warning}")
+        return (f"分片检查发现 {len(self.issues)} 个问题：缺失 {len(self.by_problem('missing'))}，"
+                f"为空 {len(self.by_problem('empty'))}，损坏 {len(self.by_problem('corrupt'))}")
+
+    def lines(self, limit=20):
+        """问题明细（最多 limit 行，警告排在后面）"""
+        issues = self.issues + self.warnings
+        result = [f"  #{issue.index} {issue.path}: {issue.detail}" for issue in issues[:limit]]
+        if len(issues) > limit:
+            result.append(f"  ... 另有 {len(issues) - limit} 个")
+        return result
+
+
+def _check_sync(mm, start, length, full):
+    """检查 [start, start+length) 范围内各 TS 包的同步字节，返回第一个错误的包偏移或 None"""
+    packets = length // TS_PACKET_SIZE
+    if full or packets <= SAMPLE_PACKETS:
+        sync = mm[start:start + packets * TS_PACKET_SIZE:TS_PACKET_SIZE]
+        if sync.count(TS_SYNC_BYTE) == len(sync):
+            return None
+        for i, value in enumerate(sync):
+            if value != TS_SYNC_BYTE:
+                return start + i * TS_PACKET_SIZE
+        return None
+    step = max(packets // SAMPLE_PACKETS, 1)
+    indexes = list(range(0, packets, step)) + [packets - 1]
+    for i in indexes:
+        offset = start + i * TS_PACKET_SIZE
+        if mm[offset] != TS_SYNC_BYTE:
+            return offset
+    return None
+
+
+def check_segment(index, segment, encrypted=False, full=False):
+    """
+    检查单个分片，返回 (文件大小, SegmentIssue 或 None)；远程分片返回 (None, None)
+    加密分片只检查长度是否为 16 字节的整数倍；非 .ts 分片只检查存在且非空；
+    .ts 分片末尾有不完整的包时返回 'partial'（警告），其余完整的包照常检查同步字节
+    """
+    path = segment.path
+    if '://' in path:
+        return None, None
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        return 0, SegmentIssue(index, path, 'missing', '文件不存在')
+    if segment.byterange:
+        length, offset = segment.byterange
+        if offset + length > size:
+            return size, SegmentIssue(index, path, 'corrupt',
+                                      f"字节范围 {offset}+{length} 超出文件大小 {size}")
+    else:
+        length, offset = size, 0
+    if length == 0:
+        return size, SegmentIssue(index, path, 'empty', '文件为空')
+
+    if encrypted:
+        if length % 16:
+            return size, SegmentIssue(index, path, 'corrupt', f"加密分片长度 {length} 不是 16 的整数倍")
+        return size, None
+    if not path.lower().endswith('.ts'):
+        return size, None
+    if length < TS_PACKET_SIZE:
+        return size, SegmentIssue(index, path, 'corrupt', f"长度 {length} 不足一个 TS 包")
+
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                bad = _check_sync(mm, offset, length, full)
+    except (OSError, ValueError) as e:
+        return size, SegmentIssue(index, path, 'corrupt', f"无法读取: {e}")
+    if bad is not None:
+        return size, SegmentIssue(index, path, 'corrupt', f"偏移 {bad} 处缺少同步字节 0x47")
+    if length % TS_PACKET_SIZE:
+        return size, SegmentIssue(index, path, 'partial',
+                                  f"警告：长度 {length} 不是 {TS_PACKET_SIZE} 字节的整数倍，"
+                                  f"末尾 {length % TS_PACKET_SIZE} 字节不完整（文件可能被截断）")
+    return size, None
+
+
+def scan_playlist(m3u8_path, workers=None, full=False):
+    """
+    并发检查播放列表中的所有分片，返回 ScanReport
+    full=False 时每个分片只抽查部分 TS 包的同步字节，full=True 时检查全部包
+    主播放列表没有分片，直接返回空报告
+    """
+    start = time.time()
+    report = ScanReport(os.path.abspath(m3u8_path))
+    playlist = load_playlist(m3u8_path)
+    if playlist.is_master:
+        report.elapsed = time.time() - start
+        return report
+
+    segments = playlist.segments
+    report.total = len(segments)
+    encrypted = [seg.key is not None and playlist.keys[seg.key].method != 'NONE' for seg in segments]
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            lambda i: check_segment(i, segments[i], encrypted[i], full),
+            range(len(segments))
+        ))
+
+    for size, issue in results:
+        if size is None:
+            report.skipped += 1
+            continue
+        report.checked += 1
+        report.bytes += size
+        if issue:
+            (report.warnings if issue.problem in WARNING_PROBLEMS else report.issues).append(issue)
+    report.elapsed = time.time() - start
+    return report
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args:
+        print("用法: python segment_check.py [--full] index.m3u8 [...]")
+        sys.exit(2)
+    failed = False
+    for path in args:
+        report = scan_playlist(path, full='--full' in sys.argv)
+        print(f"{path}: {report.summary()}")
+        for line in report.lines():
+            print(line)
+        failed = failed or not report.ok
+    sys.exit(1 if failed else 0)
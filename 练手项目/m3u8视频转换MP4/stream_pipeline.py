@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+边下载边转封装
+分片并发下载（加密分片同时解密），按播放列表顺序送入转封装器（ffmpeg 标准输入或内置引擎），
+后面的分片仍在下载时前面的分片已经在转封装，总耗时接近 max(下载, 转封装) 而不是两者之和
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ffmpeg_progress import run_ffmpeg
+from hls_decrypt import KeyStore, check_supported, decrypt_bytes, segment_iv
+from hls_download import DEFAULT_WORKERS, HLSDownloader, is_url
+from m3u8_parser import load_playlist
+from toolchain import ffmpeg_command
+from ts_remux import TSRemuxer
+
+# 重排缓冲区相对并发数的倍数：最多领先当前写入位置 workers * WINDOW_FACTOR 个分片
+WINDOW_FACTOR = 2
+
+
+class PipelineError(Exception):
+    """播放列表无法流式转封装"""
+
+
+def iter_in_order(fetch, count, workers=DEFAULT_WORKERS, window=None):
+    """
+    并发执行 fetch(0..count-1)，按下标顺序逐个产出结果
+    已提交但未被取走的任务最多 window 个，超出时暂停提交，内存占用有上限
+    """
+    workers = max(1, workers)
+    window = max(window or workers * WINDOW_FACTOR, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        next_submit = 0
+        try:
+            for i in range(count):
+                while next_submit < count and next_submit < i + window:
+                    pending[next_submit] = pool.submit(fetch, next_submit)
+                    next_submit += 1
+                yield pending.pop(i).result()
+        finally:
+            # 出错或提前停止时取消尚未开始的下载
+            for future in pending.values():
+                future.cancel()
+
+
+def read_local_segment(path, byterange=None):
+    """读取本地分片内容；byterange 为 (长度, 偏移) 时只读取该范围（#EXT-X-BYTERANGE）"""
+    with open(path, 'rb') as f:
+        if byterange:
+            length, offset = byterange
+            f.seek(offset)
+            return f.read(length)
+        return f.read()
+
+
+def open_source(source, downloader):
+    """读取本地或远程播放列表，返回 (播放列表, fetch(下标) -> 分片内容)"""
+    if is_url(source):
+        playlist = downloader.fetch_playlist(source)
+    else:
+        playlist = load_playlist(source)
+        if playlist.is_master:
+            raise PipelineError("本地主播放列表请先选择具体的子播放列表")
+    if playlist.init_map:
+        raise PipelineError("fMP4 分片（EXT-X-MAP）暂不支持流式转封装")
+    problem = check_supported(playlist)
+    if problem:
+        raise PipelineError(problem)
+    if not playlist.segments:
+        raise PipelineError("播放列表中没有分片")
+
+    segments = playlist.segments
+    keys = KeyStore(downloader)
+
+    def fetch(index):
+        seg = segments[index]
+        if is_url(seg.path):
+            data = downloader.fetch_bytes(seg.path, seg.byterange)
+        else:
+            data = read_local_segment(seg.path, seg.byterange)
+        # 解密在下载线程中进行，与转封装同时运行
+        if seg.key is not None:
+            key = playlist.keys[seg.key]
+            data = decrypt_bytes(data, keys.get(key), segment_iv(key, seg.sequence))
+        return data
+
+    return playlist, fetch
+
+
+def pipeline_convert(source, output_path, muxer='ffmpeg', ffmpeg_cmd=None, workers=DEFAULT_WORKERS,
+                     window=None, on_progress=None, log=print, output_args=None):
+    """
+    边下载边转封装，返回 (返回码, 错误信息)
+    source 为本地播放列表路径或 http(s) 地址，AES-128 加密的分片在下载线程中解密；
+    muxer 为 'ffmpeg'（写入 ffmpeg 标准输入）、'native'（内置引擎，输出分片 MP4）
+    或 'ts'（直接拼接为 .ts）；
+    on_progress(已写入分片数, 分片总数, 已写入时长, 总时长) 每写入一个分片回调一次；
+    output_args 为传给 ffmpeg 的额外输出参数（例如 -movflags）
+    """
+    start = time.time()
+    downloader = HLSDownloader(workers=workers, log=log)
+    try:
+        playlist, fetch = open_source(source, downloader)
+        segments = playlist.segments
+        state = {'bytes': 0, 'duration': 0.0}
+        log(f"边下载边转封装: {len(segments)} 个分片（并发 {workers}），输出 {output_path}")
+
+        def write_all(write):
+            for i, data in enumerate(iter_in_order(fetch, len(segments), workers, window)):
+                write(data)
+                state['bytes'] += len(data)
+                state['duration'] += segments[i].duration
+                if on_progress:
+                    on_progress(i + 1, len(segments), state['duration'], playlist.total_duration)
+
+        if muxer == 'ts':
+            with open(output_path, 'wb') as out:
+                write_all(out.write)
+            returncode, error = 0, ''
+        elif muxer == 'native':
+            with open(output_path, 'wb') as out:
+                remuxer = TSRemuxer(out)
+                write_all(remuxer.feed)
+                remuxer.finish()
+            returncode, error = 0, ''
+        else:
+            cmd = [ffmpeg_cmd or ffmpeg_command(), '-f', 'mpegts', '-i', 'pipe:0', '-c', 'copy', '-bsf:a', 'aac_adtstoasc',
+                   *(output_args or []), '-y', output_path]
+            returncode, error = run_ffmpeg(cmd, feed=lambda stdin: write_all(stdin.write))
+    except Exception as e:
+        returncode, error = 1, str(e)
+    finally:
+        downloader.close()
+
+    if returncode == 0:
+        elapsed = max(time.time() - start, 1e-6)
+        log(f"完成：{state['bytes'] / (1024 * 1024):.2f} MB，用时 {elapsed:.2f} 秒，"
+            f"{state['bytes'] / (1024 * 1024) / elapsed:.1f} MB/s")
+    elif os.path.exists(output_path):
+        # 中途失败的输出不完整，不保留
+        os.remove(output_path)
+    return returncode, error
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if len(args) < 2:
+        print("用法: python stream_pipeline.py [--native] 播放列表路径或地址 输出.mp4 [并发数]")
+        sys.exit(2)
+    code, message = pipeline_convert(
+        args[0], args[1],
+        muxer='native' if '--native' in sys.argv else 'ffmpeg',
+        workers=int(args[2]) if len(args) > 2 else DEFAULT_WORKERS
+    )
+    if code != 0:
+        print(f"转换失败: {message}")
+    sys.exit(code)
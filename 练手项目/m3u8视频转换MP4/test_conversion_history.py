@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""conversion_history 的测试：内容指纹随分片和码率变化失效"""
+
+import os
+
+import pytest
+
+from conversion_history import ConversionHistory, playlist_fingerprint
+from convert_m3u8_to_mp4 import find_converted, new_job_result, run_job
+
+
+def _media(folder, sizes):
+    """folder 下的媒体播放列表和指定大小的分片，返回播放列表路径"""
+    os.makedirs(folder, exist_ok=True)
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+    for i, size in enumerate(sizes):
+        with open(os.path.join(folder, f"seg{i}.ts"), 'wb') as f:
+            f.write(b'\x47' * size)
+        lines += ['#EXTINF:4.0,', f"seg{i}.ts"]
+    lines.append('#EXT-X-ENDLIST')
+    path = os.path.join(folder, 'index.m3u8')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+@pytest.fixture
+def master(tmp_path):
+    """两路码率（720p 和 480p）共用一条单独音轨的主播放列表"""
+    _media(str(tmp_path / 'v720'), [3000, 3000])
+    _media(str(tmp_path / 'v480'), [1000, 1000])
+    _media(str(tmp_path / 'aud'), [200, 200])
+    path = tmp_path / 'master.m3u8'
+    path.write_text(
+        '#EXTM3U\n'
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="main",DEFAULT=YES,URI="aud/index.m3u8"\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=854x480,AUDIO="aac"\n'
+        'v480/index.m3u8\n'
+        '#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,AUDIO="aac"\n'
+        'v720/index.m3u8\n',
+        encoding='utf-8'
+    )
+    return str(path)
+
+
+def test_media_fingerprint_tracks_segments(tmp_path):
+    path = _media(str(tmp_path / 'a'), [100, 200])
+    before = playlist_fingerprint(path)
+    assert playlist_fingerprint(path) == before
+    with open(tmp_path / 'a' / 'seg1.ts', 'ab') as f:
+        f.write(b'\x47')
+    assert playlist_fingerprint(path) != before
+    os.remove(tmp_path / 'a' / 'seg0.ts')
+    assert playlist_fingerprint(path) != before
+
+
+def test_master_fingerprint_covers_selected_variant(tmp_path, master):
+    best = playlist_fingerprint(master, 'best')
+    low = playlist_fingerprint(master, 800000)
+    assert best != low
+
+    # 未选中的码率变化不影响指纹，选中的码率或音轨变化时失效
+    _media(str(tmp_path / 'v480'), [1000, 1500])
+    assert playlist_fingerprint(master, 'best') == best
+    assert playlist_fingerprint(master, 800000) != low
+    _media(str(tmp_path / 'v720'), [3000, 3001])
+    assert playlist_fingerprint(master, 'best') != best
+    changed = playlist_fingerprint(master, 'best')
+    _media(str(tmp_path / 'aud'), [200, 300])
+    assert playlist_fingerprint(master, 'best') != changed
+
+
+def test_history_skips_only_unchanged_content(tmp_path, master):
+    history = ConversionHistory(str(tmp_path / 'history.sqlite3'))
+    output = tmp_path / 'out.mp4'
+    output.write_bytes(b'\x00' * 64)
+    fingerprint = playlist_fingerprint(master)
+    history.record(master, fingerprint, str(output), True)
+    assert history.find_converted(playlist_fingerprint(master), str(output)).output_path == str(output)
+
+    # 重新下载后选中码率的分片变了：不再视为已转换
+    _media(str(tmp_path / 'v720'), [4000, 4000])
+    assert history.find_converted(playlist_fingerprint(master), str(output)) is None
+
+    # 输出被改动后记录也不再有效
+    output.write_bytes(b'\x00' * 32)
+    assert history.find_converted(fingerprint, str(output)) is None
+    history.close()
+
+
+def test_history_skips_only_same_output_and_options(tmp_path):
+    path = _media(str(tmp_path / 'in'), [188 * 4, 188 * 2])
+    history = ConversionHistory(str(tmp_path / 'history.sqlite3'))
+    job = {'input': path, 'output': str(tmp_path / 'in.ts')}
+    first = run_job(job, history=history, check=False)
+    assert first['ok'] and not first['skipped']
+    assert run_job(job, history=history, check=False)['skipped']
+
+    # 同一内容转换到另一个输出：必须真正转换
+    other = run_job({'input': path, 'output': str(tmp_path / 'other.ts')}, history=history, check=False)
+    assert other['ok'] and not other['skipped']
+    assert other['output'] == str(tmp_path / 'other.ts')
+    assert os.path.getsize(tmp_path / 'other.ts') == 188 * 6
+
+    # 选项不同（分片 MP4、多输出）时也不跳过
+    output = str(tmp_path / 'in.ts')
+    for options in ({'fragmented': True}, {'targets': 'mp4,m4a'}):
+        result = new_job_result(path, output, 'auto')
+        assert find_converted(history, path, output, result, **options)
+        assert not result['skipped']
+    history.close()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""hls_variants 的测试：码率选择和导出文件命名"""
+
+import pytest
+
+from hls_variants import VariantError, parse_selection, plan_exports, select_variants, variant_label
+from m3u8_parser import load_playlist
+
+
+def _master(tmp_path, streams):
+    """streams 为 [(码率, 分辨率或 None, 地址), ...]"""
+    lines = ['#EXTM3U']
+    for bandwidth, resolution, uri in streams:
+        attrs = f"BANDWIDTH={bandwidth}" + (f",RESOLUTION={resolution}" if resolution else '')
+        lines += [f"#EXT-X-STREAM-INF:{attrs}", uri]
+    path = tmp_path / 'master.m3u8'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return load_playlist(str(path))
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 'best'), ('best', 'best'), (' ALL ', 'all'), ('800000', 800000),
+    ('2500k', 2500000), ('1.5m', 1500000), (3000000, 3000000),
+])
+def test_parse_selection(value, expected):
+    assert parse_selection(value) == expected
+
+
+@pytest.mark.parametrize('value', ['fast', '', 'k'])
+def test_parse_selection_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        parse_selection(value)
+
+
+@pytest.fixture
+def master(tmp_path):
+    return _master(tmp_path, [
+        (800000, '854x480', 'v480/index.m3u8'),
+        (5000000, '1920x1080', 'v1080/index.m3u8'),
+        (2500000, '1280x720', 'v720/index.m3u8'),
+        (5000000, '1280x720', 'v720b/index.m3u8'),
+    ])
+
+
+def _labels(variants):
+    return [variant_label(v) for v in variants]
+
+
+def test_select_best_prefers_resolution_on_equal_bandwidth(master):
+    assert _labels(select_variants(master, 'best')) == ['1080p_5000k']
+
+
+def test_select_by_bandwidth(master):
+    assert _labels(select_variants(master, 3000000)) == ['720p_2500k']
+    assert _labels(select_variants(master, 2500000)) == ['720p_2500k']
+    # 都超过上限时取最低的一路
+    assert _labels(select_variants(master, 100000)) == ['480p_800k']
+
+
+def test_select_all_is_sorted_high_to_low(master):
+    assert _labels(select_variants(master, 'all')) == ['1080p_5000k', '720p_5000k', '720p_2500k', '480p_800k']
+
+
+def test_select_without_variants(tmp_path):
+    path = tmp_path / 'master.m3u8'
+    path.write_text('#EXTM3U\n#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",NAME="x",URI="a.m3u8"\n', encoding='utf-8')
+    with pytest.raises(VariantError):
+        select_variants(load_playlist(str(path)), 'best')
+
+
+def test_plan_exports_names(tmp_path):
+    master = _master(tmp_path, [
+        (2500000, '1280x720', 'a/index.m3u8'),
+        (2500000, '1280x720', 'b/index.m3u8'),
+        (800000, None, 'c/index.m3u8'),
+    ])
+    out = str(tmp_path / 'out.mp4')
+    assert [t.output_path for t in plan_exports(master, out, 'best')] == [out]
+    names = [t.output_path for t in plan_exports(master, out, 'all')]
+    assert names == [str(tmp_path / n) for n in ('out_720p_2500k.mp4', 'out_720p_2500k_2.mp4', 'out_800k.mp4')]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""m3u8_parser 的测试：无法解析的标签值报 PlaylistError 并带行号"""
+
+import pytest
+
+from convert_m3u8_to_mp4 import is_encrypted, preflight_check
+from m3u8_parser import PlaylistError, parse_playlist
+
+
+@pytest.mark.parametrize('line, number', [
+    ('#EXT-X-TARGETDURATION:abc', 2),
+    ('#EXT-X-MEDIA-SEQUENCE:1.5', 2),
+    ('#EXT-X-VERSION:x', 2),
+    ('#EXT-X-KEY:METHOD=AES-128,URI="k.key",IV=0xZZ', 2),
+    ('#EXT-X-MAP:BYTERANGE="100@0"', 2),
+    ('#EXT-X-BYTERANGE:abc', 3),
+])
+def test_bad_tag_value_reports_line(line, number):
+    text = f"#EXTM3U\n{line}\nseg0.ts\n"
+    with pytest.raises(PlaylistError, match=f"第 {number} 行"):
+        parse_playlist(text, '/tmp/index.m3u8')
+
+
+def test_bad_stream_inf_reports_uri_line():
+    text = '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=fast\nv/index.m3u8\n'
+    with pytest.raises(PlaylistError, match='第 3 行'):
+        parse_playlist(text, '/tmp/master.m3u8')
+
+
+def test_bad_extinf_is_zero_duration():
+    playlist = parse_playlist('#EXTM3U\n#EXTINF:abc,\nseg0.ts\n', '/tmp/index.m3u8')
+    assert playlist.segments[0].duration == 0.0
+
+
+def test_unparsable_playlist_is_left_to_ffmpeg(tmp_path):
+    path = tmp_path / 'index.m3u8'
+    path.write_text('#EXTM3U\n#EXT-X-TARGETDURATION:abc\n#EXTINF:4,\nseg0.ts\n', encoding='utf-8')
+    assert not is_encrypted(str(path))
+    assert preflight_check(str(path))
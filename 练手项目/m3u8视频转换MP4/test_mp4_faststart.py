@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""mp4_faststart 的测试：合成的 moov 在末尾的 MP4"""
+
+import struct
+
+import pytest
+
+from mp4_faststart import faststart, is_faststart
+from mp4_verify import iter_boxes
+
+PAYLOAD = bytes(range(256)) * 64
+
+
+def _box(box_type, payload, large=False):
+    if large:
+        return struct.pack('>I4sQ', 1, box_type, len(payload) + 16) + payload
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def _write_mp4(path, large_headers=()):
+    """ftyp + mdat + moov；stco 中的两个块偏移指向 mdat 数据的开头和中间，large_headers 中的 box 用 64 位头"""
+    ftyp = _box(b'ftyp', b'isom' + struct.pack('>I', 0x200) + b'isommp41')
+    mdat = _box(b'mdat', PAYLOAD)
+    data_start = len(ftyp) + 8
+    stco = _box(b'stco', struct.pack('>IIII', 0, 2, data_start, data_start + len(PAYLOAD) // 2))
+    box = stco
+    for box_type in (b'stbl', b'minf', b'mdia', b'trak', b'moov'):
+        box = _box(box_type, box, large=box_type in large_headers)
+    with open(path, 'wb') as f:
+        f.write(ftyp + mdat + box)
+    return len(ftyp + mdat + box)
+
+
+def _chunk_offsets(data):
+    box = next(b for b in iter_boxes(data, 0, len(data)) if b[0] == b'moov')
+    pos = box[1]
+    for box_type in (b'moov', b'trak', b'mdia', b'minf', b'stbl', b'stco'):
+        found = next(b for b in iter_boxes(data, pos, box[1] + box[3]) if b[0] == box_type)
+        box, pos = found, found[1] + found[2]
+    count = struct.unpack_from('>I', data, pos + 4)[0]
+    return struct.unpack_from(f'>{count}I', data, pos + 8)
+
+
+@pytest.mark.parametrize('large_headers', [(), (b'moov',), (b'moov', b'trak', b'stbl')])
+def test_faststart_keeps_chunk_offsets_valid(tmp_path, large_headers):
+    path = tmp_path / 'out.mp4'
+    size = _write_mp4(path, large_headers)
+    result = faststart(str(path), chunk_size=1000)
+    assert result.changed
+    assert is_faststart(str(path))
+    data = path.read_bytes()
+    # 变短的 moov 用 free 补齐，文件长度不变，数据没有被覆盖
+    assert len(data) == size
+    first, middle = _chunk_offsets(data)
+    assert data[first:first + len(PAYLOAD)] == PAYLOAD
+    assert data[middle:middle + 16] == PAYLOAD[len(PAYLOAD) // 2:len(PAYLOAD) // 2 + 16]
+    assert [b[0] for b in iter_boxes(data, 0, len(data))][-1] == b'mdat'
+
+
+def test_already_faststart_is_unchanged(tmp_path):
+    path = tmp_path / 'out.mp4'
+    _write_mp4(path)
+    faststart(str(path))
+    before = path.read_bytes()
+    assert not faststart(str(path)).changed
+    assert path.read_bytes() == before
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""multi_output 的测试：用假的 ffmpeg 检查失败时保留上次的输出、成功时替换；按大小分段时计入单独的音轨"""
+
+import os
+import sys
+
+import pytest
+
+from m3u8_parser import load_playlist
+from multi_output import convert_multi, parse_targets, plan_split_times
+
+# 把 -y 之后的每个输出写成 "new"（分段模板只写第一段），同目录下有 FAIL 文件时写出后返回失败
+FAKE_FFMPEG = '''
+import os, sys
+args = sys.argv[1:]
+for i, arg in enumerate(args):
+    if arg == '-y':
+        path = args[i + 1]
+        with open(path % 1 if '%03d' in path else path, 'w') as f:
+            f.write('new')
+sys.exit(1 if os.path.exists(os.path.join(os.path.dirname(sys.argv[0]), 'FAIL')) else 0)
+'''
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    if os.name == 'nt':
+        pytest.skip("假的 ffmpeg 需要可执行脚本")
+    script = tmp_path / 'fake_ffmpeg.py'
+    script.write_text(FAKE_FFMPEG, encoding='utf-8')
+    wrapper = tmp_path / 'ffmpeg'
+    wrapper.write_text(f"#!/bin/sh\nexec '{sys.executable}' '{script}' \"$@\"\n", encoding='utf-8')
+    wrapper.chmod(0o755)
+    return str(wrapper)
+
+
+@pytest.fixture
+def playlist(tmp_path):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+    for i in range(3):
+        (tmp_path / f"seg{i}.ts").write_bytes(b'\x47' * 188 * 10)
+        lines += ['#EXTINF:4.0,', f"seg{i}.ts"]
+    lines.append('#EXT-X-ENDLIST')
+    path = tmp_path / 'index.m3u8'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def _files(folder):
+    return sorted(name for name in os.listdir(folder) if name.startswith('out'))
+
+
+def test_failure_keeps_previous_outputs(tmp_path, ffmpeg, playlist):
+    for name in ('out.mp4', 'out.m4a', 'out_part001.mp4', 'out_part002.mp4'):
+        (tmp_path / name).write_text('old')
+    (tmp_path / 'FAIL').write_text('')
+    returncode, _, outputs = convert_multi(playlist, str(tmp_path / 'out.mp4'), parse_targets('mp4,m4a,split:1G'),
+                                           ffmpeg_cmd=ffmpeg, log=lambda message: None)
+    assert returncode != 0 and outputs == []
+    # 上次的输出原样保留，本次写了一半的临时文件被删除
+    assert _files(tmp_path) == ['out.m4a', 'out.mp4', 'out_part001.mp4', 'out_part002.mp4']
+    assert all((tmp_path / name).read_text() == 'old' for name in _files(tmp_path))
+
+
+def test_success_replaces_outputs(tmp_path, ffmpeg, playlist):
+    for name in ('out.mp4', 'out_part001.mp4', 'out_part002.mp4'):
+        (tmp_path / name).write_text('old')
+    returncode, _, outputs = convert_multi(playlist, str(tmp_path / 'out.mp4'), parse_targets('mp4,m4a,split:1G'),
+                                           ffmpeg_cmd=ffmpeg, log=lambda message: None)
+    assert returncode == 0
+    assert outputs == [str(tmp_path / name) for name in ('out.mp4', 'out.m4a', 'out_part001.mp4')]
+    # 只有一段时上次多出来的分段也被删除
+    assert _files(tmp_path) == ['out.m4a', 'out.mp4', 'out_part001.mp4']
+    assert all((tmp_path / name).read_text() == 'new' for name in _files(tmp_path))
+
+
+def _media_playlist(folder, name, sizes, duration):
+    lines = ['#EXTM3U', f"#EXT-X-TARGETDURATION:{int(duration)}"]
+    for i, size in enumerate(sizes):
+        (folder / f"{name}{i}.ts").write_bytes(b'\x47' * size)
+        lines += [f"#EXTINF:{duration},", f"{name}{i}.ts"]
+    lines.append('#EXT-X-ENDLIST')
+    path = folder / f"{name}.m3u8"
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return load_playlist(str(path))
+
+
+def test_split_counts_separate_audio(tmp_path):
+    video = _media_playlist(tmp_path, 'v', [400] * 4, 4.0)
+    # 音频分片 2 秒一个，与视频分片不对齐
+    audio = _media_playlist(tmp_path, 'a', [100] * 8, 2.0)
+    assert plan_split_times(video, 1000) == [8.0]
+    # 每个视频分片加上 2 个音频分片就是 600 字节，每段只能放一个视频分片
+    assert plan_split_times(video, 1000, audio) == [4.0, 8.0, 12.0]
+    assert plan_split_times(video, 1200, audio) == [8.0]
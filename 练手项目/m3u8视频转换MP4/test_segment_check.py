@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""segment_check 的测试：末尾不完整的 TS 包只作为警告，同步字节和字节范围错误仍然阻止转换"""
+
+from segment_check import TS_PACKET_SIZE, scan_playlist
+
+PACKET = b'\x47' + bytes(TS_PACKET_SIZE - 1)
+
+
+def _playlist(tmp_path, segments, byteranges=None):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+    for i, data in enumerate(segments):
+        (tmp_path / f"seg{i}.ts").write_bytes(data)
+        if byteranges:
+            lines.append(f"#EXT-X-BYTERANGE:{byteranges[i]}")
+        lines += ['#EXTINF:4.0,', f"seg{i}.ts"]
+    path = tmp_path / 'index.m3u8'
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def test_trailing_partial_packet_is_warning(tmp_path):
+    report = scan_playlist(_playlist(tmp_path, [PACKET * 10, PACKET * 10 + PACKET[:100]]))
+    assert report.ok
+    assert [w.problem for w in report.warnings] == ['partial']
+    assert '不完整' in report.summary()
+    assert len(report.lines()) == 1
+
+
+def test_missing_sync_byte_is_corrupt(tmp_path):
+    bad = PACKET * 5 + b'\x00' + PACKET[1:] + PACKET[:50]
+    report = scan_playlist(_playlist(tmp_path, [bad]), full=True)
+    assert not report.ok
+    assert [issue.problem for issue in report.issues] == ['corrupt']
+    assert report.warnings == []
+
+
+def test_byterange_out_of_file_is_corrupt(tmp_path):
+    report = scan_playlist(_playlist(tmp_path, [PACKET * 2], byteranges=[f"{TS_PACKET_SIZE * 3}@0"]))
+    assert [issue.problem for issue in report.issues] == ['corrupt']
+
+
+def test_shorter_than_one_packet_is_corrupt(tmp_path):
+    report = scan_playlist(_playlist(tmp_path, [PACKET[:100]]))
+    assert [issue.problem for issue in report.issues] == ['corrupt']
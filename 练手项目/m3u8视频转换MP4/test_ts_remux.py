@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""ts_remux 的测试：用合成的 MPEG-TS 覆盖缺少参数集的轨道和高采样率 AAC"""
+
+import struct
+
+import pytest
+
+import ts_remux
+from mp4_verify import verify_mp4
+from ts_remux import AAC_SAMPLE_RATES, STREAM_TYPE_AAC, STREAM_TYPE_H264, TSRemuxer
+
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+
+
+def _ts_packet(pid, payload, pusi=False):
+    """一个 TS 包；负载不足 184 字节时用适配字段填充"""
+    header = bytes([0x47, (0x40 if pusi else 0) | (pid >> 8), pid & 0xFF])
+    if len(payload) >= 184:
+        return header + b'\x10' + payload[:184]
+    stuffing = 183 - len(payload)
+    adaptation = bytes([stuffing]) + (b'\x00' + b'\xFF' * (stuffing - 1) if stuffing else b'')
+    return header + b'\x30' + adaptation + payload
+
+
+def _psi_packet(pid, section):
+    # 指针字段 + 表 + CRC（解析器不校验 CRC）
+    return _ts_packet(pid, b'\x00' + section + b'\x00' * 4, pusi=True)
+
+
+def _pat():
+    body = struct.pack('>HBBBHH', 1, 0xC1, 0, 0, 1, 0xE000 | PMT_PID)
+    return _psi_packet(0, struct.pack('>BH', 0x00, 0xB000 | (len(body) + 4)) + body)
+
+
+def _pmt(streams):
+    body = struct.pack('>HBBBHH', 1, 0xC1, 0, 0, 0xE000 | VIDEO_PID, 0xF000)
+    for stream_type, pid in streams:
+        body += struct.pack('>BHH', stream_type, 0xE000 | pid, 0xF000)
+    return _psi_packet(PMT_PID, struct.pack('>BH', 0x02, 0xB000 | (len(body) + 4)) + body)
+
+
+def _pes(stream_id, pts, payload):
+    pts_bytes = bytes([
+        0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, 0x01 | ((pts >> 14) & 0xFE),
+        (pts >> 7) & 0xFF, 0x01 | ((pts << 1) & 0xFE)
+    ])
+    return b'\x00\x00\x01' + bytes([stream_id]) + b'\x00\x00\x80\x80\x05' + pts_bytes + payload
+
+
+def _adts(freq_index, raw, channels=2):
+    length = 7 + len(raw)
+    return bytes([
+        0xFF, 0xF1, (1 << 6) | (freq_index << 2) | (channels >> 2),
+        ((channels & 3) << 6) | (length >> 11), (length >> 3) & 0xFF, ((length & 7) << 5) | 0x1F, 0xFC
+    ]) + raw
+
+
+def _remux(tmp_path, packets):
+    output = tmp_path / 'out.mp4'
+    with open(output, 'wb') as out:
+        remuxer = TSRemuxer(out)
+        remuxer.feed(b''.join(packets))
+        remuxer.finish()
+    return verify_mp4(str(output))
+
+
+def _audio_packets(freq_index, count=3):
+    step = 1024 * 90000 // AAC_SAMPLE_RATES[freq_index]
+    return [
+        _ts_packet(AUDIO_PID, _pes(0xC0, 90000 + i * step, _adts(freq_index, bytes(20))), pusi=True)
+        for i in range(count)
+    ]
+
+
+def test_forced_header_drops_unready_track_with_buffered_pes(tmp_path, monkeypatch):
+    # 缓存上限为 0：音频就绪后立即强制写文件头，视频只有一个没有 SPS/PPS 的 PES 仍在缓存中
+    monkeypatch.setattr(ts_remux, 'MAX_FRAGMENT_BYTES', 0)
+    idr = b'\x00\x00\x00\x01\x65' + bytes(30)
+    packets = [_pat(), _pmt([(STREAM_TYPE_H264, VIDEO_PID), (STREAM_TYPE_AAC, AUDIO_PID)]),
+               _ts_packet(VIDEO_PID, _pes(0xE0, 90000, idr), pusi=True)] + _audio_packets(3)
+    report = _remux(tmp_path, packets)
+    assert report.ok, report.problems
+    assert [track.handler for track in report.tracks] == ['soun']
+
+
+@pytest.mark.parametrize('sample_rate', [96000, 88200, 48000])
+def test_high_sample_rate_aac(tmp_path, sample_rate):
+    freq_index = AAC_SAMPLE_RATES.index(sample_rate)
+    report = _remux(tmp_path, [_pat(), _pmt([(STREAM_TYPE_AAC, AUDIO_PID)])] + _audio_packets(freq_index))
+    assert report.ok, report.problems
+    assert report.tracks[0].timescale == sample_rate
+    assert report.tracks[0].samples == 3
+
+
+SPS = bytes.fromhex('6764001eacd940a02ff97011000003000100000300320f162d96')
+PPS = bytes.fromhex('68ebe3cb22c0')
+
+
+def _segment_packets(start, frames=25):
+    """一个 1 秒的分片：25 帧视频（首帧为带参数集的关键帧）和按时间穿插的 48 kHz AAC 帧"""
+    step = 1024 * 90000 // 48000
+    audio_pts = start
+    packets = []
+    for i in range(frames):
+        pts = start + i * 3600
+        nal = (b'\x00\x00\x00\x01' + SPS + b'\x00\x00\x00\x01' + PPS + b'\x00\x00\x00\x01\x65' if i == 0
+               else b'\x00\x00\x00\x01\x41') + bytes(30)
+        packets.append(_ts_packet(VIDEO_PID, _pes(0xE0, pts, nal), pusi=True))
+        while audio_pts < pts + 3600:
+            packets.append(_ts_packet(AUDIO_PID, _pes(0xC0, audio_pts, _adts(3, bytes(20))), pusi=True))
+            audio_pts += step
+    return packets
+
+
+@pytest.mark.parametrize('second_start', [90000, 90000 * 600])
+def test_discontinuity_keeps_tracks_in_sync(tmp_path, second_start):
+    # 第二个分片的时间戳后退（或向前跳过很多）：音视频使用同一个偏移，时长一致且不会交错
+    packets = [_pat(), _pmt([(STREAM_TYPE_H264, VIDEO_PID), (STREAM_TYPE_AAC, AUDIO_PID)])]
+    packets += _segment_packets(90000 * 100) + _segment_packets(second_start)
+    report = _remux(tmp_path, packets)
+    assert report.ok, report.problems
+    video, audio = sorted(report.tracks, key=lambda track: track.handler != 'vide')
+    assert video.seconds == pytest.approx(2.0, abs=0.05)
+    assert audio.seconds == pytest.approx(video.seconds, abs=0.05)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+FFmpeg 工具链查找与能力探测
+只查找一次 ffmpeg / ffprobe，读取版本、支持的编解码器和比特流过滤器，
+结果按可执行文件的路径、大小和修改时间缓存在 logs/toolchain.json，
+可执行文件没有变化时直接读缓存，不再启动 ffmpeg -version；所有调用方共用同一个路径
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+# 常用安装位置（不在 PATH 中时也能找到），按顺序优先于 PATH
+CANDIDATE_DIRS = [
+    r"D:\ffmpeg-8.0-essentials_build\bin",
+]
+CACHE_VERSION = 1
+PROBE_TIMEOUT = 5
+# 转封装 HLS 到 MP4 需要的能力
+REQUIRED_CODECS = ('h264', 'aac')
+REQUIRED_BSFS = ('aac_adtstoasc',)
+
+_lock = threading.Lock()
+_toolchain = None
+
+
+def default_cache_file():
+    """默认缓存文件：脚本目录下 logs/toolchain.json"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, 'logs', 'toolchain.json')
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def find_binary(name, prefer_dir=None):
+    """按 prefer_dir、常用安装位置、PATH 的顺序查找可执行文件，返回绝对路径或 None"""
+    exe = name + '.exe' if sys.platform == 'win32' else name
+    dirs = ([prefer_dir] if prefer_dir else []) + CANDIDATE_DIRS
+    for folder in dirs:
+        path = os.path.join(folder, exe)
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    path = shutil.which(name)
+    return os.path.abspath(path) if path else None
+
+
+def _run(path, *args):
+    result = subprocess.run(
+        [path, '-hide_banner', *args],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='ignore',
+        timeout=PROBE_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise OSError(f"{os.path.basename(path)} {' '.join(args)} 返回 {result.returncode}")
+    return result.stdout
+
+
+def _parse_version(text):
+    """'ffmpeg version 8.0-essentials_build-www.gyan.dev Copyright ...' -> '8.0-essentials_build-www.gyan.dev'"""
+    first = text.strip().splitlines()[0] if text.strip() else ''
+    parts = first.split()
+    if len(parts) >= 3 and parts[1] == 'version':
+        return parts[2]
+    return first
+
+
+def _parse_codecs(text):
+    """ffmpeg -codecs 的输出：分隔线之后每行为 ' DEV.LS h264  说明'"""
+    codecs = []
+    started = False
+    for line in text.splitlines():
+        if line.strip().startswith('---'):
+            started = True
+            continue
+        parts = line.split()
+        if started and len(parts) >= 2:
+            codecs.append(parts[1])
+    return codecs
+
+
+def _parse_bsfs(text):
+    """ffmpeg -bsfs 的输出：第一行为标题，其后每行一个过滤器名"""
+    return [line.strip() for line in text.splitlines()[1:] if line.strip()]
+
+
+class Tool:
+    """一个已探测的可执行文件"""
+
+    def __init__(self, path, version='', codecs=(), bsfs=()):
+        self.path = path
+        self.version = version
+        self.codecs = set(codecs)
+        self.bsfs = set(bsfs)
+
+    def to_dict(self):
+        size, mtime_ns = _stamp(self.path)
+        return {'size': size, 'mtime_ns': mtime_ns, 'version': self.version,
+                'codecs': sorted(self.codecs), 'bsfs': sorted(self.bsfs)}
+
+
+def probe_tool(path, full=True):
+    """启动可执行文件读取版本（full 时还读取编解码器和比特流过滤器），失败时抛出 OSError"""
+    try:
+        version = _parse_version(_run(path, '-version'))
+        codecs = _parse_codecs(_run(path, '-codecs')) if full else ()
+        bsfs = _parse_bsfs(_run(path, '-bsfs')) if full else ()
+    except subprocess.TimeoutExpired:
+        raise OSError(f"{path} 无响应")
+    return Tool(path, version, codecs, bsfs)
+
+
+class Toolchain:
+    """查找到的 ffmpeg / ffprobe；未安装时对应属性为 None"""
+
+    def __init__(self, ffmpeg=None, ffprobe=None, from_cache=False):
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.from_cache = from_cache
+
+    @property
+    def ffmpeg_cmd(self):
+        return self.ffmpeg.path if self.ffmpeg else 'ffmpeg'
+
+    @property
+    def ffprobe_cmd(self):
+        return self.ffprobe.path if self.ffprobe else 'ffprobe'
+
+    def has_codec(self, name):
+        return bool(self.ffmpeg) and name in self.ffmpeg.codecs
+
+    def has_bsf(self, name):
+        return bool(self.ffmpeg) and name in self.ffmpeg.bsfs
+
+    def missing_features(self):
+        """转封装需要但当前 ffmpeg 不支持的编解码器和比特流过滤器"""
+        if not self.ffmpeg:
+            return []
+        return ([name for name in REQUIRED_CODECS if not self.has_codec(name)]
+                + [name for name in REQUIRED_BSFS if not self.has_bsf(name)])
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('binaries', {})
+
+
+def _save_cache(cache_file, binaries):
+    """先写临时文件再替换，多个进程同时写入也不会留下损坏的缓存"""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'binaries': binaries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
+
+
+def _cached_or_probe(path, binaries, full):
+    """缓存中大小和修改时间一致时直接使用，否则重新探测；返回 (Tool 或 None, 是否来自缓存)"""
+    if not path:
+        return None, True
+    entry = binaries.get(path)
+    try:
+        size, mtime_ns = _stamp(path)
+    except OSError:
+        return None, True
+    if entry and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+        return Tool(path, entry.get('version', ''), entry.get('codecs', ()), entry.get('bsfs', ())), True
+    try:
+        tool = probe_tool(path, full)
+    except OSError:
+        binaries.pop(path, None)
+        return None, False
+    binaries[path] = tool.to_dict()
+    return tool, False
+
+
+def find_toolchain(refresh=False, cache_file=None):
+    """
+    返回本进程共用的 Toolchain；refresh=True 时重新查找（例如安装 ffmpeg 之后），
+    可执行文件未变化时仍然使用磁盘缓存的探测结果
+    """
+    global _toolchain
+    with _lock:
+        if _toolchain is not None and not refresh:
+            return _toolchain
+        cache_file = cache_file or default_cache_file()
+        binaries = _load_cache(cache_file)
+        ffmpeg_path = find_binary('ffmpeg')
+        ffmpeg, ffmpeg_cached = _cached_or_probe(ffmpeg_path, binaries, full=True)
+        # ffprobe 优先取与 ffmpeg 同一目录的，避免版本不一致
+        ffprobe_path = find_binary('ffprobe', os.path.dirname(ffmpeg_path) if ffmpeg_path else None)
+        ffprobe, ffprobe_cached = _cached_or_probe(ffprobe_path, binaries, full=False)
+        if not (ffmpeg_cached and ffprobe_cached):
+            _save_cache(cache_file, binaries)
+        _toolchain = Toolchain(ffmpeg, ffprobe, from_cache=ffmpeg_cached and ffprobe_cached)
+        return _toolchain
+
+
+def ffmpeg_command():
+    """ffmpeg 可执行文件路径（未找到时为 'ffmpeg'，由调用方报告 FileNotFoundError）"""
+    return find_toolchain().ffmpeg_cmd
+
+
+if __name__ == '__main__':
+    if '--refresh' in sys.argv:
+        # 清空缓存，强制重新探测
+        _save_cache(default_cache_file(), {})
+    toolchain = find_toolchain()
+    for name, tool in (('ffmpeg', toolchain.ffmpeg), ('ffprobe', toolchain.ffprobe)):
+        if tool:
+            print(f"{name}: {tool.path}（版本 {tool.version}）")
+        else:
+            print(f"{name}: 未找到")
+    if toolchain.ffmpeg:
+        print(f"编解码器 {len(toolchain.ffmpeg.codecs)} 个，比特流过滤器 {len(toolchain.ffmpeg.bsfs)} 个"
+              f"{'（来自缓存）' if toolchain.from_cache else ''}")
+        missing = toolchain.missing_features()
+        if missing:
+            print(f"缺少转封装需要的功能: {', '.join(missing)}")
+    sys.exit(0 if toolchain.ffmpeg else 1)
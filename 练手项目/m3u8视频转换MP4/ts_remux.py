@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内置 TS -> MP4 转封装引擎（不依赖 ffmpeg）
+解复用 MPEG-TS 中的 H.264 视频与 AAC(ADTS) 音频，按关键帧切片写出分片 MP4（moof/mdat），
+每个分片写完即落盘，内存占用与输入长度无关
+
+用法:
+    python ts_remux.py index.m3u8 output.mp4
+    python ts_remux.py --benchmark index.m3u8     # 与 ffmpeg -c copy 对比吞吐量
+"""
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# 每次从分片读取的字节数（188 的整数倍）
+READ_CHUNK_SIZE = TS_PACKET_SIZE * 43690
+
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC = 0x0F
+
+VIDEO_TIMESCALE = 90000
+# 单个分片缓存超过该大小时强制切片，防止超长 GOP 占用过多内存
+MAX_FRAGMENT_BYTES = 16 * 1024 * 1024
+# 同一轨道的时间戳后退或向前跳过超过该值（90kHz）时视为不连续（EXT-X-DISCONTINUITY 等）
+DISCONTINUITY_JUMP = 10 * VIDEO_TIMESCALE
+
+AAC_SAMPLE_RATES = [
+    96000, 88200, 64000, 48000, 44100, 32000, 24000,
+    22050, 16000, 12000, 11025, 8000, 7350
+]
+
+# trun 中的 sample_flags
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+UNITY_MATRIX = struct.pack(
+    '>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000
+)
+
+
+class RemuxError(Exception):
+    """输入无法用内置引擎转封装（不支持的编码、缺少参数集等）"""
+
+
+# ================= MP4 box 工具 =================
+
+def _box(box_type, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(data), box_type) + data
+
+
+def _full_box(box_type, version, flags, *payloads):
+    return _box(box_type, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+# ================= H.264 / AAC 解析 =================
+
+class _BitReader:
+    """读取去除防竞争字节后的 RBSP 比特流"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def bit(self):
+        byte = self.data[self.pos >> 3]
+        value = (byte >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return value
+
+    def bits(self, n):
+        value = 0
+        for _ in range(n):
+            value = (value << 1) | self.bit()
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.bit() == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def _unescape_rbsp(nal):
+    """去除 0x000003 防竞争字节"""
+    return nal.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+def parse_sps_dimensions(sps):
+    """从 SPS 解析出 (宽, 高)"""
+    r = _BitReader(_unescape_rbsp(sps[1:]))
+    profile_idc = r.bits(8)
+    r.bits(16)  # constraint flags + level_idc
+    r.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = r.ue()
+        if chroma_format_idc == 3:
+            r.bit()  # separate_colour_plane_flag
+        r.ue()  # bit_depth_luma_minus8
+        r.ue()  # bit_depth_chroma_minus8
+        r.bit()  # qpprime_y_zero_transform_bypass_flag
+        if r.bit():  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if r.bit():
+                    size = 16 if i < 6 else 64
+                    last, nxt = 8, 8
+                    for _ in range(size):
+                        if nxt:
+                            nxt = (last + r.se() + 256) % 256
+                        last = nxt or last
+    r.ue()  # log2_max_frame_num_minus4
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.bit()
+        r.se()
+        r.se()
+        for _ in range(r.ue()):
+            r.se()
+    r.ue()  # max_num_ref_frames
+    r.bit()  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = r.ue() + 1
+    height_map_units = r.ue() + 1
+    frame_mbs_only = r.bit()
+    if not frame_mbs_only:
+        r.bit()  # mb_adaptive_frame_field_flag
+    r.bit()  # direct_8x8_inference_flag
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_map_units * 16
+    if r.bit():  # frame_cropping_flag
+        left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+        crop_x = 2 if chroma_format_idc in (1, 2) else 1
+        crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    return width, height
+
+
+def split_annexb(data):
+    """把 Annex B 字节流按起始码拆分为 NAL 单元列表"""
+    nals = []
+    start = data.find(b'\x00\x00\x01')
+    while start != -1:
+        start += 3
+        end = data.find(b'\x00\x00\x01', start)
+        nal = data[start:] if end == -1 else data[start:end]
+        nal = nal.rstrip(b'\x00')
+        if nal:
+            nals.append(nal)
+        start = end
+    return nals
+
+
+def iter_adts_frames(data):
+    """遍历 ADTS 帧，返回 (profile, 采样率索引, 声道配置, 原始 AAC 数据)"""
+    pos = 0
+    size = len(data)
+    while pos + 7 <= size:
+        if data[pos] != 0xFF or (data[pos + 1] & 0xF0) != 0xF0:
+            pos += 1
+            continue
+        protection_absent = data[pos + 1] & 0x01
+        profile = (data[pos + 2] >> 6) & 0x03
+        freq_index = (data[pos + 2] >> 2) & 0x0F
+        channels = ((data[pos + 2] & 0x01) << 2) | (data[pos + 3] >> 6)
+        frame_length = ((data[pos + 3] & 0x03) << 11) | (data[pos + 4] << 3) | (data[pos + 5] >> 5)
+        header_size = 7 if protection_absent else 9
+        if frame_length < header_size or pos + frame_length > size:
+            break
+        yield profile, freq_index, channels, data[pos + header_size:pos + frame_length]
+        pos += frame_length
+
+
+# ================= 轨道 =================
+
+class _Track:
+    """一条输出轨道：保存编码参数与当前分片中尚未写出的样本"""
+
+    def __init__(self, track_id, kind):
+        self.track_id = track_id
+        self.kind = kind  # 'video' / 'audio'
+        self.timescale = VIDEO_TIMESCALE
+        self.ready = False
+        # 样本: [dts, 时长, 数据, 是否关键帧, cts 偏移]
+        self.samples = []
+        self.pending_bytes = 0
+        self.last_dts = None
+        self.last_duration = 0
+        self.next_dts = None
+        self.first_time90 = None  # 首个样本的 90kHz 时间，用于对齐各轨道起点
+        self.last_raw = None  # 上一个 PES 未加偏移的时间戳（90kHz），用于检测不连续
+        self.end_time90 = 0  # 已有样本的结束时间（90kHz）
+        self.epoch = 0  # 已经过的不连续次数，对应 TSRemuxer.offsets 的下标
+        # 视频参数
+        self.sps = None
+        self.pps = None
+        self.width = 0
+        self.height = 0
+        # 音频参数
+        self.sample_rate = 0
+        self.channels = 0
+        self.audio_object_type = 2
+
+    def sample_entry(self):
+        if self.kind == 'video':
+            avcc = _box(
+                b'avcC',
+                bytes([1, self.sps[1], self.sps[2], self.sps[3], 0xFF, 0xE1]),
+                struct.pack('>H', len(self.sps)), self.sps,
+                b'\x01', struct.pack('>H', len(self.pps)), self.pps
+            )
+            return _box(
+                b'avc1',
+                b'\x00' * 6, struct.pack('>H', 1),
+                b'\x00' * 16,
+                struct.pack('>HHIIIH', self.width, self.height, 0x00480000, 0x00480000, 0, 1),
+                b'\x00' * 32,
+                struct.pack('>Hh', 0x0018, -1),
+                avcc
+            )
+        freq_index = AAC_SAMPLE_RATES.index(self.sample_rate)
+        asc = struct.pack('>H', (self.audio_object_type << 11) | (freq_index << 7) | (self.channels << 3))
+        dec_specific = b'\x05' + bytes([len(asc)]) + asc
+        dec_config = (b'\x04' + bytes([13 + len(dec_specific)])
+                      + b'\x40\x15' + b'\x00\x00\x00' + struct.pack('>II', 0, 0) + dec_specific)
+        sl_config = b'\x06\x01\x02'
+        es_desc = (b'\x03' + bytes([3 + len(dec_config) + len(sl_config)])
+                   + struct.pack('>HB', self.track_id, 0) + dec_config + sl_config)
+        return _box(
+            b'mp4a',
+            b'\x00' * 6, struct.pack('>H', 1),
+            b'\x00' * 8,
+            # 16.16 定点数放不下 65536 Hz 以上的采样率时写 0，实际采样率见 mdhd 和 esds
+            struct.pack('>HHHHI', self.channels, 16, 0, 0,
+                        (self.sample_rate if self.sample_rate < 65536 else 0) << 16),
+            _full_box(b'esds', 0, 0, es_desc)
+        )
+
+    def trak(self):
+        is_video = self.kind == 'video'
+        tkhd = _full_box(
+            b'tkhd', 0, 3,
+            struct.pack('>IIIII', 0, 0, self.track_id, 0, 0),
+            b'\x00' * 8,
+            struct.pack('>hhhH', 0, 0, 0 if is_video else 0x0100, 0),
+            UNITY_MATRIX,
+            struct.pack('>II', self.width << 16, self.height << 16)
+        )
+        mdhd = _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, self.timescale, 0, 0x55C4, 0))
+        hdlr = _full_box(
+            b'hdlr', 0, 0,
+            struct.pack('>I4s', 0, b'vide' if is_video else b'soun'),
+            b'\x00' * 12,
+            b'VideoHandler\x00' if is_video else b'SoundHandler\x00'
+        )
+        media_header = (_full_box(b'vmhd', 0, 1, b'\x00' * 8) if is_video
+                        else _full_box(b'smhd', 0, 0, b'\x00' * 4))
+        dinf = _box(b'dinf', _full_box(b'dref', 0, 0, struct.pack('>I', 1), _full_box(b'url ', 0, 1)))
+        stbl = _box(
+            b'stbl',
+            _full_box(b'stsd', 0, 0, struct.pack('>I', 1), self.sample_entry()),
+            _full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+            _full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+            _full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+            _full_box(b'stco', 0, 0, struct.pack('>I', 0))
+        )
+        return _box(b'trak', tkhd, _box(b'mdia', mdhd, hdlr, _box(b'minf', media_header, dinf, stbl)))
+
+    def trex(self):
+        return _full_box(b'trex', 0, 0, struct.pack('>IIIII', self.track_id, 1, 0, 0, 0))
+
+    def traf(self, data_offset, base90):
+        count = len(self.samples)
+        base = base90 * self.timescale // VIDEO_TIMESCALE
+        entries = bytearray()
+        for _, duration, data, keyframe, cts in self.samples:
+            entries += struct.pack(
+                '>IIIi', duration, len(data),
+                SAMPLE_FLAGS_SYNC if keyframe else SAMPLE_FLAGS_NON_SYNC, cts
+            )
+        return _box(
+            b'traf',
+            _full_box(b'tfhd', 0, 0x020000, struct.pack('>I', self.track_id)),
+            _full_box(b'tfdt', 1, 0, struct.pack('>Q', max(self.samples[0][0] - base, 0))),
+            _full_box(b'trun', 1, 0x000F01, struct.pack('>Ii', count, data_offset), bytes(entries))
+        )
+
+
+# ================= 转封装器 =================
+
+class TSRemuxer:
+    """把 MPEG-TS 数据流式转封装为分片 MP4"""
+
+    def __init__(self, output_file):
+        self.out = output_file
+        self.pmt_pid = None
+        self.tracks = {}  # pid -> _Track
+        self.pes_buffers = {}  # pid -> [bytes, ...]
+        self.origin = None  # 首个时间戳，作为回绕判断的参考点
+        # 每次时间戳不连续后加到时间戳上的偏移（90kHz），所有轨道共用，音视频保持同步
+        self.offsets = [0]
+        self.base = 0  # 写文件头时确定的各轨道共同起点（相对 origin，90kHz）
+        self.header_written = False
+        self.sequence = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._remainder = b''
+
+    # ---------- TS 层 ----------
+
+    def feed(self, data):
+        """送入任意长度的 TS 数据"""
+        if self._remainder:
+            data = self._remainder + data
+            self._remainder = b''
+        self.bytes_in += len(data)
+        view = memoryview(data)
+        pos = 0
+        size = len(data)
+        while pos + TS_PACKET_SIZE <= size:
+            if data[pos] != TS_SYNC_BYTE:
+                # 失去同步，向后寻找下一个同步字节
+                nxt = data.find(b'\x47', pos + 1)
+                if nxt == -1:
+                    pos = size
+                    break
+                pos = nxt
+                continue
+            self._packet(view[pos:pos + TS_PACKET_SIZE])
+            pos += TS_PACKET_SIZE
+        if pos < size:
+            self._remainder = bytes(view[pos:])
+            self.bytes_in -= len(self._remainder)
+
+    def _packet(self, pkt):
+        pusi = pkt[1] & 0x40
+        pid = ((pkt[1] & 0x1F) << 8) | pkt[2]
+        afc = (pkt[3] >> 4) & 0x03
+        if not afc & 0x01:
+            return
+        offset = 4
+        if afc & 0x02:
+            offset += 1 + pkt[4]
+        if offset >= TS_PACKET_SIZE:
+            return
+        payload = pkt[offset:]
+        if pid == 0:
+            if pusi:
+                self._parse_pat(bytes(payload))
+        elif pid == self.pmt_pid:
+            if pusi:
+                self._parse_pmt(bytes(payload))
+        elif pid in self.tracks:
+            if pusi:
+                self._flush_pes(pid)
+                self.pes_buffers[pid] = [bytes(payload)]
+            elif pid in self.pes_buffers:
+                self.pes_buffers[pid].append(bytes(payload))
+
+    def _section(self, payload):
+        pointer = payload[0]
+        section = payload[1 + pointer:]
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        return section[:3 + length]
+
+    def _parse_pat(self, payload):
+        section = self._section(payload)
+        # 跳过 8 字节头，去掉末尾 4 字节 CRC
+        for i in range(8, len(section) - 4, 4):
+            program = (section[i] << 8) | section[i + 1]
+            if program != 0:
+                self.pmt_pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                return
+
+    def _parse_pmt(self, payload):
+        if self.tracks:
+            return
+        section = self._section(payload)
+        info_len = ((section[10] & 0x0F) << 8) | section[11]
+        pos = 12 + info_len
+        track_id = 1
+        while pos + 5 <= len(section) - 4:
+            stream_type = section[pos]
+            pid = ((section[pos + 1] & 0x1F) << 8) | section[pos + 2]
+            es_info_len = ((section[pos + 3] & 0x0F) << 8) | section[pos + 4]
+            if stream_type == STREAM_TYPE_H264 and not any(t.kind == 'video' for t in self.tracks.values()):
+                self.tracks[pid] = _Track(track_id, 'video')
+                track_id += 1
+            elif stream_type == STREAM_TYPE_AAC and not any(t.kind == 'audio' for t in self.tracks.values()):
+                self.tracks[pid] = _Track(track_id, 'audio')
+                track_id += 1
+            pos += 5 + es_info_len
+        if not self.tracks:
+            raise RemuxError("TS 中没有 H.264 或 AAC 流，请使用 ffmpeg 转换")
+
+    # ---------- PES 层 ----------
+
+    def _flush_pes(self, pid):
+        chunks = self.pes_buffers.pop(pid, None)
+        if not chunks or pid not in self.tracks:
+            return
+        pes = b''.join(chunks)
+        if len(pes) < 9 or pes[0:3] != b'\x00\x00\x01':
+            return
+        flags = pes[7]
+        header_len = pes[8]
+        if not flags & 0x80:
+            return
+        pts = self._read_timestamp(pes, 9)
+        dts = self._read_timestamp(pes, 14) if flags & 0x40 else pts
+        payload = pes[9 + header_len:]
+        track = self.tracks[pid]
+        if self.origin is None:
+            self.origin = dts
+        raw = self._unwrap(dts - self.origin, track.last_raw)
+        pts = self._unwrap(pts - self.origin, raw)
+        if track.last_raw is not None and not 0 <= raw - track.last_raw <= DISCONTINUITY_JUMP:
+            track.epoch += 1
+            if track.epoch == len(self.offsets):
+                # 第一条遇到这次不连续的轨道确定偏移：跳变后的时间紧接在它已有的样本之后；
+                # 其他轨道遇到同一次跳变时沿用这个偏移，而不是各自对齐
+                self.offsets.append(track.end_time90 - raw)
+        track.last_raw = raw
+        offset = self.offsets[track.epoch]
+        dts, pts = raw + offset, pts + offset
+        if track.kind == 'video':
+            self._video_access_unit(track, pts, dts, payload)
+        else:
+            self._audio_frames(track, pts, payload)
+
+    @staticmethod
+    def _read_timestamp(data, pos):
+        return (((data[pos] >> 1) & 0x07) << 30) | (data[pos + 1] << 22) | \
+            ((data[pos + 2] >> 1) << 15) | (data[pos + 3] << 7) | (data[pos + 4] >> 1)
+
+    def _unwrap(self, ts, reference):
+        """处理 33 位时间戳回绕"""
+        if reference is None:
+            return ts
+        period = 1 << 33
+        while ts - reference > period // 2:
+            ts -= period
+        while reference - ts > period // 2:
+            ts += period
+        return ts
+
+    def _video_access_unit(self, track, pts, dts, payload):
+        keyframe = False
+        sample = bytearray()
+        for nal in split_annexb(payload):
+            nal_type = nal[0] & 0x1F
+            if nal_type == 7:
+                if track.sps is None:
+                    track.sps = nal
+                    track.width, track.height = parse_sps_dimensions(nal)
+                continue
+            if nal_type == 8:
+                if track.pps is None:
+                    track.pps = nal
+                continue
+            if nal_type == 9:
+                continue
+            if nal_type == 5:
+                keyframe = True
+            sample += struct.pack('>I', len(nal)) + nal
+        if not sample:
+            return
+        track.ready = track.sps is not None and track.pps is not None
+        if track.samples:
+            duration = dts - track.samples[-1][0]
+            if duration <= 0:
+                # 时间戳不连续，沿用上一帧时长
+                duration = track.last_duration or 3600
+                dts = track.samples[-1][0] + duration
+            track.samples[-1][1] = duration
+            track.last_duration = duration
+        elif track.last_dts is not None and dts <= track.last_dts:
+            dts = track.last_dts + (track.last_duration or 3600)
+        if track.first_time90 is None:
+            track.first_time90 = dts
+        if keyframe and track.samples and self.header_written:
+            # 在关键帧处切片；最后一个样本的时长已由当前帧确定
+            self._write_fragment()
+        elif track.pending_bytes > MAX_FRAGMENT_BYTES and self.header_written:
+            self._write_fragment()
+        track.samples.append([dts, track.last_duration, bytes(sample), keyframe, pts - dts])
+        track.pending_bytes += len(sample)
+        track.last_dts = dts
+        track.end_time90 = dts + (track.last_duration or 3600)
+        self._maybe_write_header()
+
+    def _audio_frames(self, track, pts, payload):
+        for profile, freq_index, channels, raw in iter_adts_frames(payload):
+            if not track.ready:
+                if freq_index >= len(AAC_SAMPLE_RATES):
+                    raise RemuxError("不支持的 AAC 采样率")
+                track.audio_object_type = profile + 1
+                track.sample_rate = AAC_SAMPLE_RATES[freq_index]
+                track.timescale = track.sample_rate
+                track.channels = channels
+                track.ready = True
+            # 以 PES 的 PTS 校准，同一 PES 内的后续帧按 1024 个采样递增
+            pts90 = pts
+            dts = pts90 * track.sample_rate // VIDEO_TIMESCALE
+            if track.next_dts is not None and abs(dts - track.next_dts) < track.sample_rate // 10:
+                dts = track.next_dts
+            if track.first_time90 is None:
+                track.first_time90 = pts90
+            track.samples.append([dts, 1024, raw, True, 0])
+            track.pending_bytes += len(raw)
+            track.next_dts = dts + 1024
+            track.last_dts = pts90
+            pts += 1024 * VIDEO_TIMESCALE // track.sample_rate
+            track.end_time90 = pts
+        if track.pending_bytes > MAX_FRAGMENT_BYTES and self.header_written:
+            self._write_fragment([track])
+        self._maybe_write_header()
+
+    # ---------- MP4 输出 ----------
+
+    def _maybe_write_header(self, force=False):
+        if self.header_written:
+            return
+        tracks = list(self.tracks.values())
+        if not force and not all(t.ready for t in tracks):
+            # 某条轨道迟迟没有参数时不再等待，避免缓存无限增长
+            if sum(t.pending_bytes for t in tracks) <= MAX_FRAGMENT_BYTES:
+                return
+            force = True
+        ready = [t for t in tracks if t.ready]
+        if not ready:
+            raise RemuxError("未找到可用的 H.264 参数集或 AAC 音频帧")
+        if force:
+            # 输入结束仍缺少参数的轨道直接丢弃（连同尚未解析的 PES 缓存）
+            self.tracks = {pid: t for pid, t in self.tracks.items() if t.ready}
+            self.pes_buffers = {pid: c for pid, c in self.pes_buffers.items() if pid in self.tracks}
+        starts = [t.first_time90 for t in ready if t.first_time90 is not None]
+        self.base = min(starts) if starts else 0
+        ftyp = _box(b'ftyp', b'isom', struct.pack('>I', 0x200), b'isomiso6avc1mp41')
+        mvhd = _full_box(
+            b'mvhd', 0, 0,
+            struct.pack('>IIIIIH', 0, 0, 1000, 0, 0x00010000, 0x0100),
+            b'\x00' * 10, UNITY_MATRIX, b'\x00' * 24,
+            struct.pack('>I', max(t.track_id for t in ready) + 1)
+        )
+        moov = _box(b'moov', mvhd, *[t.trak() for t in ready], _box(b'mvex', *[t.trex() for t in ready]))
+        self._write(ftyp + moov)
+        self.header_written = True
+
+    def _write(self, data):
+        self.out.write(data)
+        self.bytes_out += len(data)
+
+    def _write_fragment(self, tracks=None):
+        """把轨道已缓存的样本写成一个 moof + mdat（默认包含所有轨道）"""
+        tracks = [t for t in (tracks or self.tracks.values()) if t.samples]
+        if not tracks:
+            return
+        self.sequence += 1
+
+        def build(offsets):
+            return _box(
+                b'moof',
+                _full_box(b'mfhd', 0, 0, struct.pack('>I', self.sequence)),
+                *[t.traf(off, self.base) for t, off in zip(tracks, offsets)]
+            )
+
+        moof_size = len(build([0] * len(tracks)))
+        offsets = []
+        pos = moof_size + 8
+        for t in tracks:
+            offsets.append(pos)
+            pos += t.pending_bytes
+        mdat_size = pos - moof_size
+        self._write(build(offsets))
+        self._write(struct.pack('>I4s', mdat_size, b'mdat'))
+        for t in tracks:
+            for sample in t.samples:
+                self._write(sample[2])
+            t.samples = []
+            t.pending_bytes = 0
+
+    def finish(self):
+        """输入结束：写出剩余样本"""
+        for pid in list(self.pes_buffers):
+            self._flush_pes(pid)
+        self._maybe_write_header(force=True)
+        self._write_fragment()
+        self.out.flush()
+
+
+def remux_ts_to_mp4(segment_paths, output_path, progress_callback=None):
+    """
+    把一组 .ts 分片转封装为分片 MP4
+    progress_callback(已处理字节数, 总字节数) 每读完一块调用一次
+    返回 (输入字节数, 输出字节数)
+    """
+    total_bytes = sum(os.path.getsize(p) for p in segment_paths)
+    done_bytes = 0
+    with open(output_path, 'wb') as out:
+        remuxer = TSRemuxer(out)
+        for path in segment_paths:
+            with open(path, 'rb') as f:
+                while True:
+                    chunk = f.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    remuxer.feed(chunk)
+                    done_bytes += len(chunk)
+                    if progress_callback:
+                        progress_callback(done_bytes, total_bytes)
+        remuxer.finish()
+    return remuxer.bytes_in, remuxer.bytes_out
+
+
+def benchmark(m3u8_path, ffmpeg_cmd=None):
+    """对比内置引擎与 ffmpeg -c copy 的转封装吞吐量"""
+    from convert_m3u8_to_mp4 import parse_ts_segments
+    from toolchain import ffmpeg_command
+
+    ffmpeg_cmd = ffmpeg_cmd or ffmpeg_command()
+    segments = parse_ts_segments(m3u8_path)
+    if not segments:
+        print("错误：播放列表不是本地未加密的 .ts 分片")
+        return False
+    size_mb = sum(os.path.getsize(p) for p in segments) / (1024 * 1024)
+    print(f"输入: {len(segments)} 个分片，共 {size_mb:.2f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.time()
+        remux_ts_to_mp4(segments, os.path.join(tmp, 'native.mp4'))
+        native = time.time() - start
+        print(f"内置引擎: {native:.2f} 秒，{size_mb / native:.1f} MB/s")
+
+        start = time.time()
+        try:
+            subprocess.run(
+                [ffmpeg_cmd, '-v', 'error', '-i', os.path.abspath(m3u8_path),
+                 '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-y', os.path.join(tmp, 'ffmpeg.mp4')],
+                check=True, capture_output=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"ffmpeg 对比失败: {e}")
+            return True
+        ffmpeg = time.time() - start
+        print(f"ffmpeg:   {ffmpeg:.2f} 秒，{size_mb / ffmpeg:.1f} MB/s")
+        print(f"内置引擎 / ffmpeg 耗时比: {native / ffmpeg:.2f}")
+    return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == '--benchmark':
+        sys.exit(0 if benchmark(sys.argv[2]) else 1)
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    from convert_m3u8_to_mp4 import convert_m3u8_to_mp4
+    sys.exit(0 if convert_m3u8_to_mp4(sys.argv[1], sys.argv[2], engine='remux') else 1)
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+监视文件夹，自动转换录制完成的 m3u8（无界面的常驻模式）
+采集机把录好的 HLS 文件夹放进投递目录后，不需要再打开 GUI 逐个点击：
+Linux 上通过 inotify（ctypes 调用 libc，无第三方依赖）等待目录变化，空闲时阻塞在 select 上不占 CPU；
+没有 inotify 时（Windows、macOS 或 inotify 监视数用完）退回按间隔比较目录修改时间。
+
+播放列表满足以下条件才算录制完成并排队转换：
+  - 包含 #EXT-X-ENDLIST
+  - 所有本地分片都已存在
+  - 播放列表和分片最近 settle 秒内没有修改，且相隔一次检查大小和修改时间都没有变化
+同时转换的任务数有上限；转换结果写入转换历史，重启后同一内容不会重复转换
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from m3u8_parser import PlaylistError, load_playlist
+
+# 最后一次修改之后至少等待这么多秒才认为文件已写完
+DEFAULT_SETTLE_SECONDS = 10
+# 两次稳定性检查之间的最短间隔
+STABLE_RECHECK_SECONDS = 1.0
+# 还没有 #EXT-X-ENDLIST 的播放列表的复查间隔（原地追加写入时 inotify/目录修改时间不一定有变化）
+PENDING_RECHECK_SECONDS = 30
+# 没有 inotify 时比较目录修改时间的间隔
+POLL_INTERVAL = 5
+# 转换过程中生成的工作目录，其中的 m3u8 不是投递进来的
+WORK_DIR_SUFFIXES = ('.parts', '.parallel', '.download')
+
+# inotify 常量（linux/inotify.h）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# 不监视 IN_MODIFY：分片写入过程中每次 write 都会触发，写完关闭时的 IN_CLOSE_WRITE 就够了
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def walk_dirs(root):
+    """root 及其下所有子目录（跳过转换工作目录）"""
+    for folder, dirs, _ in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.endswith(WORK_DIR_SUFFIXES))
+        yield folder
+
+
+class InotifyWatcher:
+    """
+    递归监视目录：wait() 阻塞到有变化或超时，返回发生变化的目录集合（超时为空集合）
+    新建的子目录自动加入监视；事件队列溢出时返回全部根目录，由调用方重新扫描
+    """
+
+    def __init__(self, roots):
+        path = ctypes.util.find_library('c')
+        if not path:
+            raise OSError("找不到 libc")
+        libc = ctypes.CDLL(path, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("系统不支持 inotify")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.roots = [os.path.abspath(root) for root in roots]
+        self._wds = {}
+        self._wake_r, self._wake_w = os.pipe()
+        try:
+            for root in self.roots:
+                for folder in walk_dirs(root):
+                    self._add(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, folder):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"无法监视 {folder}: {os.strerror(code)}")
+        self._wds[wd] = folder
+
+    def _add_tree(self, folder, changed):
+        """监视新出现的目录：加入监视之前可能已经写入了文件，因此整棵树都算作有变化"""
+        for sub in walk_dirs(folder):
+            try:
+                self._add(sub)
+            except OSError:
+                continue
+            changed.add(sub)
+
+    def wait(self, timeout=None):
+        try:
+            ready, _, _ = select.select([self.fd, self._wake_r], [], [], timeout)
+        except InterruptedError:
+            return set()
+        if self._wake_r in ready:
+            os.read(self._wake_r, 64)
+        if self.fd not in ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b'\0')
+                pos += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self.roots)
+                    continue
+                folder = self._wds.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    # 目录被删除或移走
+                    del self._wds[wd]
+                    continue
+                changed.add(folder)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    sub = os.path.join(folder, os.fsdecode(name))
+                    if not sub.endswith(WORK_DIR_SUFFIXES):
+                        self._add_tree(sub, changed)
+        return changed
+
+    def wake(self):
+        """让正在 wait() 的线程立即返回（可在其他线程或信号处理函数中调用）"""
+        try:
+            os.write(self._wake_w, b'x')
+        except OSError:
+            pass
+
+    def close(self):
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class PollingWatcher:
+    """
+    没有 inotify 时按间隔比较目录和其中 m3u8 的修改时间
+    （新建、删除、重命名文件会改变目录的修改时间；播放列表原地追加 #EXT-X-ENDLIST 只改变它自己的修改时间）
+    """
+
+    def __init__(self, roots, interval=POLL_INTERVAL):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.interval = interval
+        self._wake = threading.Event()
+        self._mtimes = self._snapshot()
+
+    def _snapshot(self):
+        mtimes = {}
+        for root in self.roots:
+            for folder in walk_dirs(root):
+                try:
+                    with os.scandir(folder) as entries:
+                        playlists = tuple(sorted((e.name, e.stat().st_mtime_ns) for e in entries
+                                                 if e.name.lower().endswith('.m3u8') and e.is_file()))
+                    mtimes[folder] = (os.stat(folder).st_mtime_ns, playlists)
+                except OSError:
+                    continue
+        return mtimes
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(deadline - time.time(), 0))
+            if self._wake.wait(delay):
+                self._wake.clear()
+                return set()
+            mtimes = self._snapshot()
+            changed = {folder for folder, mtime in mtimes.items() if self._mtimes.get(folder) != mtime}
+            self._mtimes = mtimes
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self):
+        pass
+
+
+def create_watcher(roots, poll=False, poll_interval=POLL_INTERVAL, log=print):
+    """优先使用 inotify，不可用时退回轮询"""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(roots)
+        except OSError as e:
+            log(f"inotify 不可用（{e}），改为每 {poll_interval} 秒轮询")
+    return PollingWatcher(roots, poll_interval)
+
+
+def playlist_state(m3u8_path):
+    """
+    返回 (状态, 签名, 最后修改时间)：状态为 'complete'（有 ENDLIST 且分片齐全）、'recording'、'missing' 或 'invalid'；
+    签名为播放列表和各本地分片的 (大小, 修改时间)
+    """
+    try:
+        st = os.stat(m3u8_path)
+        playlist = load_playlist(m3u8_path)
+    except OSError:
+        return 'invalid', None, None
+    except PlaylistError:
+        # 刚创建、还没写入内容的播放列表
+        return 'recording', None, None
+    if playlist.is_master:
+        return 'invalid', None, None
+    if not playlist.endlist:
+        return 'recording', None, st.st_mtime
+    stamps = [(st.st_size, st.st_mtime_ns)]
+    newest = st.st_mtime
+    paths = [seg.path for seg in playlist.segments]
+    if playlist.init_map:
+        paths.append(playlist.init_map.path)
+    for path in dict.fromkeys(paths):
+        if '://' in path:
+            continue
+        try:
+            seg_st = os.stat(path)
+        except OSError:
+            return 'missing', None, None
+        stamps.append((seg_st.st_size, seg_st.st_mtime_ns))
+        newest = max(newest, seg_st.st_mtime)
+    return 'complete', tuple(stamps), newest
+
+
+class WatchDaemon:
+    """
+    监视 roots 下的所有 m3u8，录制完成的交给 execute(m3u8 路径) 转换（在线程池中运行，最多 concurrency 个）
+    execute 返回 run_job 的结果字典；已转换过且内容未变化的播放列表不会再次排队
+    """
+
+    def __init__(self, roots, execute, concurrency=1, settle=DEFAULT_SETTLE_SECONDS, watcher=None, log=print):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.execute = execute
+        self.settle = settle
+        self.watcher = watcher or create_watcher(self.roots, log=log)
+        self.log = log
+        self.concurrency = max(1, concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._lock = threading.Lock()
+        self._pending = {}     # 路径 -> 上次检查时的签名（None 表示还在录制），尚未转换的播放列表
+        self._running = set()
+        self._done = {}        # 路径 -> 转换时的签名
+        self._stopping = False
+
+    def _discover(self, folder):
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.lower().endswith('.m3u8') and entry.is_file():
+                path = entry.path
+                with self._lock:
+                    self._pending.setdefault(path, None)
+
+    def _check(self, path, now):
+        """检查一个播放列表，完成时排队转换；返回下次需要检查的时间（None 表示等待目录变化）"""
+        state, signature, newest = playlist_state(path)
+        if state == 'invalid':
+            # 主播放列表或已被删除的文件不再跟踪
+            self._pending.pop(path, None)
+            return None
+        if state == 'recording':
+            self._pending[path] = None
+            return now + PENDING_RECHECK_SECONDS
+        if state == 'missing':
+            self._pending[path] = None
+            return now + self.settle
+        if self._done.get(path) == signature:
+            self._pending.pop(path, None)
+            return None
+        settled_at = newest + self.settle
+        if self._pending.get(path) != signature or now < settled_at:
+            self._pending[path] = signature
+            return max(settled_at, now + STABLE_RECHECK_SECONDS)
+        del self._pending[path]
+        self._submit(path, signature)
+        return None
+
+    def _submit(self, path, signature):
+        self._running.add(path)
+        self.log(f"录制完成，加入转换队列: {path}")
+        future = self._pool.submit(self.execute, path)
+        future.add_done_callback(lambda f: self._finished(path, signature, f))
+
+    def _finished(self, path, signature, future):
+        if future.cancelled():
+            with self._lock:
+                self._running.discard(path)
+            return
+        error = future.exception()
+        result = None if error else future.result()
+        with self._lock:
+            self._running.discard(path)
+            self._done[path] = signature
+        if error is not None:
+            self.log(f"✗ {path}: {error}")
+        elif result.get('skipped'):
+            self.log(f"- {path}: 已转换过 -> {result['output']}")
+        elif result.get('ok'):
+            self.log(f"✓ {path} -> {result['output']}（{result['wall_time']:.1f} 秒）")
+        else:
+            self.log(f"✗ {path}: {result.get('error') or '转换失败'}")
+        # 转换期间可能又有变化，唤醒主循环重新检查
+        self.watcher.wake()
+
+    def scan_all(self):
+        for root in self.roots:
+            for folder in walk_dirs(root):
+                self._discover(folder)
+
+    def check_pending(self):
+        """检查所有跟踪中的播放列表，返回最早需要再次检查的时间（None 表示没有）"""
+        now = time.time()
+        wake_at = None
+        with self._lock:
+            paths = list(self._pending)
+        for path in paths:
+            with self._lock:
+                if path in self._running:
+                    continue
+                due = self._check(path, now)
+            if due is not None:
+                wake_at = due if wake_at is None else min(wake_at, due)
+        return wake_at
+
+    def run(self, once=False):
+        """
+        持续监视直到 stop()；once=True 时只处理当前已经完成的播放列表，全部转换结束后返回
+        """
+        self.log(f"监视: {', '.join(self.roots)}（{'inotify' if isinstance(self.watcher, InotifyWatcher) else '轮询'}，"
+                 f"最多同时转换 {self.concurrency} 个）")
+        self.scan_all()
+        try:
+            while not self._stopping:
+                wake_at = self.check_pending()
+                if once:
+                    # 只等待已有 ENDLIST、正在确认稳定的播放列表
+                    with self._lock:
+                        waiting = any(sig is not None for sig in self._pending.values())
+                    if not waiting:
+                        break
+                    time.sleep(max(wake_at - time.time(), 0) if wake_at else STABLE_RECHECK_SECONDS)
+                    continue
+                timeout = None if wake_at is None else max(wake_at - time.time(), 0)
+                for folder in self.watcher.wait(timeout):
+                    self._discover(folder)
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=self._stopping)
+            self.watcher.close()
+
+    def stop(self):
+        """停止监视；已开始的转换会运行完，排队中的取消"""
+        self._stopping = True
+        self.watcher.wake()
+
+
+def main(argv=None):
+    import argparse
+
+    from conversion_history import ConversionHistory
+    from convert_m3u8_to_mp4 import run_job
+
+    parser = argparse.ArgumentParser(description="监视文件夹，自动把录制完成的 m3u8 转换为 MP4")
+    parser.add_argument('folders', nargs='+', help="要监视的投递目录（包括子目录）")
+    parser.add_argument('--output-dir', help="输出目录（默认与输入相邻）")
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help="同时转换的任务数上限（默认 1）")
+    parser.add_argument('--engine', default='auto',
+                        choices=['auto', 'ffmpeg', 'native', 'remux', 'resume', 'parallel', 'pipeline', 'pipeline-remux'],
+                        help="转换引擎（默认 auto）")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help=f"最后一次修改后等待多少秒才开始转换（默认 {DEFAULT_SETTLE_SECONDS}）")
+    parser.add_argument('--poll', action='store_true', help="不使用 inotify，按间隔轮询")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f"轮询间隔秒数（默认 {POLL_INTERVAL}）")
+    parser.add_argument('--once', action='store_true', help="只转换当前已录制完成的播放列表，然后退出")
+    parser.add_argument('--no-history', action='store_true', help="不读写转换历史记录（重启后会重复转换）")
+    parser.add_argument('--no-verify', action='store_true', help="跳过转换后的 MP4 输出校验")
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--faststart', action='store_true', help="转换后把 moov 原地移到文件开头")
+    layout.add_argument('--fragmented', action='store_true', help="输出分片 MP4")
+    args = parser.parse_args(argv)
+
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            parser.error(f"不是文件夹: {folder}")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    history = None if args.no_history else ConversionHistory()
+
+    def execute(path):
+        return run_job({'input': path}, args.engine, None, args.output_dir, history=history,
+                       verify=not args.no_verify, faststart=args.faststart, fragmented=args.fragmented)
+
+    watcher = create_watcher(args.folders, poll=args.poll, poll_interval=args.poll_interval)
+    daemon = WatchDaemon(args.folders, execute, concurrency=args.concurrency, settle=args.settle, watcher=watcher)
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.run(once=args.once)
+    finally:
+        if history:
+            history.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())